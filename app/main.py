@@ -1,31 +1,66 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.middleware.cors import CORSMiddleware
-from app.routers import playground, tools, templates, ab_test, evaluation, workflows
+# Imported first so the start-up clock runs before anything else is loaded
+from app.models.startup import startup, STARTUP_PRELOAD
+
+import asyncio
+import importlib
 import os
+from contextlib import asynccontextmanager
+
+with startup.phase("import_framework"):
+    from fastapi import FastAPI
+    from fastapi.staticfiles import StaticFiles
+    from fastapi.middleware.cors import CORSMiddleware
+
+ROUTERS = ["playground", "tools", "templates", "ab_test", "evaluation", "workflows", "metrics", "history", "conversations"]
+
+# Timed one by one so /api/startup shows which router (and what it pulls in) is slow to import
+routers = []
+for name in ROUTERS:
+    with startup.phase(f"import:app.routers.{name}"):
+        routers.append(importlib.import_module(f"app.routers.{name}"))
+
+from app.models.eval_runner import eval_runner
+from app.models.history import history
+from app.models.service import service
+from app.models.tool_runtime import tool_runtime
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with startup.phase("lifespan_startup"):
+        # Every worker process picks up queued evaluation jobs and those left by a worker that died
+        eval_runner.ensure_polling()
+    startup.ready()
+    if STARTUP_PRELOAD:
+        asyncio.get_running_loop().run_in_executor(None, startup.run_preload)
+    try:
+        yield
+    finally:
+        # Jobs first: stopping them closes their upstream calls and records them in the history
+        await eval_runner.shutdown()
+        await asyncio.gather(service.aclose(), tool_runtime.aclose())
+        await history.aclose()
+
+
+with startup.phase("app_setup"):
+    app = FastAPI(title="LLM Testing Interface", lifespan=lifespan)
+
+    # CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Routers
+    for module in routers:
+        app.include_router(module.router)
 
-app = FastAPI(title="LLM Testing Interface")
-
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Routers
-app.include_router(playground.router)
-app.include_router(tools.router)
-app.include_router(templates.router)
-app.include_router(ab_test.router)
-app.include_router(evaluation.router)
-app.include_router(workflows.router)
-
-# Static Files
-static_dir = os.path.join(os.path.dirname(__file__), "static")
-app.mount("/", StaticFiles(directory=static_dir, html=True), name="static")
+    # Static Files
+    static_dir = os.path.join(os.path.dirname(__file__), "static")
+    app.mount("/", StaticFiles(directory=static_dir, html=True), name="static")
 
 if __name__ == "__main__":
     import uvicorn
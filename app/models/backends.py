@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sys
+import time
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+import httpx
+
+# Comma-separated list of OpenAI-compatible servers (LM Studio, vLLM, ...)
+LLM_BACKEND_URLS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("LM_STUDIO_BASE_URLS", os.getenv("LM_STUDIO_BASE_URL", "http://127.0.0.1:1234/v1")).split(",")
+    if url.strip()
+]
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "200"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "50"))
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+# Generations can legitimately take minutes, so reads get a long timeout
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "600"))
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "15"))
+
+# Errors that mean the backend itself is unreachable, so another one should be tried
+FAILOVER_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+def failover_errors() -> Tuple[type, ...]:
+    """FAILOVER_ERRORS plus openai's connection error once the openai package is loaded (it is imported lazily)."""
+    openai = sys.modules.get("openai")
+    if openai is None:
+        return FAILOVER_ERRORS
+    return FAILOVER_ERRORS + (openai.APIConnectionError,)
+
+
+class Backend:
+    """
+    One OpenAI-compatible server. Its clients are created on first use, so
+    importing the app (and a worker's cold start) does not pay for the openai
+    package or TLS setup before the first request needs them.
+    """
+
+    def __init__(self, base_url: str, max_retries: int = 2):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._client = None
+        self.outstanding = 0
+        self.healthy = True
+        self.models: Set[str] = set()
+        self.model_data: List[Dict[str, Any]] = []
+        self.last_checked = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(
+                    max_connections=LLM_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+            )
+        return self._http_client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            # The OpenAI client shares this backend's connection pool
+            self._client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key="lm-studio",
+                http_client=self.http_client,
+                max_retries=self.max_retries
+            )
+        return self._client
+
+    def serves(self, model: str) -> bool:
+        # Until the first successful /models call we do not know, so assume yes
+        return not self.models or model in self.models
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "models": sorted(self.models),
+            "last_checked": self.last_checked,
+            "error": self.last_error,
+        }
+
+    async def refresh(self) -> bool:
+        try:
+            response = await self.http_client.get("/models", timeout=LLM_CONNECT_TIMEOUT)
+            response.raise_for_status()
+            self.model_data = response.json().get("data", [])
+            self.models = {m["id"] for m in self.model_data if "id" in m}
+            self.healthy = True
+            self.last_error = None
+        except Exception as e:
+            self.healthy = False
+            self.last_error = str(e)
+        self.last_checked = time.time()
+        return self.healthy
+
+    def mark_failed(self, error: Exception):
+        self.healthy = False
+        self.last_error = str(error)
+
+    async def aclose(self):
+        client, self._http_client, self._client = self._http_client, None, None
+        if client is not None:
+            await client.aclose()
+
+
+class BackendPool:
+    """
+    Routes each request to the least-loaded healthy backend that serves the model.
+    Backends are health-checked in the background; unreachable ones are skipped
+    until a check succeeds again.
+    """
+
+    def __init__(self, urls: List[str] = LLM_BACKEND_URLS, health_interval: float = LLM_HEALTH_INTERVAL):
+        # With several backends, fail over immediately instead of retrying the same host
+        retries = 2 if len(urls) == 1 else 0
+        self.backends = [Backend(url, max_retries=retries) for url in urls]
+        self.health_interval = health_interval
+        self._health_task: Optional[asyncio.Task] = None
+        self._initial_refresh: Optional[asyncio.Task] = None
+        self.refreshed_at = 0.0
+
+    @property
+    def primary(self) -> Backend:
+        return self.backends[0]
+
+    async def refresh_all(self):
+        await asyncio.gather(*(b.refresh() for b in self.backends))
+        self.refreshed_at = time.monotonic()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.refresh_all()
+
+    async def ensure_started(self):
+        if self._initial_refresh is None:
+            self._initial_refresh = asyncio.create_task(self.refresh_all())
+        await self._initial_refresh
+        if len(self.backends) > 1 and (self._health_task is None or self._health_task.done()):
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    def candidates(self, model: Optional[str], exclude: Set[Backend] = frozenset()) -> List[Backend]:
+        available = [b for b in self.backends if b not in exclude]
+        # A model no backend lists may still be loadable on demand (LM Studio JIT loading)
+        pool = [b for b in available if model is None or b.serves(model)] or available
+        healthy = [b for b in pool if b.healthy]
+        # If nothing looks healthy, still try the rest rather than failing outright
+        return sorted(healthy or pool, key=lambda b: b.outstanding)
+
+    def pick(self, model: Optional[str], exclude: Set[Backend] = frozenset()) -> Optional[Backend]:
+        candidates = self.candidates(model, exclude)
+        return candidates[0] if candidates else None
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [b.status() for b in self.backends]
+
+    async def aclose(self):
+        for task in (self._health_task, self._initial_refresh):
+            if task is not None and not task.done():
+                task.cancel()
+        self._health_task = self._initial_refresh = None
+        await asyncio.gather(*(b.aclose() for b in self.backends))
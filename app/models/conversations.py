@@ -0,0 +1,342 @@
+import asyncio
+import math
+import os
+import time
+import uuid
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.models.storage import storage
+from app.models.service import service
+
+# Context window assumed for a conversation unless it sets context_tokens
+CONVERSATION_CONTEXT_TOKENS = int(os.getenv("CONVERSATION_CONTEXT_TOKENS", "8192"))
+# Room left for the reply when a request does not set max_tokens
+CONVERSATION_RESERVE_TOKENS = int(os.getenv("CONVERSATION_RESERVE_TOKENS", "1024"))
+CONVERSATION_POLICY = os.getenv("CONVERSATION_POLICY", "truncate")
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "512"))
+# Rough tokenizer-free estimate; good enough to keep requests inside the window
+CHARS_PER_TOKEN = float(os.getenv("CONVERSATION_CHARS_PER_TOKEN", "4"))
+MESSAGE_OVERHEAD_TOKENS = 4
+
+POLICIES = ("truncate", "summarize", "error")
+TAIL_PAGE = 64
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below so it can replace the original messages as context. "
+    "Keep facts, names, decisions, open questions and the user's goals. Be concise."
+)
+
+
+class ContextBudgetError(ValueError):
+    pass
+
+
+def count_tokens(content: Any) -> int:
+    text = content if isinstance(content, str) else str(content or "")
+    return MESSAGE_OVERHEAD_TOKENS + math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def response_text(data: Dict[str, Any]) -> str:
+    """Output text of a non-streamed Responses API payload."""
+    if data.get("output_text"):
+        return data["output_text"]
+    parts = []
+    for item in data.get("output") or []:
+        for content in item.get("content") or []:
+            if content.get("type") in ("output_text", "text") and content.get("text"):
+                parts.append(content["text"])
+    return "".join(parts)
+
+
+class ConversationStore:
+    """
+    Conversations kept server-side so clients send only the new turn.
+    Every message stores its token estimate when appended, so a request's context
+    is assembled from the newest messages backwards without re-counting history,
+    and only the tail that fits the budget is read from storage.
+    """
+
+    def __init__(self):
+        self.conversations = storage.collection("conversations")
+        # One record per message, keyed "<conversation_id>:<seq>" and grouped by conversation
+        self.messages = storage.collection("conversation_messages", key="key")
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _lock(self, conversation_id: str) -> asyncio.Lock:
+        if conversation_id not in self._locks:
+            self._locks[conversation_id] = asyncio.Lock()
+        return self._locks[conversation_id]
+
+    async def _reload(self, conversation: Dict[str, Any]):
+        # Another turn may have appended since this copy was read
+        stored = await self.conversations.get(conversation["id"])
+        if stored is not None:
+            conversation.update(stored)
+
+    # CRUD
+    async def create(self, conversation: Dict[str, Any]) -> Dict[str, Any]:
+        policy = conversation.get("policy", CONVERSATION_POLICY)
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(POLICIES)}")
+        now = time.time()
+        system_prompt = conversation.get("system_prompt") or ""
+        conversation.update({
+            "id": conversation.get("id") or str(uuid.uuid4()),
+            "policy": policy,
+            "context_tokens": int(conversation.get("context_tokens") or CONVERSATION_CONTEXT_TOKENS),
+            "system_prompt": system_prompt,
+            "system_tokens": count_tokens(system_prompt) if system_prompt else 0,
+            "message_count": 0,
+            "token_total": 0,
+            "summary": None,
+            "last_response_id": None,
+            "chain_tokens": 0,
+            "created_at": now,
+            "updated_at": now,
+        })
+        return await self.conversations.upsert(conversation)
+
+    async def list(self) -> List[Dict[str, Any]]:
+        return await self.conversations.list()
+
+    async def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return await self.conversations.get(conversation_id)
+
+    async def delete(self, conversation_id: str) -> bool:
+        await self.messages.delete_group(conversation_id)
+        self._locks.pop(conversation_id, None)
+        return await self.conversations.delete(conversation_id)
+
+    async def list_messages(self, conversation_id: str, offset: int = 0, limit: int = -1) -> List[Dict[str, Any]]:
+        return await self.messages.list(group=conversation_id, offset=offset, limit=limit)
+
+    @staticmethod
+    def _key(conversation_id: str, seq: int) -> str:
+        return f"{conversation_id}:{seq:08d}"
+
+    async def _append(self, conversation: Dict[str, Any], messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Store messages after the conversation's newest one. The counters are read,
+        advanced and written in the same transaction as the messages, so workers
+        appending to one conversation at once never hand out the same seq.
+        """
+        def append() -> List[Dict[str, Any]]:
+            stored = self.conversations._get(conversation["id"]) or conversation
+            conversation["message_count"] = stored["message_count"]
+            conversation["token_total"] = stored["token_total"]
+            records = []
+            for message in messages:
+                seq = conversation["message_count"]
+                tokens = message.get("tokens") or count_tokens(message.get("content"))
+                records.append({
+                    "key": self._key(conversation["id"], seq),
+                    "seq": seq,
+                    "role": message.get("role", "user"),
+                    "content": message.get("content", ""),
+                    "tokens": tokens,
+                    "ts": time.time(),
+                })
+                conversation["message_count"] += 1
+                conversation["token_total"] += tokens
+            self.messages._put(records, conversation["id"])
+            self.conversations._put([{**stored, **self._counters(conversation)}], None)
+            return records
+
+        return await storage.atomic(append, self.conversations, self.messages)
+
+    async def _rollback(self, conversation: Dict[str, Any], records: List[Dict[str, Any]]):
+        # A turn rejected for its size is not kept, so the conversation stays usable
+        if not records:
+            return
+
+        def rollback():
+            stored = self.conversations._get(conversation["id"]) or conversation
+            for record in records:
+                self.messages._delete(record["key"])
+            counters = self._counters(stored)
+            counters["token_total"] -= sum(record["tokens"] for record in records)
+            # Seqs go back only if nothing was appended after them (by another worker); otherwise they stay a gap
+            if counters["message_count"] == records[-1]["seq"] + 1:
+                counters["message_count"] = records[0]["seq"]
+            self.conversations._put([{**stored, **counters}], None)
+            conversation.update(counters)
+
+        await storage.atomic(rollback, self.conversations, self.messages)
+
+    @staticmethod
+    def _counters(conversation: Dict[str, Any]) -> Dict[str, int]:
+        return {"message_count": conversation["message_count"], "token_total": conversation["token_total"]}
+
+    async def _tail(self, conversation: Dict[str, Any], budget: int, stop_seq: int) -> Tuple[List[Dict[str, Any]], int]:
+        """Newest messages (seq > stop_seq) whose tokens fit the budget, oldest first, plus the oldest seq left out."""
+        selected: List[Dict[str, Any]] = []
+        used = 0
+        end = conversation["message_count"]
+        while end > stop_seq + 1:
+            start = max(stop_seq + 1, end - TAIL_PAGE)
+            # By key, not position: a rolled-back turn can leave a gap in the seqs
+            page = await self.messages.between(self._key(conversation["id"], start), self._key(conversation["id"], end))
+            for message in reversed(page):
+                if used + message["tokens"] > budget:
+                    return list(reversed(selected)), message["seq"]
+                selected.append(message)
+                used += message["tokens"]
+            end = start
+        return list(reversed(selected)), -1
+
+    # Context assembly
+    def _summary_tokens(self, conversation: Dict[str, Any]) -> int:
+        # Small windows cannot spare the full default for the summary
+        return min(CONVERSATION_SUMMARY_TOKENS, conversation["context_tokens"] // 4)
+
+    def _budget(self, conversation: Dict[str, Any], max_tokens: int) -> int:
+        if max_tokens and max_tokens > 0:
+            reserve = max_tokens
+        else:
+            reserve = min(CONVERSATION_RESERVE_TOKENS, conversation["context_tokens"] // 4)
+        budget = conversation["context_tokens"] - reserve - conversation.get("system_tokens", 0)
+        if conversation["policy"] == "summarize":
+            budget -= self._summary_tokens(conversation) + MESSAGE_OVERHEAD_TOKENS
+        return budget
+
+    async def _context(self, conversation: Dict[str, Any], model: str, max_tokens: int) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        budget = self._budget(conversation, max_tokens)
+        summary = conversation.get("summary")
+        summarized_until = summary["until"] if summary else -1
+        window, first_dropped = await self._tail(conversation, budget, summarized_until)
+        if not window or window[-1]["seq"] != conversation["message_count"] - 1:
+            raise ContextBudgetError("The new message alone does not fit the context budget")
+
+        info = {"budget": budget, "dropped": 0, "summarized": False}
+        if first_dropped >= 0:
+            if conversation["policy"] == "error":
+                raise ContextBudgetError(f"Conversation exceeds its {conversation['context_tokens']}-token context window")
+            info["dropped"] = first_dropped - summarized_until
+            if conversation["policy"] == "summarize":
+                summary = await self._summarize(conversation, model, summarized_until, first_dropped)
+                info["summarized"] = True
+
+        messages: List[Dict[str, str]] = []
+        if conversation.get("system_prompt"):
+            messages.append({"role": "system", "content": conversation["system_prompt"]})
+        if summary and conversation["policy"] == "summarize":
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary['text']}"})
+        messages += [{"role": m["role"], "content": m["content"]} for m in window]
+        info["tokens"] = sum(count_tokens(m["content"]) for m in messages[:len(messages) - len(window)]) + sum(m["tokens"] for m in window)
+        info["messages"] = len(messages)
+        return messages, info
+
+    async def _summarize(self, conversation: Dict[str, Any], model: str, after_seq: int, until_seq: int) -> Dict[str, Any]:
+        """Fold messages (after_seq, until_seq] into the running summary."""
+        previous = conversation.get("summary")
+        older = await self.messages.between(self._key(conversation["id"], after_seq + 1), self._key(conversation["id"], until_seq + 1))
+        # Keep the summarization request itself inside the window, newest messages first
+        room = conversation["context_tokens"] - self._summary_tokens(conversation) - count_tokens(SUMMARY_PROMPT)
+        room -= count_tokens(previous["text"]) if previous else 0
+        lines: List[str] = []
+        for message in reversed(older):
+            if message["tokens"] > room:
+                break
+            lines.append(f"{message['role']}: {message['content']}")
+            room -= message["tokens"]
+        transcript = "\n".join(reversed(lines))
+        if previous:
+            transcript = f"Earlier summary:\n{previous['text']}\n\nLater messages:\n{transcript}"
+        response = await service.chat_completion(
+            messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+            model=model,
+            temperature=0.0,
+            max_tokens=self._summary_tokens(conversation)
+        )
+        text = response.choices[0].message.content or ""
+        summary = {"text": text, "until": until_seq, "tokens": count_tokens(text), "updated_at": time.time()}
+        conversation["summary"] = summary
+        return summary
+
+    # Turns
+    async def prepare_chat(
+        self,
+        conversation: Dict[str, Any],
+        new_messages: List[Dict[str, str]],
+        model: str,
+        max_tokens: int = -1
+    ) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        """Store the new messages and return the budgeted messages to send upstream."""
+        async with self._lock(conversation["id"]):
+            await self._reload(conversation)
+            records = await self._append(conversation, [m for m in new_messages if m.get("role") != "system"])
+            # Chat turns rebuild context here, so a Responses chain has to restart
+            conversation["last_response_id"] = None
+            try:
+                return await self._context(conversation, model, max_tokens)
+            except ContextBudgetError:
+                await self._rollback(conversation, records)
+                raise
+            finally:
+                await self._save(conversation)
+
+    async def prepare_response(
+        self,
+        conversation: Dict[str, Any],
+        input_text: str,
+        model: str,
+        max_tokens: int = -1
+    ) -> Tuple[Any, Optional[str], Dict[str, Any]]:
+        """
+        Store the new input and choose what to send to the Responses API: just the
+        input chained with previous_response_id while the backend-held context still
+        fits the budget, otherwise the budgeted history as an input message list.
+        """
+        async with self._lock(conversation["id"]):
+            await self._reload(conversation)
+            records = await self._append(conversation, [{"role": "user", "content": input_text}])
+            try:
+                previous = conversation.get("last_response_id")
+                if previous and conversation["chain_tokens"] + records[0]["tokens"] <= self._budget(conversation, max_tokens):
+                    conversation["chain_tokens"] += records[0]["tokens"]
+                    return input_text, previous, {"chained": True, "tokens": conversation["chain_tokens"]}
+                try:
+                    messages, info = await self._context(conversation, model, max_tokens)
+                except ContextBudgetError:
+                    await self._rollback(conversation, records)
+                    raise
+                conversation["last_response_id"] = None
+                conversation["chain_tokens"] = info["tokens"]
+                return messages, None, {"chained": False, **info}
+            finally:
+                await self._save(conversation)
+
+    async def restart_chain(self, conversation: Dict[str, Any], model: str, max_tokens: int = -1) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        """Drop a previous_response_id the backend no longer knows and rebuild the context instead."""
+        async with self._lock(conversation["id"]):
+            await self._reload(conversation)
+            conversation["last_response_id"] = None
+            try:
+                messages, info = await self._context(conversation, model, max_tokens)
+                conversation["chain_tokens"] = info["tokens"]
+                return messages, {"chained": False, **info}
+            finally:
+                await self._save(conversation)
+
+    async def record_reply(self, conversation: Dict[str, Any], content: str, tokens: int = 0, response_id: Optional[str] = None):
+        """Store the assistant reply; tokens is the upstream completion count when known."""
+        async with self._lock(conversation["id"]):
+            await self._reload(conversation)
+            counted = tokens + MESSAGE_OVERHEAD_TOKENS if tokens else None
+            records = await self._append(conversation, [{"role": "assistant", "content": content, "tokens": counted}])
+            if response_id:
+                conversation["last_response_id"] = response_id
+                conversation["chain_tokens"] += records[0]["tokens"]
+            await self._save(conversation)
+
+    async def _save(self, conversation: Dict[str, Any]):
+        conversation["updated_at"] = time.time()
+
+        def change(stored: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            # The counters are only moved by _append and _rollback, maybe in another worker since this copy was read
+            return {**conversation, **self._counters(stored)} if stored else conversation
+
+        conversation.update(self._counters(await self.conversations.update(conversation["id"], change)))
+
+
+conversation_store = ConversationStore()
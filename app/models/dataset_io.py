@@ -0,0 +1,120 @@
+import codecs
+import csv
+import io
+import json
+from typing import List, Dict, Any, AsyncIterator
+
+# Upload formats and the content types they are also recognised by
+FORMATS = {"jsonl": ("application/jsonl", "application/x-ndjson", "application/json-lines"), "csv": ("text/csv",)}
+
+
+class DatasetFormatError(ValueError):
+    pass
+
+
+def detect_format(filename: str = "", content_type: str = "") -> str:
+    name = (filename or "").lower()
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    for fmt, types in FORMATS.items():
+        if content_type in types:
+            return fmt
+    return "jsonl"
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream into lines (with their endings) without holding more than one chunk."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+
+    def decode(chunk: bytes, final: bool = False) -> str:
+        try:
+            return decoder.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            raise DatasetFormatError(f"File is not valid UTF-8 ({e.reason})")
+
+    tail = ""
+    async for chunk in chunks:
+        # Split on \n only: str.splitlines would also break on separators JSON allows inside strings
+        lines = (tail + decode(chunk)).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    tail += decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def iter_jsonl(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    line_no = 0
+    async for line in _lines(chunks):
+        line_no += 1
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            raise DatasetFormatError(f"Line {line_no}: invalid JSON ({e})")
+        if not isinstance(row, dict):
+            raise DatasetFormatError(f"Line {line_no}: expected a JSON object")
+        yield row
+
+
+async def iter_csv(chunks: AsyncIterator[bytes], batch_lines: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+    header: List[str] = []
+    record = ""
+    records: List[str] = []
+
+    def parse(batch: List[str]) -> List[List[str]]:
+        try:
+            return list(csv.reader(batch))
+        except csv.Error as e:
+            raise DatasetFormatError(f"Invalid CSV: {e}")
+
+    async for line in _lines(chunks):
+        record += line
+        # A quoted field can span lines; a record is complete once its quotes balance
+        if record.count('"') % 2:
+            continue
+        records.append(record)
+        record = ""
+        if len(records) >= batch_lines:
+            for values in parse(records):
+                if not header:
+                    header = values
+                elif values:
+                    yield dict(zip(header, values))
+            records = []
+    if record:
+        records.append(record)
+    for values in parse(records):
+        if not header:
+            header = values
+        elif values:
+            yield dict(zip(header, values))
+
+
+def parse_rows(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Dict[str, Any]]:
+    if fmt == "csv":
+        return iter_csv(chunks)
+    if fmt == "jsonl":
+        return iter_jsonl(chunks)
+    raise DatasetFormatError(f"Unsupported format '{fmt}', use jsonl or csv")
+
+
+def encode_jsonl(rows: List[Dict[str, Any]]) -> bytes:
+    return "".join(json.dumps(row) + "\n" for row in rows).encode("utf-8")
+
+
+def encode_csv(rows: List[Dict[str, Any]], columns: List[str], header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    if header:
+        writer.writeheader()
+    for row in rows:
+        # Nested values (e.g. chat messages) are written as JSON
+        writer.writerow({k: json.dumps(v) if isinstance(v, (dict, list)) else v for k, v in row.items()})
+    return buffer.getvalue().encode("utf-8")
@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import os
+import re
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from app.models.service import service
+from app.models.storage import DATA_DIR
+
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", os.path.join(DATA_DIR, "embeddings"))
+EMBEDDING_DEFAULT_MODEL = os.getenv("EMBEDDING_DEFAULT_MODEL", "")
+# Prediction/reference pairs scored together; their texts share embedding requests
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "128"))
+# How long a partial batch waits for more pairs before it is scored anyway
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "50"))
+# Texts sent in one /v1/embeddings request
+EMBEDDING_REQUEST_SIZE = int(os.getenv("EMBEDDING_REQUEST_SIZE", "256"))
+# Embedding requests in flight at once, across all jobs
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "2"))
+
+SEMANTIC_SIMILARITY = "semantic_similarity"
+KEY_BYTES = 16
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=KEY_BYTES).digest()
+
+
+def _model_dir(model: str) -> str:
+    name = str(model).replace("/", "__")
+    if not re.fullmatch(r"[A-Za-z0-9_.-]{1,96}", name) or name.startswith("."):
+        name = hashlib.sha1(str(model).encode("utf-8")).hexdigest()
+    return os.path.join(EMBEDDINGS_DIR, name)
+
+
+class VectorFile:
+    """One process's append-only record file: a 16-byte text hash, then the unit-length float32 vector."""
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype([("key", f"V{KEY_BYTES}"), ("vector", "<f4", (dim,))])
+        self.count = 0
+        self.vectors: Optional[np.memmap] = None
+
+    def load(self) -> List[Tuple[bytes, int]]:
+        """(key, row) for records appended since the last load; a torn record at the end is ignored."""
+        try:
+            count = os.path.getsize(self.path) // self.dtype.itemsize
+        except FileNotFoundError:
+            return []
+        if count <= self.count:
+            return []
+        self.vectors = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(count,))
+        keys = self.vectors["key"][self.count:count]
+        added = [(key.tobytes(), self.count + i) for i, key in enumerate(keys)]
+        self.count = count
+        return added
+
+
+class VectorCache:
+    """
+    Embeddings of one model, keyed by a hash of the text, in memory-mapped
+    record files under EMBEDDINGS_DIR/<model>. Each worker process appends to
+    a file of its own and reads everyone's, so a text embedded by any job in
+    any process is never sent to the model again. Vectors are stored
+    normalized, so cosine similarity is a plain dot product.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.directory = _model_dir(model)
+        self.lock = threading.Lock()
+        self.dim: Optional[int] = None
+        self.files: Dict[str, VectorFile] = {}
+        self.index: Dict[bytes, Tuple[VectorFile, int]] = {}
+
+    def _own_path(self, dim: int) -> str:
+        return os.path.join(self.directory, f"{dim}-{os.getpid()}.vec")
+
+    def refresh(self):
+        """Index records other processes (or earlier runs) appended since the last look."""
+        with self.lock:
+            if not os.path.isdir(self.directory):
+                return
+            names = [n for n in os.listdir(self.directory) if re.fullmatch(r"\d+-\d+\.vec", n)]
+            if self.dim is None and names:
+                # A model's vectors all have one size; follow the files written last
+                newest = max(names, key=lambda n: os.path.getmtime(os.path.join(self.directory, n)))
+                self.dim = int(newest.split("-")[0])
+            for name in names:
+                if int(name.split("-")[0]) != self.dim:
+                    continue
+                vector_file = self.files.get(name)
+                if vector_file is None:
+                    vector_file = self.files[name] = VectorFile(os.path.join(self.directory, name), self.dim)
+                for key, row in vector_file.load():
+                    self.index.setdefault(key, (vector_file, row))
+
+    def missing(self, keys: List[bytes]) -> List[bytes]:
+        return [k for k in keys if k not in self.index]
+
+    def add(self, keys: List[bytes], vectors: List[List[float]]):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or len(matrix) != len(keys):
+            raise ValueError("Embedding vectors do not match their texts")
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+        dim = matrix.shape[1]
+        with self.lock:
+            if dim != self.dim:
+                # The model behind this name changed; vectors of the old size cannot be compared
+                self.dim = dim
+                self.files = {}
+                self.index = {}
+            path = self._own_path(dim)
+            name = os.path.basename(path)
+            vector_file = self.files.get(name)
+            if vector_file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                vector_file = self.files[name] = VectorFile(path, dim)
+                # A file left by a crashed process that had our pid may end in a torn record
+                if os.path.exists(path):
+                    size = os.path.getsize(path)
+                    if size % vector_file.dtype.itemsize:
+                        os.truncate(path, size - size % vector_file.dtype.itemsize)
+            records = np.zeros(len(keys), dtype=vector_file.dtype)
+            records["key"] = np.frombuffer(b"".join(keys), dtype=f"V{KEY_BYTES}")
+            records["vector"] = matrix
+            with open(path, "ab") as f:
+                f.write(records.tobytes())
+            for key, row in vector_file.load():
+                self.index.setdefault(key, (vector_file, row))
+
+    def vectors(self, keys: List[bytes]) -> np.ndarray:
+        """Stacked vectors for keys that are all cached, gathered one file at a time."""
+        with self.lock:
+            matrix = np.empty((len(keys), self.dim or 0), dtype=np.float32)
+            by_file: Dict[int, Tuple[VectorFile, List[int], List[int]]] = {}
+            for position, key in enumerate(keys):
+                vector_file, row = self.index[key]
+                group = by_file.setdefault(id(vector_file), (vector_file, [], []))
+                group[1].append(position)
+                group[2].append(row)
+            for vector_file, positions, rows in by_file.values():
+                matrix[positions] = vector_file.vectors["vector"][rows]
+            return matrix
+
+
+class EmbeddingBatcher:
+    """Collects prediction/reference pairs for one model and scores them in batches."""
+
+    def __init__(self, scorer: "SimilarityScorer", model: str, user: Optional[str]):
+        self.scorer = scorer
+        self.model = model
+        self.user = user
+        self.pending: List[Tuple[str, str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def add(self, prediction: str, reference: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((prediction, reference, future))
+        if len(self.pending) >= EMBEDDING_BATCH_SIZE:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(EMBEDDING_BATCH_WAIT_MS / 1000, self.flush)
+        return future
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.pending = self.pending, []
+        # Empty now, so the scorer lets go of it; the next pair starts a new batcher
+        key = (self.model, self.user)
+        if self.scorer._batchers.get(key) is self:
+            del self.scorer._batchers[key]
+        if batch:
+            self.scorer._spawn(self.scorer._score_batch(self.model, batch, self.user))
+
+
+class SimilarityScorer:
+    """
+    The semantic_similarity evaluator: cosine similarity between embeddings of
+    the prediction and the reference. Pairs are scored in batches; a batch
+    embeds only the texts no cache file has yet (in large requests), then
+    scores every pair with one matrix operation.
+    """
+
+    def __init__(self, concurrency: int = EMBEDDING_CONCURRENCY):
+        self.concurrency = concurrency
+        self._limit: Optional[asyncio.Semaphore] = None
+        self._caches: Dict[str, VectorCache] = {}
+        self._batchers: Dict[Tuple[str, Optional[str]], EmbeddingBatcher] = {}
+        # Texts being embedded right now, so two batches never send the same one
+        self._inflight: Dict[Tuple[str, bytes], asyncio.Future] = {}
+        self._tasks: set = set()
+        self.stats = {"pairs": 0, "batches": 0, "requests": 0, "texts_embedded": 0, "cache_hits": 0}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.concurrency)
+        return self._limit
+
+    def _spawn(self, coroutine) -> asyncio.Task:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def cache(self, model: str) -> VectorCache:
+        cache = self._caches.get(model)
+        if cache is None:
+            cache = self._caches[model] = VectorCache(model)
+        return cache
+
+    async def score(self, model: str, prediction: str, reference: str, user: Optional[str] = None) -> float:
+        """Cosine similarity of the two texts' embeddings, clipped to 0-1."""
+        self.stats["pairs"] += 1
+        batcher = self._batchers.get((model, user))
+        if batcher is None:
+            batcher = self._batchers[(model, user)] = EmbeddingBatcher(self, model, user)
+        return await asyncio.shield(batcher.add(prediction, reference))
+
+    async def score_many(self, model: str, predictions: List[str], references: List[str], user: Optional[str] = None) -> List[float]:
+        if len(predictions) != len(references):
+            raise ValueError("predictions and references must have the same length")
+        return list(await asyncio.gather(*(self.score(model, p, r, user) for p, r in zip(predictions, references))))
+
+    async def prefetch(self, model: str, texts: List[str], user: Optional[str] = None):
+        """Embed texts ahead of scoring, e.g. a dataset's references in full-size requests."""
+        await self._embed(model, {text_key(t): t for t in texts if t.strip()}, user)
+
+    async def _embed(self, model: str, texts: Dict[bytes, str], user: Optional[str]):
+        """Make sure every text is in the model's cache, embedding the ones that are not."""
+        cache = self.cache(model)
+        await asyncio.to_thread(cache.refresh)
+        missing = cache.missing(list(texts))
+        self.stats["cache_hits"] += len(texts) - len(missing)
+        waiting = [self._inflight[(model, k)] for k in missing if (model, k) in self._inflight]
+        mine = [k for k in missing if (model, k) not in self._inflight]
+        if mine:
+            done = asyncio.get_running_loop().create_future()
+            for key in mine:
+                self._inflight[(model, key)] = done
+            try:
+                chunks = [mine[i:i + EMBEDDING_REQUEST_SIZE] for i in range(0, len(mine), EMBEDDING_REQUEST_SIZE)]
+                await asyncio.gather(*(self._embed_chunk(model, [(k, texts[k]) for k in chunk], user) for chunk in chunks))
+                done.set_result(None)
+            except Exception as e:
+                done.set_exception(e)
+                # Retrieved here so a failure nobody else awaited is not reported as unhandled
+                done.exception()
+                raise
+            finally:
+                for key in mine:
+                    self._inflight.pop((model, key), None)
+        if waiting:
+            await asyncio.gather(*(asyncio.shield(w) for w in set(waiting)))
+
+    async def _embed_chunk(self, model: str, items: List[Tuple[bytes, str]], user: Optional[str]):
+        async with self._semaphore():
+            self.stats["requests"] += 1
+            vectors = await service.embeddings([text for _, text in items], model, priority="batch", user=user)
+        self.stats["texts_embedded"] += len(items)
+        await asyncio.to_thread(self.cache(model).add, [key for key, _ in items], vectors)
+
+    async def _score_batch(self, model: str, batch: List[Tuple[str, str, asyncio.Future]], user: Optional[str]):
+        try:
+            self.stats["batches"] += 1
+            # An empty answer (or reference) scores 0 without asking the model
+            for prediction, reference, future in batch:
+                if not (prediction.strip() and reference.strip()) and not future.done():
+                    future.set_result(0.0)
+            batch = [b for b in batch if not b[2].done()]
+            if not batch:
+                return
+            predictions = [text_key(p) for p, _, _ in batch]
+            references = [text_key(r) for _, r, _ in batch]
+            texts = {}
+            for (prediction, reference, _), p, r in zip(batch, predictions, references):
+                texts[p] = prediction
+                texts[r] = reference
+            await self._embed(model, texts, user)
+            cache = self.cache(model)
+            similarity = np.einsum("ij,ij->i", cache.vectors(predictions), cache.vectors(references))
+            scores = np.clip(similarity, 0.0, 1.0)
+            for (_, _, future), score in zip(batch, scores):
+                if not future.done():
+                    future.set_result(float(score))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "concurrency": self.concurrency,
+            "cached": {model: len(cache.index) for model, cache in self._caches.items()},
+        }
+
+
+similarity_scorer = SimilarityScorer()
@@ -0,0 +1,436 @@
+import asyncio
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.models.eval_store import eval_store
+from app.models.embeddings import similarity_scorer, SEMANTIC_SIMILARITY, EMBEDDING_DEFAULT_MODEL, EMBEDDING_BATCH_SIZE
+from app.models.evaluators import BUILTIN_EVALUATORS, evaluate_row
+from app.models.judge import judge_runner, JudgeDefinition, JudgeError, is_judge, JUDGE_BATCH_SIZE, JUDGE_CONCURRENCY
+from app.models.service import service
+from app.models.job_queue import job_queue, LeaseLost, JOB_HEARTBEAT_INTERVAL
+
+# Upper bound on in-flight requests per model, shared by every running job
+EVAL_MODEL_CONCURRENCY = int(os.getenv("EVAL_MODEL_CONCURRENCY", "4"))
+# Minimum seconds between job record checkpoints (row results are saved individually)
+EVAL_CHECKPOINT_INTERVAL = float(os.getenv("EVAL_CHECKPOINT_INTERVAL", "2.0"))
+# Jobs one worker process runs at once; further runs wait in the shared queue for any worker
+EVAL_WORKER_JOBS = int(os.getenv("EVAL_WORKER_JOBS", "2"))
+# How often each worker looks for queued or abandoned jobs to pick up
+EVAL_POLL_INTERVAL = float(os.getenv("EVAL_POLL_INTERVAL", "2.0"))
+
+
+def row_messages(row: Dict[str, Any], system_prompt: Optional[str] = None) -> List[Dict[str, str]]:
+    if row.get("messages"):
+        return list(row["messages"])
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    prompt = row.get("input", row.get("prompt", ""))
+    messages.append({"role": "user", "content": str(prompt)})
+    return messages
+
+
+def row_reference(row: Dict[str, Any]) -> str:
+    for key in ("expected", "reference", "output"):
+        if key in row and row[key] is not None:
+            return str(row[key])
+    return ""
+
+
+def job_models(job: Dict[str, Any]) -> List[str]:
+    models = job.get("models") or ([job["model"]] if job.get("model") else [])
+    return list(dict.fromkeys(models))
+
+
+def job_embedding_model(job: Dict[str, Any]) -> Optional[str]:
+    """Embedding model for the semantic_similarity evaluator, or None if the job does not use it."""
+    if SEMANTIC_SIMILARITY not in (job.get("evaluators") or []):
+        return None
+    model = job.get("embedding_model") or EMBEDDING_DEFAULT_MODEL
+    if not model:
+        raise ValueError("semantic_similarity needs the job's 'embedding_model' (or set EMBEDDING_DEFAULT_MODEL)")
+    return model
+
+
+def job_user(job: Dict[str, Any]) -> str:
+    # Jobs share batch capacity fairly; a user field groups one person's jobs
+    return job.get("user") or f"job:{job['id']}"
+
+
+class EvalRunner:
+    """
+    Runs evaluation jobs claimed from the shared job queue. Any worker process can
+    accept a run (it is queued in the store) and the first one with a free slot
+    claims it; progress and cancellation go through the job's lease, so every
+    worker can report on or stop a job wherever it runs.
+    """
+
+    def __init__(self, model_concurrency: int = EVAL_MODEL_CONCURRENCY, max_jobs: int = EVAL_WORKER_JOBS):
+        self.model_concurrency = model_concurrency
+        self.max_jobs = max_jobs
+        self._model_limits: Dict[str, asyncio.Semaphore] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._progress: Dict[str, Dict[str, Any]] = {}
+        # Jobs whose lease passed to another worker; their local run stops without recording a state
+        self._lost: set = set()
+        # Jobs this worker stopped because it is shutting down; they go back to the queue
+        self._released: set = set()
+        # Heartbeats of running jobs
+        self._helpers: set = set()
+        self._poller: Optional[asyncio.Task] = None
+
+    def _limit_for(self, model: str) -> asyncio.Semaphore:
+        if model not in self._model_limits:
+            self._model_limits[model] = asyncio.Semaphore(self.model_concurrency)
+        return self._model_limits[model]
+
+    def is_running(self, job_id: str) -> bool:
+        """Whether this worker process is running the job."""
+        task = self._tasks.get(job_id)
+        return task is not None and not task.done()
+
+    def _spawn(self, coroutine) -> asyncio.Task:
+        # Held here: the loop keeps only weak references, and a collected heartbeat would let the lease lapse
+        task = asyncio.ensure_future(coroutine)
+        self._helpers.add(task)
+        task.add_done_callback(self._helpers.discard)
+        return task
+
+    def _running_count(self) -> int:
+        return sum(1 for task in self._tasks.values() if not task.done())
+
+    async def is_active(self, job_id: str) -> bool:
+        """Whether the job is queued or running in any worker."""
+        if self.is_running(job_id):
+            return True
+        lease = await job_queue.get(job_id)
+        return bool(lease) and (lease.get("state") == "queued" or job_queue.live(lease))
+
+    async def get_progress(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Live progress from this worker, or as last published by the worker running the job."""
+        if job_id in self._progress and self.is_running(job_id):
+            return self._progress[job_id]
+        lease = await job_queue.get(job_id)
+        if lease is None:
+            return self._progress.get(job_id)
+        status = lease["state"] if lease["state"] != "running" or job_queue.live(lease) else "stalled"
+        return {**lease.get("progress", {}), "status": status, "worker": lease.get("owner")}
+
+    async def _prepare(self, job_id: str) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, JudgeDefinition]]:
+        job = await eval_store.get_job(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        dataset = await eval_store.get_dataset(job.get("dataset_id", ""))
+        if dataset is None:
+            raise ValueError("Dataset not found for job")
+        if not job_models(job):
+            raise ValueError("Job must specify 'model' or 'models'")
+        job_embedding_model(job)
+        return job, dataset, await self._judges(job)
+
+    async def start(self, job_id: str, restart: bool = False) -> Dict[str, Any]:
+        if self.is_running(job_id):
+            raise RuntimeError("Job is already running")
+        await self._prepare(job_id)
+        await job_queue.enqueue(job_id, restart=restart)
+        self.ensure_polling()
+        await self._claim(job_id)
+        return await self.get_progress(job_id)
+
+    async def _claim(self, job_id: str) -> bool:
+        """Run a queued job here if this worker has a free slot and wins the lease."""
+        if self._running_count() >= self.max_jobs or self.is_running(job_id):
+            return False
+        lease = await job_queue.claim(job_id)
+        if lease is None:
+            return False
+        progress = {"status": "running", "total": 0, "completed": 0, "failed": 0, "worker": job_queue.worker_id}
+        self._progress[job_id] = progress
+        try:
+            job, dataset, judges = await self._prepare(job_id)
+            if lease.get("restart"):
+                await eval_store.clear_job_results(job_id)
+                await job_queue.restarted(job_id)
+        except Exception as e:
+            # Validated when it was queued, but the job or its dataset changed since
+            print(f"Evaluation job {job_id} failed to start: {e}")
+            progress.update({"status": "failed", "error": str(e)})
+            job = await eval_store.get_job(job_id)
+            if job is not None:
+                job.update({"status": "failed", "error": str(e),
+                            "progress": {k: progress[k] for k in ("total", "completed", "failed")}})
+                await eval_store.save_job(job)
+            await job_queue.finish(job_id, "failed", progress)
+            return False
+        self._lost.discard(job_id)
+        self._released.discard(job_id)
+        task = asyncio.create_task(self._run(job, dataset, judges))
+        self._tasks[job_id] = task
+        heartbeat = self._spawn(self._heartbeat(job_id, task))
+        # Stops with the job, even mid-renewal
+        task.add_done_callback(lambda _: heartbeat.cancel())
+        return True
+
+    async def _heartbeat(self, job_id: str, task: asyncio.Task):
+        """Keep the lease alive and publish progress while the job runs; act on cancel requests."""
+        while not task.done():
+            await asyncio.wait({task}, timeout=JOB_HEARTBEAT_INTERVAL)
+            if task.done():
+                break
+            try:
+                lease = await job_queue.heartbeat(job_id, self._progress[job_id])
+            except LeaseLost:
+                print(f"Evaluation job {job_id}: lease taken over by another worker, stopping here")
+                self._lost.add(job_id)
+                task.cancel()
+                break
+            except Exception as e:
+                print(f"Evaluation job {job_id}: heartbeat failed: {e}")
+                continue
+            if lease.get("cancel"):
+                task.cancel()
+
+    def ensure_polling(self):
+        """Start looking for queued and abandoned jobs (once per worker process)."""
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll_loop())
+
+    async def shutdown(self):
+        """Stop polling and hand the jobs running here back to the queue, with their finished rows saved."""
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        running = [(job_id, task) for job_id, task in self._tasks.items() if not task.done()]
+        for job_id, task in running:
+            self._released.add(job_id)
+            task.cancel()
+        await asyncio.gather(*(task for _, task in running), return_exceptions=True)
+        await asyncio.gather(*self._helpers, return_exceptions=True)
+
+    async def _poll_loop(self):
+        while True:
+            try:
+                if self._running_count() < self.max_jobs:
+                    for job_id in await job_queue.claimable():
+                        if not await self._claim(job_id) and self._running_count() >= self.max_jobs:
+                            break
+            except Exception as e:
+                print(f"Evaluation job poll failed: {e}")
+            await asyncio.sleep(EVAL_POLL_INTERVAL)
+
+    async def _judges(self, job: Dict[str, Any]) -> Dict[str, JudgeDefinition]:
+        """Compile the custom judge evaluators a job names (by id or name); anything else unknown is rejected."""
+        custom: Dict[str, Dict[str, Any]] = {}
+        for evaluator in await eval_store.list_evaluators():
+            custom[str(evaluator.get("id"))] = evaluator
+            custom.setdefault(str(evaluator.get("name")), evaluator)
+        judges: Dict[str, JudgeDefinition] = {}
+        unknown = []
+        for name in job.get("evaluators", []):
+            if name in BUILTIN_EVALUATORS or name == SEMANTIC_SIMILARITY:
+                continue
+            evaluator = custom.get(name)
+            if evaluator is None or not is_judge(evaluator):
+                unknown.append(name)
+                continue
+            try:
+                judges[name] = JudgeDefinition(evaluator)
+            except JudgeError as e:
+                raise ValueError(str(e))
+        if unknown:
+            raise ValueError(f"Unknown evaluators: {', '.join(unknown)}")
+        return judges
+
+    async def cancel(self, job_id: str) -> bool:
+        task = self._tasks.get(job_id)
+        if task is None or task.done():
+            # Running in another worker (it sees the request at its next heartbeat) or still queued
+            return await job_queue.request_cancel(job_id)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    async def _run(self, job: Dict[str, Any], dataset: Dict[str, Any], judges: Dict[str, JudgeDefinition]):
+        job_id = job["id"]
+        row_count = dataset.get("row_count", 0)
+        models = job_models(job)
+        evaluator_names = [e for e in job.get("evaluators") or BUILTIN_EVALUATORS if e in BUILTIN_EVALUATORS]
+        embedding_model = job_embedding_model(job)
+
+        # Resume: rows that already scored successfully are not sent again
+        await eval_store.ensure_result_columns(job_id, verify=True)
+        done = await eval_store.columns.done_keys(job_id)
+
+        progress = self._progress[job_id]
+        progress.update({
+            "total": row_count * len(models),
+            "completed": len(done),
+            "failed": 0,
+            "resumed_from": len(done),
+        })
+
+        worker_count = max(1, self.model_concurrency * len(models))
+        if judges:
+            # Rows waiting on a judge hold a worker but no generation slot; enough of them
+            # keep the model busy while the judge fills whole batches
+            worker_count += JUDGE_BATCH_SIZE * JUDGE_CONCURRENCY
+        if embedding_model:
+            # Same for rows waiting on a batch of embeddings
+            worker_count += EMBEDDING_BATCH_SIZE
+        # Rows are read one segment at a time; the bounded queue keeps the reader just ahead of the workers
+        pending: asyncio.Queue = asyncio.Queue(maxsize=worker_count * 2)
+        last_checkpoint = 0.0
+
+        async def feed():
+            async for start, rows in eval_store.iter_dataset_segments(dataset["id"]):
+                for model in models:
+                    for offset, row in enumerate(rows):
+                        if (start + offset, model) not in done:
+                            await pending.put((start + offset, row, model))
+            for _ in range(worker_count):
+                await pending.put(None)
+
+        async def prefetch_references():
+            # References are embedded up front in full requests; rows then only wait on their prediction
+            try:
+                async for start, rows in eval_store.iter_dataset_segments(dataset["id"]):
+                    references = [row_reference(row) for offset, row in enumerate(rows)
+                                  if any((start + offset, model) not in done for model in models)]
+                    await similarity_scorer.prefetch(embedding_model, references, user=job_user(job))
+            except Exception as e:
+                print(f"Reference embedding for job {job_id} failed: {e}")
+
+        async def checkpoint(status: str, force: bool = False):
+            nonlocal last_checkpoint
+            now = time.monotonic()
+            if not force and now - last_checkpoint < EVAL_CHECKPOINT_INTERVAL:
+                return
+            last_checkpoint = now
+            await eval_store.flush_job_results(job_id)
+            progress["status"] = status
+            job["status"] = status
+            job["progress"] = {k: progress[k] for k in ("total", "completed", "failed")}
+            await eval_store.save_job(job)
+
+        async def worker():
+            while True:
+                unit = await pending.get()
+                if unit is None:
+                    return
+                row_index, row, model = unit
+                result = await self._evaluate_row(job, row, row_index, model, evaluator_names, judges, embedding_model)
+                await eval_store.append_job_result(job_id, result)
+                if "error" in result:
+                    progress["failed"] += 1
+                else:
+                    progress["completed"] += 1
+                await checkpoint("running")
+
+        job["started_at"] = job.get("started_at") or time.time()
+        await checkpoint("running", force=True)
+        try:
+            tasks = [asyncio.ensure_future(feed())] + [asyncio.ensure_future(worker()) for _ in range(worker_count)]
+            prefetch = asyncio.ensure_future(prefetch_references()) if embedding_model else None
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                # A failed reader or worker must not leave the others blocked on the queue
+                helpers = tasks + ([prefetch] if prefetch else [])
+                for task in helpers:
+                    task.cancel()
+                await asyncio.gather(*helpers, return_exceptions=True)
+            await eval_store.flush_job_results(job_id)
+            job["summary"] = summarize_results(await eval_store.columns.aggregate(job_id, percentiles=(), samples=0))
+            job["finished_at"] = time.time()
+            await checkpoint("completed", force=True)
+        except asyncio.CancelledError:
+            if job_id in self._released:
+                # Another worker claims it from the queue and resumes after the saved rows
+                await eval_store.flush_job_results(job_id)
+                progress["status"] = "queued"
+                await job_queue.release(job_id, progress)
+            elif job_id not in self._lost:
+                await checkpoint("cancelled", force=True)
+            raise
+        except Exception as e:
+            print(f"Evaluation job {job_id} failed: {e}")
+            job["error"] = str(e)
+            await checkpoint("failed", force=True)
+        finally:
+            if job_id not in self._lost and job_id not in self._released:
+                await job_queue.finish(job_id, progress["status"], progress)
+
+    async def _evaluate_row(
+        self,
+        job: Dict[str, Any],
+        row: Dict[str, Any],
+        row_index: int,
+        model: str,
+        evaluator_names: List[str],
+        judges: Optional[Dict[str, JudgeDefinition]] = None,
+        embedding_model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        reference = row_reference(row)
+        result: Dict[str, Any] = {"row_index": row_index, "model": model, "reference": reference}
+        start = time.perf_counter()
+        try:
+            async with self._limit_for(model):
+                response = await service.chat_completion(
+                    messages=row_messages(row, job.get("system_prompt")),
+                    model=model,
+                    temperature=job.get("temperature", 0.0),
+                    max_tokens=job.get("max_tokens", -1),
+                    priority="batch",
+                    user=job_user(job)
+                )
+            prediction = response.choices[0].message.content or ""
+        except Exception as e:
+            result["error"] = str(e)
+            result["latency_ms"] = (time.perf_counter() - start) * 1000
+            return result
+
+        result["prediction"] = prediction
+        result["latency_ms"] = (time.perf_counter() - start) * 1000
+        scores = evaluate_row(prediction, reference, evaluator_names)
+        # Embedded while the judges deliberate
+        similarity = asyncio.ensure_future(
+            similarity_scorer.score(embedding_model, prediction, reference, user=job_user(job))
+        ) if embedding_model else None
+        if judges:
+            verdicts = await asyncio.gather(
+                *(judge_runner.judge(judge, prediction, reference, row, user=job_user(job)) for judge in judges.values()),
+                return_exceptions=True
+            )
+            for name, verdict in zip(judges, verdicts):
+                if isinstance(verdict, Exception):
+                    result.setdefault("judge_errors", {})[name] = str(verdict)
+                elif verdict is None:
+                    result.setdefault("judge_errors", {})[name] = "Judge reply had no readable score"
+                else:
+                    scores[name] = verdict["score"]
+        if similarity is not None:
+            try:
+                scores[SEMANTIC_SIMILARITY] = await similarity
+            except Exception as e:
+                result.setdefault("judge_errors", {})[SEMANTIC_SIMILARITY] = str(e)
+        result["scores"] = scores
+        return result
+
+
+def summarize_results(aggregate: Dict[str, Any]) -> Dict[str, Any]:
+    """Mean score per model and evaluator over successfully scored rows, from a column aggregate."""
+    return {
+        model: {
+            "rows": stats["rows"] - stats["errors"],
+            "errors": stats["errors"],
+            "mean_scores": {name: metric["mean"] for name, metric in stats["metrics"].items() if metric["count"]},
+        }
+        for model, stats in aggregate["models"].items()
+    }
+
+
+eval_runner = EvalRunner()
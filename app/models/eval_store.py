@@ -1,86 +1,208 @@
-import json
 import os
-from typing import List, Dict, Any, Optional
-import aiofiles
+from typing import List, Dict, Any, Optional, AsyncIterator, Iterable, Tuple
 import uuid
+from app.models.storage import storage, DATA_DIR
+from app.models.result_columns import result_columns
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+# Pre-database JSON files, imported into their collections on first use
 DATASETS_FILE = os.path.join(DATA_DIR, "datasets.json")
 EVALUATORS_FILE = os.path.join(DATA_DIR, "evaluators.json")
 JOBS_FILE = os.path.join(DATA_DIR, "eval_jobs.json")
 
-class EvalStore:
-    def __init__(self):
-        self._ensure_data_dir()
+# Dataset rows are stored in segments of this many rows, separately from the dataset record
+DATASET_CHUNK_ROWS = int(os.getenv("DATASET_CHUNK_ROWS", "1000"))
+# Inline row fields accepted on the dataset body (and found in legacy records)
+ROW_FIELDS = ("rows", "items")
+
+async def _aiter(items: Iterable[Any]) -> AsyncIterator[Any]:
+    for item in items:
+        yield item
 
-    def _ensure_data_dir(self):
-        os.makedirs(DATA_DIR, exist_ok=True)
-        for fpath in [DATASETS_FILE, EVALUATORS_FILE, JOBS_FILE]:
-            if not os.path.exists(fpath):
-                with open(fpath, 'w') as f:
-                    json.dump([], f)
+def _rows_group(dataset: Dict[str, Any]) -> str:
+    # Datasets ingested before row generations existed keep their rows under the dataset id
+    return dataset.get("rows_group") or dataset["id"]
 
-    async def _load(self, filepath: str) -> List[Dict[str, Any]]:
-        async with aiofiles.open(filepath, 'r') as f:
-            return json.loads(await f.read())
+class EvalStore:
+    def __init__(self):
+        self.datasets = storage.collection("datasets", legacy_file=DATASETS_FILE)
+        # Row segments, keyed "<rows_group>:<segment>" and grouped by the dataset's current rows_group
+        self.dataset_rows = storage.collection("dataset_rows", key="key")
+        self.evaluators = storage.collection("evaluators", legacy_file=EVALUATORS_FILE)
+        self.jobs = storage.collection("eval_jobs", legacy_file=JOBS_FILE)
+        # One row per (job, dataset row, model), grouped by job id; scores are also
+        # kept column-wise in result_columns for aggregation
+        self.results = storage.collection("eval_results", key="key")
+        self.columns = result_columns
 
-    async def _save(self, filepath: str, data: List[Dict[str, Any]]):
-        async with aiofiles.open(filepath, 'w') as f:
-            await f.write(json.dumps(data, indent=2))
+    async def _save(self, collection, item: Dict[str, Any]) -> Dict[str, Any]:
+        if "id" not in item:
+            item["id"] = str(uuid.uuid4())
+        return await collection.upsert(item)
 
-    # Datasets
+    # Datasets (records hold metadata only; rows live in dataset_rows)
     async def list_datasets(self) -> List[Dict[str, Any]]:
-        return await self._load(DATASETS_FILE)
+        return [await self._migrate_inline_rows(d) for d in await self.datasets.list()]
 
     async def save_dataset(self, dataset: Dict[str, Any]) -> Dict[str, Any]:
-        items = await self.list_datasets()
+        rows = None
+        for field in ROW_FIELDS:
+            if field in dataset:
+                rows = rows if rows is not None else dataset[field]
+                del dataset[field]
+        if "id" not in dataset:
+            dataset["id"] = str(uuid.uuid4())
+        if rows is None:
+            # Metadata-only update keeps the stored row stats
+            existing = await self.datasets.get(dataset["id"]) or {}
+            dataset = {**{k: v for k, v in existing.items() if k not in ROW_FIELDS}, **dataset}
+            dataset.setdefault("row_count", 0)
+            return await self.datasets.upsert(dataset)
+        return await self.ingest_dataset(dataset, _aiter(rows))
+
+    async def ingest_dataset(self, dataset: Dict[str, Any], rows: AsyncIterator[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Write rows as they arrive, one segment at a time, then save the dataset record.
+        A re-upload writes to a new row group and the record moves to it only once every
+        row is in, so a failed upload leaves the previous rows in place.
+        """
         if "id" not in dataset:
             dataset["id"] = str(uuid.uuid4())
-        
-        idx = next((i for i, x in enumerate(items) if x["id"] == dataset["id"]), -1)
-        if idx >= 0:
-            items[idx] = dataset
-        else:
-            items.append(dataset)
-        await self._save(DATASETS_FILE, items)
+        dataset_id = dataset["id"]
+        group = f"{dataset_id}:{uuid.uuid4().hex[:12]}"
+        chunk: List[Dict[str, Any]] = []
+        columns: Dict[str, None] = {}
+        count = segments = 0
+
+        async def flush():
+            nonlocal segments
+            await self.dataset_rows.upsert(
+                {"key": f"{group}:{segments:08d}", "start": count - len(chunk), "rows": chunk},
+                group=group
+            )
+            segments += 1
+
+        try:
+            async for row in rows:
+                chunk.append(row)
+                count += 1
+                columns.update(dict.fromkeys(row))
+                if len(chunk) >= DATASET_CHUNK_ROWS:
+                    await flush()
+                    chunk = []
+            if chunk:
+                await flush()
+        except BaseException:
+            await self.dataset_rows.delete_group(group)
+            raise
+
+        dataset.update({"row_count": count, "columns": list(columns), "segments": segments, "chunk_rows": DATASET_CHUNK_ROWS,
+                        "rows_group": group})
+        replaced: List[str] = []
+
+        def change(stored: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            # Read in the same transaction as the switch, so concurrent uploads each free the group they replaced
+            replaced[:] = [_rows_group(stored)] if stored else []
+            return dataset
+
+        await self.datasets.update(dataset_id, change)
+        for old in replaced:
+            await self.dataset_rows.delete_group(old)
+        return dataset
+
+    async def _migrate_inline_rows(self, dataset: Dict[str, Any]) -> Dict[str, Any]:
+        # Records saved before row segments existed carry their rows inline
+        if any(field in dataset for field in ROW_FIELDS):
+            return await self.save_dataset(dataset)
         return dataset
 
+    async def get_dataset(self, dataset_id: str) -> Optional[Dict[str, Any]]:
+        dataset = await self.datasets.get(dataset_id)
+        return await self._migrate_inline_rows(dataset) if dataset else None
+
+    async def get_dataset_rows(self, dataset_id: str, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Rows [offset, offset + limit), reading only the segments that cover them."""
+        dataset = await self.get_dataset(dataset_id)
+        if dataset is None:
+            return []
+        chunk_rows = dataset.get("chunk_rows", DATASET_CHUNK_ROWS)
+        if limit < 0:
+            limit = dataset.get("row_count", 0) - offset
+        if limit <= 0 or offset >= dataset.get("row_count", 0):
+            return []
+        first = offset // chunk_rows
+        last = (offset + limit - 1) // chunk_rows
+        # Segments are written in order, so insertion order is segment order
+        segments = await self.dataset_rows.list(group=_rows_group(dataset), offset=first, limit=last - first + 1)
+        rows = [row for segment in segments for row in segment["rows"]]
+        skip = offset - first * chunk_rows
+        return rows[skip:skip + limit]
+
+    async def iter_dataset_segments(self, dataset_id: str, start_segment: int = 0) -> AsyncIterator[Tuple[int, List[Dict[str, Any]]]]:
+        """Yield (index of first row, rows) per segment, holding one segment in memory at a time."""
+        dataset = await self.get_dataset(dataset_id)
+        if dataset is None:
+            return
+        group = _rows_group(dataset)
+        # Segments are written in order, so insertion order is segment order; each read
+        # continues from the previous segment's cursor
+        page = await self.dataset_rows.page(group, limit=1, offset=start_segment)
+        while page:
+            cursor, segment = page[0]
+            yield segment["start"], segment["rows"]
+            page = await self.dataset_rows.page(group, after=cursor, limit=1)
+
+    async def delete_dataset(self, dataset_id: str) -> bool:
+        dataset = await self.datasets.get(dataset_id)
+        if dataset is not None:
+            await self.dataset_rows.delete_group(_rows_group(dataset))
+        return await self.datasets.delete(dataset_id)
+
     # Evaluators
     async def list_evaluators(self) -> List[Dict[str, Any]]:
-        return await self._load(EVALUATORS_FILE)
+        return await self.evaluators.list()
 
     async def save_evaluator(self, evaluator: Dict[str, Any]) -> Dict[str, Any]:
-        items = await self.list_evaluators()
-        if "id" not in evaluator:
-            evaluator["id"] = str(uuid.uuid4())
-            
-        idx = next((i for i, x in enumerate(items) if x["id"] == evaluator["id"]), -1)
-        if idx >= 0:
-            items[idx] = evaluator
-        else:
-            items.append(evaluator)
-        await self._save(EVALUATORS_FILE, items)
-        return evaluator
+        return await self._save(self.evaluators, evaluator)
 
     # Jobs
     async def list_jobs(self) -> List[Dict[str, Any]]:
-        return await self._load(JOBS_FILE)
+        return await self.jobs.list()
 
     async def save_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
-        items = await self.list_jobs()
-        if "id" not in job:
-            job["id"] = str(uuid.uuid4())
-            
-        idx = next((i for i, x in enumerate(items) if x["id"] == job["id"]), -1)
-        if idx >= 0:
-            items[idx] = job
-        else:
-            items.append(job)
-        await self._save(JOBS_FILE, items)
-        return job
+        return await self._save(self.jobs, job)
 
     async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
-        jobs = await self.list_jobs()
-        return next((j for j in jobs if j["id"] == job_id), None)
+        return await self.jobs.get(job_id)
+
+    # Job results (one record per scored row, written as rows complete)
+    async def list_job_results(self, job_id: str) -> List[Dict[str, Any]]:
+        return await self.results.list(group=job_id)
+
+    async def append_job_result(self, job_id: str, result: Dict[str, Any]):
+        # Keyed by row and model so a retried row replaces its failed attempt
+        result["key"] = f"{job_id}:{result.get('row_index')}:{result.get('model')}"
+        await self.results.upsert(result, group=job_id)
+        await self.columns.append(job_id, result)
+
+    async def flush_job_results(self, job_id: str):
+        await self.columns.flush(job_id)
+
+    async def ensure_result_columns(self, job_id: str, verify: bool = False):
+        """
+        Build a job's columns from its row records when they are missing (jobs run
+        before columns existed) or, with verify, when they disagree with the records
+        (rows buffered at a crash). Verify only while the job is not running.
+        """
+        stored = await self.results.count(group=job_id)
+        if self.columns.exists(job_id):
+            if not verify or (await self.columns.load(job_id))["columns"]["row_index"].size == stored:
+                return
+        elif not stored:
+            return
+        await self.columns.rebuild(job_id, await self.results.list(group=job_id))
+
+    async def clear_job_results(self, job_id: str):
+        await self.results.delete_group(job_id)
+        await self.columns.delete(job_id)
 
 eval_store = EvalStore()
@@ -1,4 +1,38 @@
-from typing import Any, Dict
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+BLEU_MAX_ORDER = 4
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def ngram_counts(tokens: Sequence[str], n: int) -> Counter:
+    if n == 1:
+        return Counter(tokens)
+    return Counter(zip(*(tokens[i:] for i in range(n))))
+
+
+def lcs_length(a: Sequence[str], b: Sequence[str]) -> int:
+    """Longest common subsequence length using the bit-parallel (Allison-Dix) recurrence."""
+    if not a or not b:
+        return 0
+    masks: Dict[str, int] = {}
+    for i, token in enumerate(a):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    v = full
+    for token in b:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(a) - bin(v).count("1")
+
 
 def exact_match(prediction: str, reference: str) -> float:
     return 1.0 if prediction.strip() == reference.strip() else 0.0
@@ -9,12 +43,150 @@ def contains_match(prediction: str, reference: str) -> float:
 def length_ratio(prediction: str, reference: str) -> float:
     len_pred = len(prediction)
     len_ref = len(reference)
-    if len_ref == 0:
+    if len_ref == 0 or len_pred == 0:
         return 0.0
     return min(len_pred / len_ref, len_ref / len_pred)
 
+def bleu(prediction: str, reference: str) -> float:
+    return float(TokenizedBatch([prediction], [reference]).bleu()[0])
+
+def rouge_l(prediction: str, reference: str) -> float:
+    return float(TokenizedBatch([prediction], [reference]).rouge_l()[0])
+
+def token_f1(prediction: str, reference: str) -> float:
+    return float(TokenizedBatch([prediction], [reference]).token_f1()[0])
+
 BUILTIN_EVALUATORS = {
     "exact_match": exact_match,
     "contains_match": contains_match,
-    "length_ratio": length_ratio
+    "length_ratio": length_ratio,
+    "bleu": bleu,
+    "rouge_l": rouge_l,
+    "token_f1": token_f1
 }
+
+
+class TokenizedBatch:
+    """
+    A column of predictions and references, tokenized once.
+    N-gram statistics are computed lazily and shared by every metric that needs them,
+    and per-row counts are kept as NumPy arrays so scoring is vectorized.
+    """
+
+    def __init__(self, predictions: Sequence[str], references: Sequence[str]):
+        if len(predictions) != len(references):
+            raise ValueError("predictions and references must have the same length")
+        self.predictions = [p or "" for p in predictions]
+        self.references = [r or "" for r in references]
+        self.pred_tokens = [tokenize(p) for p in self.predictions]
+        self.ref_tokens = [tokenize(r) for r in self.references]
+        self.pred_len = np.fromiter((len(t) for t in self.pred_tokens), dtype=np.float64, count=len(self))
+        self.ref_len = np.fromiter((len(t) for t in self.ref_tokens), dtype=np.float64, count=len(self))
+        self._ngram_stats: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return len(self.predictions)
+
+    def ngram_stats(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(matches, totals), each shaped (rows, BLEU_MAX_ORDER): clipped n-gram overlaps and prediction n-gram counts."""
+        if self._ngram_stats is None:
+            matches = np.zeros((len(self), BLEU_MAX_ORDER))
+            for row, (pred, ref) in enumerate(zip(self.pred_tokens, self.ref_tokens)):
+                for n in range(1, BLEU_MAX_ORDER + 1):
+                    if len(pred) < n or len(ref) < n:
+                        break
+                    overlap = ngram_counts(pred, n) & ngram_counts(ref, n)
+                    matches[row, n - 1] = sum(overlap.values())
+            orders = np.arange(1, BLEU_MAX_ORDER + 1)
+            totals = np.maximum(self.pred_len[:, None] - orders[None, :] + 1, 0)
+            self._ngram_stats = (matches, totals)
+        return self._ngram_stats
+
+    def exact_match(self) -> np.ndarray:
+        return np.fromiter((p.strip() == r.strip() for p, r in zip(self.predictions, self.references)),
+                           dtype=np.float64, count=len(self))
+
+    def contains_match(self) -> np.ndarray:
+        return np.fromiter((r.strip().lower() in p.strip().lower() for p, r in zip(self.predictions, self.references)),
+                           dtype=np.float64, count=len(self))
+
+    def length_ratio(self) -> np.ndarray:
+        pred = np.fromiter((len(p) for p in self.predictions), dtype=np.float64, count=len(self))
+        ref = np.fromiter((len(r) for r in self.references), dtype=np.float64, count=len(self))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.minimum(pred / ref, ref / pred)
+        return np.where((pred > 0) & (ref > 0), ratio, 0.0)
+
+    def bleu(self) -> np.ndarray:
+        """Sentence BLEU-4 with add-one smoothing for n > 1."""
+        matches, totals = self.ngram_stats()
+        smoothing = np.zeros(BLEU_MAX_ORDER)
+        smoothing[1:] = 1.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precisions = (matches + smoothing) / (totals + smoothing)
+            log_precision = np.log(precisions).mean(axis=1)
+            brevity = np.minimum(0.0, 1.0 - self.ref_len / self.pred_len)
+        scores = np.exp(log_precision + brevity)
+        # No unigram overlap (or an empty side) scores zero
+        return np.where((matches[:, 0] > 0) & (self.pred_len > 0), scores, 0.0)
+
+    def corpus_bleu(self) -> float:
+        matches, totals = self.ngram_stats()
+        match_sum = matches.sum(axis=0)
+        total_sum = totals.sum(axis=0)
+        if np.any(match_sum == 0):
+            return 0.0
+        log_precision = np.log(match_sum / total_sum).mean()
+        pred_len, ref_len = self.pred_len.sum(), self.ref_len.sum()
+        brevity = min(0.0, 1.0 - ref_len / pred_len) if pred_len else -math.inf
+        return float(math.exp(log_precision + brevity))
+
+    def token_f1(self) -> np.ndarray:
+        matches, _ = self.ngram_stats()
+        common = matches[:, 0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = common / self.pred_len
+            recall = common / self.ref_len
+            f1 = 2 * precision * recall / (precision + recall)
+        both_empty = (self.pred_len == 0) & (self.ref_len == 0)
+        return np.where(both_empty, 1.0, np.where(common > 0, f1, 0.0))
+
+    def rouge_l(self) -> np.ndarray:
+        lcs = np.fromiter((lcs_length(r, p) for p, r in zip(self.pred_tokens, self.ref_tokens)),
+                          dtype=np.float64, count=len(self))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = lcs / self.pred_len
+            recall = lcs / self.ref_len
+            f1 = 2 * precision * recall / (precision + recall)
+        return np.where(lcs > 0, f1, 0.0)
+
+
+BATCH_METRICS = ["exact_match", "contains_match", "length_ratio", "bleu", "rouge_l", "token_f1"]
+
+
+def evaluate_row(prediction: str, reference: str, metrics: Sequence[str]) -> Dict[str, float]:
+    """Scores of one row for the given metrics, with the row tokenized once for all of them."""
+    batch = TokenizedBatch([prediction], [reference])
+    return {metric: float(getattr(batch, metric)()[0]) for metric in metrics}
+
+
+def evaluate_batch(
+    predictions: Sequence[str],
+    references: Sequence[str],
+    metrics: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Score whole columns at once.
+    Returns per-row score arrays and corpus-level scores (corpus BLEU, mean for the rest).
+    """
+    metrics = metrics or BATCH_METRICS
+    unknown = [m for m in metrics if m not in BATCH_METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+
+    batch = TokenizedBatch(predictions, references)
+    scores = {metric: getattr(batch, metric)() for metric in metrics}
+    corpus = {metric: float(values.mean()) if len(values) else 0.0 for metric, values in scores.items()}
+    if "bleu" in metrics:
+        corpus["bleu"] = batch.corpus_bleu() if len(batch) else 0.0
+    return {"scores": scores, "corpus": corpus}
@@ -0,0 +1,356 @@
+import asyncio
+import bisect
+import glob
+import heapq
+import json
+import os
+import struct
+import threading
+import uuid
+import zlib
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.models.storage import DATA_DIR
+
+HISTORY_DIR = os.getenv("HISTORY_DIR", os.path.join(DATA_DIR, "history"))
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1").lower() in ("1", "true", "yes")
+HISTORY_SEGMENT_BYTES = int(os.getenv("HISTORY_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+HISTORY_MAX_SEGMENTS = int(os.getenv("HISTORY_MAX_SEGMENTS", "64"))
+
+# Index entry: start timestamp, offset and length of the compressed record, record id
+INDEX_ENTRY = struct.Struct("<dQI16s")
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Segment:
+    """
+    One log file of zlib-compressed JSON records plus its fixed-width offset index.
+    Each worker process writes only its own segments (named after its pid); segments
+    from before per-process naming have no writer.
+    """
+
+    def __init__(self, seq: int, directory: str, writer: Optional[int] = None):
+        self.seq = seq
+        self.writer = writer
+        name = f"segment-{seq:08d}" if writer is None else f"segment-{writer}-{seq:08d}"
+        self.path = os.path.join(directory, f"{name}.log")
+        self.index_path = os.path.join(directory, f"{name}.idx")
+        # (ts, offset, length, id), kept sorted by ts for range queries
+        self.entries: List[Tuple[float, int, int, str]] = []
+        self.size = 0
+        self.index_bytes = 0
+
+    @classmethod
+    def from_path(cls, path: str) -> Optional["Segment"]:
+        parts = os.path.basename(path)[len("segment-"):-len(".log")].split("-")
+        try:
+            if len(parts) == 1:
+                return cls(int(parts[0]), os.path.dirname(path))
+            return cls(int(parts[1]), os.path.dirname(path), writer=int(parts[0]))
+        except (ValueError, IndexError):
+            return None
+
+    def load(self) -> List[Tuple[float, int, int, str]]:
+        """Read index entries added since the last load (by this or another process) and return them."""
+        self.size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path, "rb") as f:
+            f.seek(self.index_bytes)
+            data = f.read()
+        added = []
+        # Stop at a torn trailing entry (crash mid-write) or one whose record is not on disk yet;
+        # the next load picks up from there
+        for start in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            ts, offset, length, raw_id = INDEX_ENTRY.unpack_from(data, start)
+            if offset + length > self.size:
+                break
+            added.append((ts, offset, length, uuid.UUID(bytes=raw_id).hex))
+            self.index_bytes += INDEX_ENTRY.size
+        if added:
+            if self.entries and added[0][0] < self.entries[-1][0]:
+                self.entries = sorted(self.entries + added)
+            else:
+                self.entries.extend(sorted(added))
+        return added
+
+    @property
+    def deletable(self) -> bool:
+        """Whether retention may remove this segment: legacy, ours, or left by a process that is gone."""
+        return self.writer is None or self.writer == os.getpid() or not _process_alive(self.writer)
+
+    @property
+    def min_ts(self) -> float:
+        return self.entries[0][0] if self.entries else 0.0
+
+    @property
+    def max_ts(self) -> float:
+        return self.entries[-1][0] if self.entries else 0.0
+
+
+class HistoryLog:
+    """
+    Append-only, segment-rotated log of upstream requests and responses.
+    Records are compressed individually so any one can be read with a single
+    seek; the in-memory index maps ids and start times to segment offsets.
+    Writes are batched by a background task so request handlers never block on disk.
+
+    With several worker processes each appends to its own segments and picks up
+    the others' new index entries before answering a query.
+    """
+
+    def __init__(
+        self,
+        directory: str = HISTORY_DIR,
+        enabled: bool = HISTORY_ENABLED,
+        segment_bytes: int = HISTORY_SEGMENT_BYTES,
+        max_segments: int = HISTORY_MAX_SEGMENTS
+    ):
+        self.directory = directory
+        self.enabled = enabled
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self._segments: List[Segment] = []
+        self._by_id: Dict[str, Tuple[Segment, int, int]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._current: Optional[Segment] = None
+        self._pending: List[Dict[str, Any]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._writing = False
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._scan()
+            self._loaded = True
+
+    def _scan(self):
+        """Index segments written since the last scan, by this process or any other; call with the lock held."""
+        known = {segment.path: segment for segment in self._segments}
+        present = set(glob.glob(os.path.join(self.directory, "segment-*.log")))
+        pid = os.getpid()
+        for path, segment in known.items():
+            if path not in present and segment is not self._current:
+                # Removed by another process's retention
+                self._drop(segment)
+        for path in present:
+            segment = known.get(path)
+            if segment is None:
+                segment = Segment.from_path(path)
+                if segment is None:
+                    continue
+                self._segments.append(segment)
+            elif segment.writer == pid:
+                # Our own segments are indexed as they are written
+                continue
+            for ts, offset, length, record_id in segment.load():
+                self._by_id[record_id] = (segment, offset, length)
+        self._segments.sort(key=lambda s: (s.min_ts, s.seq))
+
+    def _drop(self, segment: Segment):
+        self._segments.remove(segment)
+        for _, _, _, record_id in segment.entries:
+            self._by_id.pop(record_id, None)
+
+    def _refresh(self):
+        if not self._loaded:
+            return self._load()
+        with self._lock:
+            self._scan()
+
+    async def _ensure_loaded(self):
+        if not self._loaded:
+            await asyncio.to_thread(self._load)
+
+    # Writing
+    def record(self, entry: Dict[str, Any]) -> str:
+        """Queue a record for writing and return its id. Safe to call from sync code in the event loop."""
+        record_id = uuid.uuid4().hex
+        self._pending.append({"id": record_id, **entry})
+        if self._writer is None or self._writer.done():
+            self._wakeup = asyncio.Event()
+            self._writer = asyncio.ensure_future(self._write_loop())
+        self._wakeup.set()
+        return record_id
+
+    async def _write_loop(self):
+        await self._ensure_loaded()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            if batch:
+                self._writing = True
+                try:
+                    await asyncio.to_thread(self._append_batch, batch)
+                except Exception as e:
+                    print(f"History write failed, dropped {len(batch)} records: {e}")
+                finally:
+                    self._writing = False
+
+    async def flush(self):
+        """Wait until every queued record is on disk."""
+        while self._pending or self._writing:
+            await asyncio.sleep(0.01)
+
+    async def aclose(self, timeout: float = 5.0):
+        """Write what is queued and stop the writer task (worker shutdown)."""
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            print(f"History flush timed out, dropped {len(self._pending)} records")
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+
+    def _current_segment(self) -> Segment:
+        pid = os.getpid()
+        if self._current is None or self._current.writer != pid or self._current.size >= self.segment_bytes:
+            own = [s.seq for s in self._segments if s.writer == pid]
+            self._current = Segment(max(own) + 1 if own else 0, self.directory, writer=pid)
+            self._segments.append(self._current)
+            self._enforce_retention()
+        return self._current
+
+    def _enforce_retention(self):
+        # The limit covers every process's segments; the oldest go first, but a live
+        # process's segments are left for that process to remove
+        excess = len(self._segments) - self.max_segments
+        for oldest in sorted(self._segments, key=lambda s: (s.min_ts, s.seq)):
+            if excess <= 0:
+                break
+            if oldest is self._current or not oldest.deletable:
+                continue
+            self._drop(oldest)
+            excess -= 1
+            for path in (oldest.path, oldest.index_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _append_batch(self, batch: List[Dict[str, Any]]):
+        with self._lock:
+            segment = self._current_segment()
+            log_file = open(segment.path, "ab")
+            index_file = open(segment.index_path, "ab")
+            try:
+                for record in batch:
+                    if segment.size >= self.segment_bytes:
+                        log_file.close()
+                        index_file.close()
+                        segment = self._current_segment()
+                        log_file = open(segment.path, "ab")
+                        index_file = open(segment.index_path, "ab")
+                    blob = zlib.compress(json.dumps(record, default=str).encode("utf-8"))
+                    offset = segment.size
+                    log_file.write(blob)
+                    ts = float(record.get("ts") or 0.0)
+                    index_file.write(INDEX_ENTRY.pack(ts, offset, len(blob), uuid.UUID(hex=record["id"]).bytes))
+                    segment.size += len(blob)
+                    entry = (ts, offset, len(blob), record["id"])
+                    # Records are appended on completion, so start times are only nearly sorted
+                    if segment.entries and ts < segment.entries[-1][0]:
+                        bisect.insort(segment.entries, entry)
+                    else:
+                        segment.entries.append(entry)
+                    self._by_id[record["id"]] = (segment, offset, len(blob))
+            finally:
+                log_file.close()
+                index_file.close()
+
+    # Reading
+    def _read(self, segment: Segment, offset: int, length: int) -> Optional[Dict[str, Any]]:
+        try:
+            with open(segment.path, "rb") as f:
+                f.seek(offset)
+                return json.loads(zlib.decompress(f.read(length)))
+        except (OSError, zlib.error, ValueError):
+            return None
+
+    def _get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        location = self._by_id.get(record_id)
+        return self._read(*location) if location else None
+
+    def _range(self, start: float, end: float, limit: int, newest: bool) -> List[Dict[str, Any]]:
+        # Snapshot the matching index slices under the lock, then read without it
+        with self._lock:
+            matches = []
+            for segment in self._segments:
+                if not segment.entries or segment.max_ts < start or segment.min_ts > end:
+                    continue
+                lo = bisect.bisect_left(segment.entries, (start,))
+                hi = bisect.bisect_right(segment.entries, (end, float("inf")))
+                matches.append((segment, segment.entries[lo:hi]))
+
+        # Segments of different processes overlap in time, so the limit applies to
+        # their entries merged by start time, not to one segment after another
+        merged = heapq.merge(
+            *([(entry, segment) for entry in (reversed(entries) if newest else entries)] for segment, entries in matches),
+            key=lambda item: item[0][0],
+            reverse=newest
+        )
+        records = []
+        files: Dict[str, Any] = {}
+        try:
+            for (ts, offset, length, _), segment in merged:
+                if segment.path not in files:
+                    try:
+                        files[segment.path] = open(segment.path, "rb")
+                    except FileNotFoundError:
+                        # Retention removed the segment after the snapshot; its records are gone
+                        files[segment.path] = None
+                f = files[segment.path]
+                if f is None:
+                    continue
+                f.seek(offset)
+                try:
+                    records.append(json.loads(zlib.decompress(f.read(length))))
+                except (zlib.error, ValueError):
+                    continue
+                if 0 < limit <= len(records):
+                    break
+        finally:
+            for f in files.values():
+                if f is not None:
+                    f.close()
+        return records
+
+    async def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        await asyncio.to_thread(self._refresh)
+        return await asyncio.to_thread(self._get, record_id)
+
+    async def query(self, start: float = 0.0, end: float = float("inf"), limit: int = -1, newest: bool = False) -> List[Dict[str, Any]]:
+        """
+        Records whose start time falls in [start, end], oldest first; with newest,
+        the latest ones first (so a limit keeps the most recent).
+        """
+        await asyncio.to_thread(self._refresh)
+        return await asyncio.to_thread(self._range, start, end, limit, newest)
+
+    async def stats(self) -> Dict[str, Any]:
+        await asyncio.to_thread(self._refresh)
+        return {
+            "enabled": self.enabled,
+            "records": len(self._by_id),
+            "segments": len(self._segments),
+            "bytes": sum(s.size for s in self._segments),
+            "oldest": min((s.min_ts for s in self._segments if s.entries), default=None),
+            "newest": max((s.max_ts for s in self._segments if s.entries), default=None),
+        }
+
+
+history = HistoryLog()
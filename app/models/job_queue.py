@@ -0,0 +1,130 @@
+import os
+import socket
+import time
+from typing import List, Dict, Any, Optional
+
+from app.models.storage import storage
+
+# A running job's owner renews its lease this often; a lease not renewed within the TTL
+# (the worker died) lets any other worker claim the job and resume it
+JOB_LEASE_TTL = float(os.getenv("JOB_LEASE_TTL", "15"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "2"))
+
+# Identifies this process in leases; unique across the workers of one deployment
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Job queue and live status shared by every worker process through the store.
+    Each job has one lease record: queued until a worker claims it, then owned by
+    that worker for as long as it keeps renewing the lease. Progress and cancel
+    requests travel through the same record, so any worker can report on or
+    cancel a job running in another.
+    """
+
+    def __init__(self, worker_id: str = WORKER_ID, ttl: float = JOB_LEASE_TTL):
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.leases = storage.collection("job_leases")
+
+    def live(self, lease: Optional[Dict[str, Any]]) -> bool:
+        return bool(lease) and lease.get("state") == "running" and lease.get("expires_at", 0) > time.time()
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.leases.get(job_id)
+
+    async def enqueue(self, job_id: str, restart: bool = False) -> Dict[str, Any]:
+        """Queue a job to run; raises RuntimeError if a worker is running it now."""
+        def change(lease):
+            if self.live(lease):
+                return None
+            return {
+                "id": job_id,
+                "state": "queued",
+                "owner": None,
+                "restart": restart,
+                "cancel": False,
+                "progress": (lease or {}).get("progress", {}),
+                "queued_at": time.time(),
+            }
+        lease = await self.leases.update(job_id, change)
+        if lease is None:
+            raise RuntimeError("Job is already running")
+        return lease
+
+    async def claim(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Take a queued (or abandoned) job for this worker; None if someone else has it."""
+        now = time.time()
+
+        def change(lease):
+            if lease is None:
+                return None
+            abandoned = lease.get("state") == "running" and lease.get("expires_at", 0) <= now
+            if lease.get("state") != "queued" and not abandoned:
+                return None
+            return {**lease, "state": "running", "owner": self.worker_id, "expires_at": now + self.ttl,
+                    "claimed_at": now, "resumed": abandoned}
+        return await self.leases.update(job_id, change)
+
+    async def claimable(self) -> List[str]:
+        now = time.time()
+        return [
+            lease["id"] for lease in await self.leases.list()
+            if lease.get("state") == "queued" or (lease.get("state") == "running" and lease.get("expires_at", 0) <= now)
+        ]
+
+    async def heartbeat(self, job_id: str, progress: Dict[str, Any]) -> Dict[str, Any]:
+        """Renew this worker's lease and publish progress; raises LeaseLost if another worker took over."""
+        def change(lease):
+            if lease is None or lease.get("owner") != self.worker_id or lease.get("state") != "running":
+                return None
+            return {**lease, "expires_at": time.time() + self.ttl, "progress": progress, "updated_at": time.time()}
+        lease = await self.leases.update(job_id, change)
+        if lease is None:
+            raise LeaseLost(job_id)
+        return lease
+
+    async def restarted(self, job_id: str):
+        """Record that this worker cleared the job's saved rows, so a worker taking over later resumes instead of clearing again."""
+        def change(lease):
+            if lease is None or lease.get("owner") != self.worker_id or not lease.get("restart"):
+                return None
+            return {**lease, "restart": False}
+        await self.leases.update(job_id, change)
+
+    async def request_cancel(self, job_id: str) -> bool:
+        """Ask the owning worker to stop the job (or drop it from the queue); False if it is not queued or running."""
+        def change(lease):
+            if lease is None:
+                return None
+            if lease.get("state") == "queued":
+                return {**lease, "state": "cancelled"}
+            if not self.live(lease):
+                return None
+            return {**lease, "cancel": True}
+        return await self.leases.update(job_id, change) is not None
+
+    async def release(self, job_id: str, progress: Dict[str, Any]):
+        """Put a job this worker owns back in the queue (the worker is shutting down)."""
+        def change(lease):
+            if lease is None or lease.get("owner") != self.worker_id or lease.get("state") != "running":
+                return None
+            return {**lease, "state": "queued", "owner": None, "restart": False, "progress": progress,
+                    "queued_at": time.time()}
+        await self.leases.update(job_id, change)
+
+    async def finish(self, job_id: str, state: str, progress: Dict[str, Any]):
+        """Record the final state of a job this worker owns."""
+        def change(lease):
+            if lease is None or lease.get("owner") != self.worker_id:
+                return None
+            return {**lease, "state": state, "progress": progress, "finished_at": time.time()}
+        await self.leases.update(job_id, change)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,389 @@
+import asyncio
+import json
+import os
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.models.response_cache import ResponseCache, cache_key
+from app.models.service import service
+from app.models.template_engine import CompiledTemplate, TemplateError
+
+JUDGE_DEFAULT_MODEL = os.getenv("JUDGE_DEFAULT_MODEL", "")
+# Judgments packed into one judge request when the rubric allows it
+JUDGE_BATCH_SIZE = int(os.getenv("JUDGE_BATCH_SIZE", "8"))
+# How long a partial batch waits for more judgments before it is sent anyway
+JUDGE_BATCH_WAIT_MS = float(os.getenv("JUDGE_BATCH_WAIT_MS", "50"))
+# Judge requests in flight at once, across all evaluators
+JUDGE_CONCURRENCY = int(os.getenv("JUDGE_CONCURRENCY", "4"))
+JUDGE_CACHE_MEMORY_ITEMS = int(os.getenv("JUDGE_CACHE_MEMORY_ITEMS", "4096"))
+JUDGE_CACHE_DISK_ITEMS = int(os.getenv("JUDGE_CACHE_DISK_ITEMS", "200000"))
+
+# Per-item variables; a rubric that uses anything else (row columns) is judged one item at a time
+ITEM_VARIABLES = ("prediction", "reference", "input")
+ITEM_LABELS = {"prediction": "Response", "reference": "Reference", "input": "Input"}
+
+SINGLE_INSTRUCTIONS = (
+    "You are an impartial judge. Grade the response using the rubric. "
+    'Reply with JSON only: {{"score": <number from {low:g} to {high:g}>, "reason": "<one sentence>"}}'
+)
+BATCH_INSTRUCTIONS = (
+    "You are an impartial judge. Grade each numbered item independently using the rubric; "
+    "in the rubric, <Response>, <Reference> and <Input> refer to the fields of the item being graded. "
+    "Reply with a JSON array only, one object per item in order: "
+    '[{{"id": <item number>, "score": <number from {low:g} to {high:g}>, "reason": "<one sentence>"}}]'
+)
+
+NUMBER = r"-?\d+(?:\.\d+)?"
+SCORE_PATTERNS = [
+    re.compile(rf"(?:score|rating|grade)\s*[:=]?\s*\**\s*({NUMBER})(?:\s*/\s*{NUMBER})?", re.IGNORECASE),
+    re.compile(rf"({NUMBER})\s*/\s*{NUMBER}"),
+    re.compile(rf"({NUMBER})\s+out of\s+{NUMBER}", re.IGNORECASE),
+]
+ITEM_LINE = re.compile(rf"^\W*(?:item\s*)?#?(\d+)\s*[:.)\]-]+(.*)$", re.IGNORECASE)
+
+
+class JudgeError(ValueError):
+    pass
+
+
+class JudgeDefinition:
+    """A custom `llm_judge` evaluator, validated and compiled once."""
+
+    def __init__(self, evaluator: Dict[str, Any]):
+        self.id = str(evaluator.get("id") or evaluator.get("name"))
+        self.name = evaluator.get("name") or self.id
+        self.model = evaluator.get("model") or JUDGE_DEFAULT_MODEL
+        if not self.model:
+            raise JudgeError(f"Judge evaluator '{self.name}' needs a model (or set JUDGE_DEFAULT_MODEL)")
+        content = evaluator.get("prompt") or evaluator.get("rubric") or ""
+        try:
+            self.template = CompiledTemplate(content)
+        except TemplateError as e:
+            raise JudgeError(f"Judge evaluator '{self.name}': {e}")
+        if "prediction" not in self.template.variables:
+            raise JudgeError(f"Judge evaluator '{self.name}': the prompt must contain {{{{prediction}}}}")
+        scale = evaluator.get("scale") or {}
+        self.low = float(scale.get("min", 0))
+        self.high = float(scale.get("max", 1))
+        if self.high <= self.low:
+            raise JudgeError(f"Judge evaluator '{self.name}': scale max must be greater than min")
+        self.temperature = float(evaluator.get("temperature", 0.0))
+        self.max_tokens = int(evaluator.get("max_tokens", -1))
+        self.batch_size = max(1, int(evaluator.get("batch_size", JUDGE_BATCH_SIZE)))
+        self.batchable = (
+            evaluator.get("batch", True) is not False
+            and self.batch_size > 1
+            and all(v in ITEM_VARIABLES for v in self.template.variables)
+        )
+        self.content = content
+
+    def values(self, prediction: str, reference: str, row: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        row = row or {}
+        values = {**row, "prediction": prediction, "reference": reference, "input": row.get("input", row.get("prompt", ""))}
+        # Only what the prompt shows the judge can change its verdict
+        return {v: values.get(v) for v in self.template.variables}
+
+    def key(self, values: Dict[str, Any]) -> str:
+        return cache_key("judge", {
+            "prompt": self.content,
+            "scale": [self.low, self.high],
+            "model": self.model,
+            "temperature": self.temperature,
+            "values": values,
+        })
+
+    def single_messages(self, values: Dict[str, Any]) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": SINGLE_INSTRUCTIONS.format(low=self.low, high=self.high)},
+            {"role": "user", "content": self.template.render(values)},
+        ]
+
+    def batch_messages(self, items: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        rubric = self.template.render({v: f"<{ITEM_LABELS[v]}>" for v in self.template.variables})
+        parts = [f"Rubric:\n{rubric}"]
+        for number, values in enumerate(items, start=1):
+            fields = "\n".join(f"<{ITEM_LABELS[v]}>\n{values.get(v) or ''}" for v in ITEM_VARIABLES if v in values)
+            parts.append(f"### Item {number}\n{fields}")
+        return [
+            {"role": "system", "content": BATCH_INSTRUCTIONS.format(low=self.low, high=self.high)},
+            {"role": "user", "content": "\n\n".join(parts)},
+        ]
+
+    def normalize(self, score: Any) -> Optional[float]:
+        """Map a raw score onto 0-1, or None if it is not a number on the scale."""
+        try:
+            value = float(score)
+        except (TypeError, ValueError):
+            return None
+        if value != value or not self.low <= value <= self.high:
+            return None
+        return (value - self.low) / (self.high - self.low)
+
+
+def _json_values(text: str) -> List[Any]:
+    """Every top-level JSON object or array embedded in text (code fences and chatter around them are fine)."""
+    decoder = json.JSONDecoder()
+    found = []
+    position = 0
+    while True:
+        starts = [i for i in (text.find("{", position), text.find("[", position)) if i >= 0]
+        if not starts:
+            return found
+        start = min(starts)
+        try:
+            value, end = decoder.raw_decode(text, start)
+        except ValueError:
+            position = start + 1
+            continue
+        found.append(value)
+        position = end
+
+
+def _number(text: str) -> Optional[str]:
+    for pattern in SCORE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return match.group(1)
+    return None
+
+
+def _verdict(value: Any) -> Tuple[Any, str]:
+    if isinstance(value, dict):
+        for key in ("score", "rating", "grade", "value"):
+            if key in value:
+                return value[key], str(value.get("reason") or value.get("explanation") or "")
+    return value, ""
+
+
+def parse_verdict(text: str, definition: JudgeDefinition) -> Optional[Dict[str, Any]]:
+    """Score and reason from a single-item judge reply."""
+    for value in _json_values(text):
+        if isinstance(value, list) and len(value) == 1:
+            value = value[0]
+        raw, reason = _verdict(value)
+        score = definition.normalize(raw)
+        if score is not None:
+            return {"score": score, "raw": float(raw), "reason": reason}
+    raw = _number(text)
+    if raw is None:
+        # Last resort: a bare number is the whole reply
+        stripped = text.strip().strip("*").strip()
+        raw = stripped if re.fullmatch(NUMBER, stripped) else None
+    score = definition.normalize(raw)
+    if score is None:
+        return None
+    return {"score": score, "raw": float(raw), "reason": text.strip()[:200]}
+
+
+def parse_batch_verdicts(text: str, definition: JudgeDefinition, count: int) -> Dict[int, Dict[str, Any]]:
+    """Verdicts by item number (1-based) from a batched judge reply; items that cannot be read are left out."""
+    verdicts: Dict[int, Dict[str, Any]] = {}
+    for value in _json_values(text):
+        if isinstance(value, dict):
+            entries = value.get("items") or value.get("results") or [value]
+        else:
+            entries = value
+        for position, entry in enumerate(entries, start=1):
+            number = entry.get("id", entry.get("item", position)) if isinstance(entry, dict) else position
+            try:
+                number = int(number)
+            except (TypeError, ValueError):
+                continue
+            raw, reason = _verdict(entry)
+            score = definition.normalize(raw)
+            if score is not None and 1 <= number <= count:
+                verdicts.setdefault(number, {"score": score, "raw": float(raw), "reason": reason})
+    if verdicts:
+        return verdicts
+    # Plain text: one "N: ... score" line per item
+    for line in text.splitlines():
+        match = ITEM_LINE.match(line.strip())
+        if not match:
+            continue
+        number = int(match.group(1))
+        raw = _number(match.group(2)) or next(iter(re.findall(NUMBER, match.group(2))), None)
+        score = definition.normalize(raw)
+        if score is not None and 1 <= number <= count:
+            verdicts.setdefault(number, {"score": score, "raw": float(raw), "reason": match.group(2).strip()[:200]})
+    return verdicts
+
+
+class JudgeBatcher:
+    """Collects judgments for one evaluator and sends them in batches."""
+
+    def __init__(self, runner: "JudgeRunner", key: Tuple[str, str, Optional[str]], definition: JudgeDefinition, user: Optional[str]):
+        self.runner = runner
+        self.key = key
+        self.definition = definition
+        self.user = user
+        self.pending: List[Tuple[Dict[str, Any], str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def add(self, values: Dict[str, Any], key: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((values, key, future))
+        if len(self.pending) >= self.definition.batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(JUDGE_BATCH_WAIT_MS / 1000, self.flush)
+        return future
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.pending = self.pending, []
+        # Empty now, so the runner lets go of it; the next judgment starts a new batcher
+        if self.runner._batchers.get(self.key) is self:
+            del self.runner._batchers[self.key]
+        if batch:
+            self.runner._spawn(self.runner._judge_batch(self.definition, batch, self.user))
+
+
+class JudgeRunner:
+    """
+    Runs LLM-as-judge evaluators: verdicts are cached by prompt, model and the
+    values the judge sees, concurrent judgments of a batchable rubric share one
+    request, and judge requests run under a shared concurrency limit.
+    """
+
+    def __init__(self, concurrency: int = JUDGE_CONCURRENCY):
+        self.concurrency = concurrency
+        self._limit: Optional[asyncio.Semaphore] = None
+        self._batchers: Dict[Tuple[str, str, Optional[str]], JudgeBatcher] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._tasks: set = set()
+        self.cache = ResponseCache(
+            enabled=True,
+            memory_items=JUDGE_CACHE_MEMORY_ITEMS,
+            disk_items=JUDGE_CACHE_DISK_ITEMS,
+            ttl=0,
+            collection="judge_verdicts"
+        )
+        self.stats = {"judgments": 0, "requests": 0, "batched_items": 0, "parse_failures": 0, "fallbacks": 0}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.concurrency)
+        return self._limit
+
+    def _spawn(self, coroutine) -> asyncio.Task:
+        # Held here so a batch in flight is not garbage-collected before it resolves its futures
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def judge(
+        self,
+        definition: JudgeDefinition,
+        prediction: str,
+        reference: str,
+        row: Optional[Dict[str, Any]] = None,
+        user: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Verdict {score (0-1), raw, reason} for one item, or None if the judge's reply could not be read."""
+        self.stats["judgments"] += 1
+        values = definition.values(prediction, reference, row)
+        key = definition.key(values)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached
+        # The same item judged twice at once (e.g. two models gave the same answer) costs one judgment
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        if definition.batchable:
+            batcher_key = (definition.id, definition.content, user)
+            batcher = self._batchers.get(batcher_key)
+            if batcher is None or batcher.definition is not definition:
+                batcher = self._batchers[batcher_key] = JudgeBatcher(self, batcher_key, definition, user)
+            future = batcher.add(values, key)
+        else:
+            future = self._spawn(self._judge_single(definition, values, key, user))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def judge_many(
+        self,
+        definition: JudgeDefinition,
+        items: List[Dict[str, Any]],
+        user: Optional[str] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        verdicts = await asyncio.gather(*(
+            self.judge(definition, str(item.get("prediction", "")), str(item.get("reference", "")), item, user)
+            for item in items
+        ), return_exceptions=True)
+        return [{"error": str(v)} if isinstance(v, Exception) else v for v in verdicts]
+
+    async def _complete(self, definition: JudgeDefinition, messages: List[Dict[str, str]], user: Optional[str]) -> str:
+        async with self._semaphore():
+            self.stats["requests"] += 1
+            response = await service.chat_completion(
+                messages=messages,
+                model=definition.model,
+                temperature=definition.temperature,
+                max_tokens=definition.max_tokens,
+                use_cache=False,
+                priority="batch",
+                user=user
+            )
+        return response.choices[0].message.content or ""
+
+    async def _judge_single(self, definition: JudgeDefinition, values: Dict[str, Any], key: str, user: Optional[str]) -> Optional[Dict[str, Any]]:
+        text = await self._complete(definition, definition.single_messages(values), user)
+        verdict = parse_verdict(text, definition)
+        if verdict is None:
+            self.stats["parse_failures"] += 1
+            print(f"Judge '{definition.name}' reply had no score: {text[:200]!r}")
+            return None
+        await self.cache.set(key, verdict)
+        return verdict
+
+    async def _judge_batch(self, definition: JudgeDefinition, batch: List[Tuple[Dict[str, Any], str, asyncio.Future]], user: Optional[str]):
+        try:
+            if len(batch) == 1:
+                values, key, future = batch[0]
+                verdicts = {1: await self._judge_single(definition, values, key, user)}
+            else:
+                self.stats["batched_items"] += len(batch)
+                text = await self._complete(definition, definition.batch_messages([b[0] for b in batch]), user)
+                verdicts = parse_batch_verdicts(text, definition, len(batch))
+                for number, (values, key, _) in enumerate(batch, start=1):
+                    if number in verdicts:
+                        await self.cache.set(key, verdicts[number])
+            # Items the batched reply answered are settled before any fallback can fail
+            for number, (_, _, future) in enumerate(batch, start=1):
+                if number in verdicts and not future.done():
+                    future.set_result(verdicts[number])
+            # Items the batched reply left out (or garbled) are judged on their own
+            missing = [(n, b) for n, b in enumerate(batch, start=1) if n not in verdicts]
+            if missing:
+                self.stats["fallbacks"] += len(missing)
+                singles = await asyncio.gather(*(self._judge_single(definition, b[0], b[1], user) for _, b in missing),
+                                               return_exceptions=True)
+                for (_, (_, _, future)), single in zip(missing, singles):
+                    if future.done():
+                        continue
+                    if isinstance(single, Exception):
+                        future.set_exception(single)
+                    elif isinstance(single, BaseException):
+                        future.cancel()
+                    else:
+                        future.set_result(single)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        cache = await self.cache.get_stats()
+        return {**self.stats, "cache": cache, "concurrency": self.concurrency}
+
+
+def is_judge(evaluator: Dict[str, Any]) -> bool:
+    return evaluator.get("type") == "llm_judge"
+
+
+judge_runner = JudgeRunner()
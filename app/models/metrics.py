@@ -0,0 +1,129 @@
+import bisect
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+# Bucket upper bounds; every histogram uses a fixed number of counters regardless of traffic
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0]
+RATE_BUCKETS = [1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000]
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate by linear interpolation inside the bucket holding the q-th observation."""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (target - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self.started_at = time.time()
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[name] = (kind, help_text)
+
+    def observe(self, name: str, value: float, buckets: List[float] = LATENCY_BUCKETS, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    def inc(self, name: str, amount: float = 1.0, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in self._counters.items():
+                self._header(lines, name, "counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in self._histograms.items():
+                self._header(lines, name, "histogram")
+                for key, hist in series.items():
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets + [float("inf")], hist.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {hist.total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: List[str], name: str, default_kind: str):
+        kind, help_text = self._help.get(name, (default_kind, name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "uptime_seconds": time.time() - self.started_at,
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in self._counters.items()
+                },
+                "histograms": {
+                    name: [{"labels": dict(key), **hist.summary()} for key, hist in series.items()]
+                    for name, series in self._histograms.items()
+                },
+            }
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: Labels) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in key) + "}"
+
+
+metrics = MetricsRegistry()
+metrics.describe("llm_requests_total", "counter", "Upstream LLM requests by model, endpoint and status")
+metrics.describe("llm_request_duration_seconds", "histogram", "Total upstream request latency")
+metrics.describe("llm_queue_wait_seconds", "histogram", "Time between a request entering the service and being sent upstream")
+metrics.describe("llm_time_to_first_token_seconds", "histogram", "Time from sending a streaming request to its first token")
+metrics.describe("llm_tokens_per_second", "histogram", "Generation throughput per request")
+metrics.describe("llm_output_tokens_total", "counter", "Generated tokens (usage or streamed deltas)")
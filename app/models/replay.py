@@ -0,0 +1,153 @@
+import asyncio
+import time
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Union
+
+import httpx
+import numpy as np
+
+from app.models.backends import LLM_BACKEND_URLS, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT
+
+ENDPOINT_PATHS = {"chat.completions": "/chat/completions", "responses": "/responses"}
+
+
+def recorded_concurrency(records: List[Dict[str, Any]]) -> int:
+    """Peak number of recorded requests that were in flight at the same time."""
+    events = []
+    for record in records:
+        start = record.get("ts", 0.0)
+        events.append((start, 1))
+        events.append((start + (record.get("duration_ms") or 0.0) / 1000, -1))
+    # Ends sort before starts at the same instant
+    events.sort(key=lambda e: (e[0], e[1]))
+    peak = current = 0
+    for _, delta in events:
+        current += delta
+        peak = max(peak, current)
+    return max(peak, 1)
+
+
+def parse_speed(speed: Union[str, float, None]) -> Optional[float]:
+    """'1x', '4x', 2.5 -> multiplier; 'max' -> None (no pacing)."""
+    if speed is None:
+        return 1.0
+    if isinstance(speed, (int, float)):
+        value = float(speed)
+    else:
+        text = speed.strip().lower()
+        if text == "max":
+            return None
+        value = float(text.rstrip("x"))
+    if value <= 0:
+        raise ValueError("speed must be positive")
+    return value
+
+
+class Replayer:
+    """
+    Re-issues recorded requests against a backend as a load generator.
+    With a speed multiplier, each request is sent at its recorded offset divided by
+    the multiplier, so the recorded overlap (concurrency) is reproduced. At 'max'
+    speed requests are sent back to back, capped at the recorded peak concurrency.
+    An explicit concurrency caps in-flight requests in either mode.
+    """
+
+    def __init__(
+        self,
+        records: List[Dict[str, Any]],
+        base_url: Optional[str] = None,
+        speed: Union[str, float, None] = "1x",
+        concurrency: Optional[int] = None,
+        model: Optional[str] = None
+    ):
+        self.records = sorted((r for r in records if r.get("endpoint") in ENDPOINT_PATHS and r.get("request")),
+                              key=lambda r: r.get("ts", 0.0))
+        self.base_url = (base_url or LLM_BACKEND_URLS[0]).rstrip("/")
+        self.speed = parse_speed(speed)
+        self.recorded_concurrency = recorded_concurrency(self.records)
+        self.concurrency = concurrency or (self.recorded_concurrency if self.speed is None else None)
+        self.model = model
+        self.latencies: List[float] = []
+        self.ttfts: List[float] = []
+        self.errors = 0
+        self.completed = 0
+
+    async def _send(self, client: httpx.AsyncClient, record: Dict[str, Any]):
+        body = dict(record["request"])
+        if self.model:
+            body["model"] = self.model
+        path = ENDPOINT_PATHS[record["endpoint"]]
+        start = time.perf_counter()
+        try:
+            if body.get("stream"):
+                async with client.stream("POST", path, json=body) as response:
+                    response.raise_for_status()
+                    first = None
+                    async for line in response.aiter_lines():
+                        if first is None and line.startswith("data:"):
+                            first = time.perf_counter()
+                            self.ttfts.append(first - start)
+            else:
+                response = await client.post(path, json=body)
+                response.raise_for_status()
+            self.latencies.append(time.perf_counter() - start)
+        except Exception:
+            self.errors += 1
+        finally:
+            self.completed += 1
+
+    async def run(self, on_progress: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None) -> Dict[str, Any]:
+        limit = asyncio.Semaphore(self.concurrency) if self.concurrency else None
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        timeout = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        started = time.perf_counter()
+        t0 = self.records[0].get("ts", 0.0) if self.records else 0.0
+
+        async def fire(record: Dict[str, Any]):
+            try:
+                await self._send(client, record)
+            finally:
+                if limit is not None:
+                    limit.release()
+
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=timeout) as client:
+            tasks = []
+            try:
+                for record in self.records:
+                    if self.speed is not None:
+                        delay = (record.get("ts", 0.0) - t0) / self.speed - (time.perf_counter() - started)
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    if limit is not None:
+                        await limit.acquire()
+                    tasks.append(asyncio.ensure_future(fire(record)))
+                    if on_progress is not None and len(tasks) % 50 == 0:
+                        await on_progress(self.summary(time.perf_counter() - started))
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+        return self.summary(time.perf_counter() - started)
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        latencies = np.asarray(self.latencies) * 1000
+        ttfts = np.asarray(self.ttfts) * 1000
+        return {
+            "base_url": self.base_url,
+            "speed": "max" if self.speed is None else f"{self.speed:g}x",
+            "concurrency": self.concurrency,
+            "recorded_concurrency": self.recorded_concurrency,
+            "total": len(self.records),
+            "completed": self.completed,
+            "errors": self.errors,
+            "elapsed_s": elapsed,
+            "requests_per_second": self.completed / elapsed if elapsed > 0 else 0.0,
+            "latency_ms": percentiles(latencies),
+            "ttft_ms": percentiles(ttfts),
+        }
+
+
+def percentiles(values: np.ndarray) -> Dict[str, Optional[float]]:
+    if not len(values):
+        return {"p50": None, "p90": None, "p99": None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": float(p50), "p90": float(p90), "p99": float(p99)}
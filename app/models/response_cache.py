@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from app.models.storage import storage
+
+# Caching is opt-in: enable it globally here, or per request with use_cache
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "1024"))
+LLM_CACHE_DISK_ITEMS = int(os.getenv("LLM_CACHE_DISK_ITEMS", "50000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+def cache_key(kind: str, payload: Dict[str, Any]) -> str:
+    """Canonical hash of a request: key order and whitespace do not matter."""
+    canonical = json.dumps({"kind": kind, **payload}, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of upstream results: an in-memory LRU in front of a
+    persistent collection in the shared store. Entries expire after ttl
+    seconds and each tier is bounded by item count.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = LLM_CACHE_ENABLED,
+        memory_items: int = LLM_CACHE_MEMORY_ITEMS,
+        disk_items: int = LLM_CACHE_DISK_ITEMS,
+        ttl: float = LLM_CACHE_TTL,
+        collection: str = "response_cache"
+    ):
+        self.enabled = enabled
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._disk = storage.collection(collection, key="key")
+        self._writes_since_trim = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def should_cache(self, use_cache: Optional[bool], temperature: Optional[float]) -> bool:
+        if use_cache is not None:
+            return use_cache
+        # Only deterministic requests are cached by default
+        return self.enabled and temperature == 0
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def _remember(self, key: str, created_at: float, value: Any):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            if not self._expired(entry[0]):
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry[1]
+            del self._memory[key]
+
+        record = await self._disk.get(key)
+        if record is not None:
+            if not self._expired(record["created_at"]):
+                self._remember(key, record["created_at"], record["value"])
+                self.stats["disk_hits"] += 1
+                return record["value"]
+            await self._disk.delete(key)
+            self.stats["evictions"] += 1
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Any):
+        created_at = time.time()
+        self._remember(key, created_at, value)
+        await self._disk.upsert({"key": key, "created_at": created_at, "value": value})
+        self.stats["stores"] += 1
+        self._writes_since_trim += 1
+        # Trimming is a table scan, so only do it every so often
+        if self._writes_since_trim >= max(1, self.disk_items // 100):
+            self._writes_since_trim = 0
+            self.stats["evictions"] += await self._disk.trim(self.disk_items)
+
+    async def clear(self):
+        self._memory.clear()
+        await self._disk.clear()
+
+    async def get_stats(self) -> Dict[str, Any]:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "disk_items": await self._disk.count(),
+        }
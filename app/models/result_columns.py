@@ -0,0 +1,437 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models.storage import DATA_DIR
+
+RESULTS_DIR = os.getenv("EVAL_RESULTS_DIR", os.path.join(DATA_DIR, "results"))
+# Buffered rows are written to the column files once this many are pending (and at every job checkpoint)
+RESULTS_FLUSH_ROWS = int(os.getenv("EVAL_RESULTS_FLUSH_ROWS", "512"))
+EVAL_BOOTSTRAP_SAMPLES = int(os.getenv("EVAL_BOOTSTRAP_SAMPLES", "1000"))
+# Scores with at most this many distinct values are resampled as counts per value,
+# so a bootstrap costs samples x values instead of samples x rows
+BOOTSTRAP_BINS = 256
+# Otherwise row indices are resampled in blocks of about this many entries
+BOOTSTRAP_BLOCK_VALUES = 4000000
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+AGGREGATE_CACHE_SIZE = 64
+
+# Fixed columns; each metric adds a float32 score column (NaN where the row has no score)
+BASE_COLUMNS = {"row_index": np.int64, "model": np.int32, "error": np.uint8, "latency_ms": np.float32}
+SCORE_DTYPE = np.float32
+
+
+def _job_dir(job_id: str) -> str:
+    name = str(job_id)
+    if not re.fullmatch(r"[A-Za-z0-9_.-]{1,64}", name) or name.startswith("."):
+        name = hashlib.sha1(name.encode("utf-8")).hexdigest()
+    return os.path.join(RESULTS_DIR, name)
+
+
+class JobColumns:
+    """
+    One job's results as append-only column files. meta.json holds the row count
+    and is replaced atomically after the columns are written, so rows past it
+    (a crash mid-append) are ignored on read. Another worker process may be the
+    one appending, so meta.json is read again before every read or write.
+    A restart or rebuild deletes the files; the next write starts a new
+    generation, so (generation, rows) identifies the data even across processes.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.directory = _job_dir(job_id)
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.lock = threading.Lock()
+        self.pending: List[Dict[str, Any]] = []
+        self.meta = self._read_meta()
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path, "r") as f:
+            return json.load(f)
+
+    def sync(self):
+        """Pick up rows appended (or a reset made) by another process; call with the lock held."""
+        self.meta = self._read_meta()
+
+    def _path(self, column: str) -> str:
+        return os.path.join(self.directory, f"{column}.bin")
+
+    def _score_column(self, metric: str) -> str:
+        return f"score.{self.meta['metrics'].index(metric)}"
+
+    def write(self, results: List[Dict[str, Any]]):
+        """Append results to the column files (runs in a worker thread)."""
+        with self.lock:
+            self.sync()
+            if self.meta is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self.meta = {"job_id": self.job_id, "generation": uuid.uuid4().hex, "rows": 0,
+                             "models": [], "metrics": [], "errors": 0}
+                for column in BASE_COLUMNS:
+                    open(self._path(column), "wb").close()
+            meta = self.meta
+            rows = meta["rows"]
+            for result in results:
+                if result["model"] not in meta["models"]:
+                    meta["models"].append(result["model"])
+                for metric in result.get("scores", {}):
+                    if metric not in meta["metrics"]:
+                        meta["metrics"].append(metric)
+                        # Rows written before the metric existed have no score for it
+                        with open(self._path(self._score_column(metric)), "wb") as f:
+                            f.write(np.full(rows, np.nan, dtype=SCORE_DTYPE).tobytes())
+            models = {m: i for i, m in enumerate(meta["models"])}
+            count = len(results)
+            columns = {
+                "row_index": np.fromiter((r["row_index"] for r in results), dtype=BASE_COLUMNS["row_index"], count=count),
+                "model": np.fromiter((models[r["model"]] for r in results), dtype=BASE_COLUMNS["model"], count=count),
+                "error": np.fromiter(("error" in r for r in results), dtype=BASE_COLUMNS["error"], count=count),
+                "latency_ms": np.fromiter((r.get("latency_ms") or np.nan for r in results), dtype=BASE_COLUMNS["latency_ms"], count=count),
+            }
+            for metric in meta["metrics"]:
+                columns[self._score_column(metric)] = np.fromiter(
+                    (_score(r, metric) for r in results), dtype=SCORE_DTYPE, count=count
+                )
+            for column, values in columns.items():
+                path = self._path(column)
+                with open(path, "r+b") as f:
+                    # Drop any torn tail left by an interrupted append before writing after it
+                    f.truncate(rows * values.itemsize)
+                    f.seek(0, os.SEEK_END)
+                    f.write(values.tobytes())
+            meta["rows"] = rows + count
+            meta["errors"] += int(columns["error"].sum())
+            tmp = self.meta_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp, self.meta_path)
+
+    def load(self) -> Dict[str, Any]:
+        """Memory-mapped columns, keeping only the latest result for each (row, model)."""
+        with self.lock:
+            self.sync()
+            meta = dict(self.meta) if self.meta else {"rows": 0, "models": [], "metrics": [], "errors": 0}
+            rows = meta["rows"]
+            columns: Dict[str, np.ndarray] = {}
+            for column, dtype in BASE_COLUMNS.items():
+                columns[column] = self._map(column, dtype, rows)
+            scores = {metric: self._map(f"score.{i}", SCORE_DTYPE, rows) for i, metric in enumerate(meta["metrics"])}
+        # Retried rows append a second result, and so does a row a stale worker finished
+        # after a takeover, so repeats are possible with or without errors
+        key = columns["row_index"] * max(1, len(meta["models"])) + columns["model"]
+        _, last = np.unique(key[::-1], return_index=True)
+        keep = np.sort(rows - 1 - last)
+        if keep.size != rows:
+            columns = {k: v[keep] for k, v in columns.items()}
+            scores = {k: v[keep] for k, v in scores.items()}
+        return {"meta": meta, "columns": columns, "scores": scores}
+
+    def _map(self, column: str, dtype, rows: int) -> np.ndarray:
+        if rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._path(column), dtype=dtype, mode="r", shape=(rows,))
+
+    def delete(self):
+        with self.lock:
+            self.pending = []
+            self.meta = None
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _score(result: Dict[str, Any], metric: str) -> float:
+    value = result.get("scores", {}).get(metric)
+    return np.nan if value is None else value
+
+
+def describe(values: np.ndarray, percentiles: Sequence[float], confidence: float, samples: int, rng) -> Dict[str, Any]:
+    """count/mean/std/min/max, percentiles and a bootstrap CI of the mean for one column."""
+    values = values[~np.isnan(values)].astype(np.float64)
+    if values.size == 0:
+        return {"count": 0, "mean": None, "std": None, "min": None, "max": None, "percentiles": {}, "ci": None}
+    return {
+        "count": int(values.size),
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "percentiles": {f"p{p:g}": float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))} if percentiles else {},
+        "ci": bootstrap_mean_ci(values, confidence, samples, rng),
+    }
+
+
+def bootstrap_mean_ci(values: np.ndarray, confidence: float, samples: int, rng) -> Optional[List[float]]:
+    """
+    Percentile bootstrap interval for the mean.
+    Few-valued scores (0/1 and the like) resample as a multinomial draw of counts per
+    distinct value; anything else resamples row indices, a block of resamples at a time.
+    """
+    n = values.size
+    if n == 0 or samples <= 0:
+        return None
+    distinct, counts = np.unique(values, return_counts=True)
+    if distinct.size == 1:
+        return [float(distinct[0]), float(distinct[0])]
+    if distinct.size <= BOOTSTRAP_BINS:
+        means = rng.multinomial(n, counts / n, size=samples) @ distinct / n
+    else:
+        # Bound each block's index matrix to about BOOTSTRAP_BLOCK_VALUES entries
+        block = max(1, BOOTSTRAP_BLOCK_VALUES // n)
+        means = np.concatenate([
+            values[rng.integers(0, n, size=(min(block, samples - start), n))].mean(axis=1)
+            for start in range(0, samples, block)
+        ])
+    alpha = (1 - confidence) / 2
+    return [float(v) for v in np.quantile(means, [alpha, 1 - alpha])]
+
+
+class ResultColumns:
+    """Columnar copies of eval job results for aggregation, kept alongside the row records."""
+
+    def __init__(self, flush_rows: int = RESULTS_FLUSH_ROWS):
+        self.flush_rows = flush_rows
+        self._jobs: Dict[str, JobColumns] = {}
+        self._aggregates: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+
+    def job(self, job_id: str) -> JobColumns:
+        columns = self._jobs.get(job_id)
+        if columns is None:
+            columns = self._jobs[job_id] = JobColumns(job_id)
+        return columns
+
+    def exists(self, job_id: str) -> bool:
+        columns = self.job(job_id)
+        with columns.lock:
+            columns.sync()
+            return columns.meta is not None
+
+    async def append(self, job_id: str, result: Dict[str, Any]):
+        columns = self.job(job_id)
+        columns.pending.append(result)
+        if len(columns.pending) >= self.flush_rows:
+            await self.flush(job_id)
+
+    async def flush(self, job_id: str):
+        columns = self.job(job_id)
+        batch, columns.pending = columns.pending, []
+        if batch:
+            await asyncio.to_thread(columns.write, batch)
+
+    async def rebuild(self, job_id: str, results: List[Dict[str, Any]]):
+        """Recreate the columns from stored row results (jobs that ran before columns existed)."""
+        columns = self.job(job_id)
+        await asyncio.to_thread(columns.delete)
+        self._forget(job_id)
+        if results:
+            await asyncio.to_thread(columns.write, results)
+
+    async def delete(self, job_id: str):
+        columns = self._jobs.pop(job_id, None) or JobColumns(job_id)
+        await asyncio.to_thread(columns.delete)
+        self._forget(job_id)
+
+    async def load(self, job_id: str) -> Dict[str, Any]:
+        await self.flush(job_id)
+        return await asyncio.to_thread(self.job(job_id).load)
+
+    async def done_keys(self, job_id: str) -> set:
+        """(row_index, model) pairs that already scored without error."""
+        data = await self.load(job_id)
+        columns, models = data["columns"], data["meta"]["models"]
+        ok = columns["error"] == 0
+        return {(int(r), models[m]) for r, m in zip(columns["row_index"][ok].tolist(), columns["model"][ok].tolist())}
+
+    async def aggregate(
+        self,
+        job_id: str,
+        metrics: Optional[List[str]] = None,
+        percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+        confidence: float = 0.95,
+        samples: int = EVAL_BOOTSTRAP_SAMPLES
+    ) -> Dict[str, Any]:
+        data = await self.load(job_id)
+        # Rows are only ever appended within a generation, so the two identify the data
+        key = (job_id, _version(data), tuple(metrics or ()), tuple(percentiles), confidence, samples)
+        cached = self._aggregates.get(key)
+        if cached is None:
+            cached = await asyncio.to_thread(_aggregate, data, metrics, percentiles, confidence, samples)
+            self._cache(key, cached)
+        return {"job_id": job_id, **cached}
+
+    async def diff(
+        self,
+        job_a: str,
+        job_b: str,
+        model_a: Optional[str] = None,
+        model_b: Optional[str] = None,
+        metrics: Optional[List[str]] = None,
+        confidence: float = 0.95,
+        samples: int = EVAL_BOOTSTRAP_SAMPLES,
+        top: int = 10
+    ) -> Dict[str, Any]:
+        data_a, data_b = await self.load(job_a), await self.load(job_b)
+        key = ("diff", job_a, _version(data_a), job_b, _version(data_b), model_a, model_b,
+               tuple(metrics or ()), confidence, samples, top)
+        cached = self._aggregates.get(key)
+        if cached is None:
+            cached = await asyncio.to_thread(_diff, data_a, data_b, model_a, model_b, metrics, confidence, samples, top)
+            self._cache(key, cached)
+        return {"job_a": job_a, "job_b": job_b, **cached}
+
+    def _cache(self, key: Tuple, value: Dict[str, Any]):
+        self._aggregates[key] = value
+        if len(self._aggregates) > AGGREGATE_CACHE_SIZE:
+            self._aggregates.popitem(last=False)
+
+    def _forget(self, job_id: str):
+        """Drop cached aggregates and diffs of a job whose columns were deleted."""
+        for key in [k for k in self._aggregates if job_id in k]:
+            del self._aggregates[key]
+
+
+def _version(data: Dict[str, Any]) -> Tuple[Optional[str], int]:
+    meta = data["meta"]
+    return meta.get("generation"), meta["rows"]
+
+
+def _selected(meta: Dict[str, Any], metrics: Optional[List[str]]) -> List[str]:
+    if not metrics:
+        return list(meta["metrics"])
+    unknown = [m for m in metrics if m not in meta["metrics"]]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+    return list(metrics)
+
+
+def _aggregate(data: Dict[str, Any], metrics: Optional[List[str]], percentiles, confidence: float, samples: int) -> Dict[str, Any]:
+    meta, columns, scores = data["meta"], data["columns"], data["scores"]
+    names = _selected(meta, metrics)
+    # Fixed seed: the same rows always give the same interval
+    rng = np.random.default_rng(0)
+    models: Dict[str, Any] = {}
+    for code, model in enumerate(meta["models"]):
+        in_model = columns["model"] == code
+        errors = in_model & (columns["error"] == 1)
+        ok = in_model & ~errors
+        rows = int(in_model.sum())
+        models[model] = {
+            "rows": rows,
+            "errors": int(errors.sum()),
+            "error_rate": float(errors.sum() / rows) if rows else 0.0,
+            "latency_ms": describe(columns["latency_ms"][ok], percentiles, confidence, samples, rng),
+            "metrics": {name: describe(scores[name][ok], percentiles, confidence, samples, rng) for name in names},
+        }
+    return {
+        "rows": int(columns["row_index"].size),
+        "models": models,
+        "metrics": names,
+        "confidence": confidence,
+        "bootstrap_samples": samples,
+    }
+
+
+def _dense(data: Dict[str, Any], model: str, size: int) -> Tuple[np.ndarray, Dict[str, np.ndarray], np.ndarray]:
+    """Scores of one model laid out by row index (NaN for missing or failed rows)."""
+    columns = data["columns"]
+    code = data["meta"]["models"].index(model)
+    ok = (columns["model"] == code) & (columns["error"] == 0)
+    index = columns["row_index"][ok]
+    present = np.zeros(size, dtype=bool)
+    present[index] = True
+    dense = {}
+    for name, values in data["scores"].items():
+        column = np.full(size, np.nan)
+        column[index] = values[ok]
+        dense[name] = column
+    latency = np.full(size, np.nan)
+    latency[index] = columns["latency_ms"][ok]
+    return present, dense, latency
+
+
+def _pairs(meta_a: Dict[str, Any], meta_b: Dict[str, Any], model_a: Optional[str], model_b: Optional[str]) -> List[Tuple[str, str]]:
+    for model, meta in ((model_a, meta_a), (model_b, meta_b)):
+        if model and model not in meta["models"]:
+            raise ValueError(f"Model {model} has no results in job {meta.get('job_id')}")
+    if model_a or model_b:
+        a = model_a or (meta_a["models"][0] if len(meta_a["models"]) == 1 else model_b)
+        b = model_b or (meta_b["models"][0] if len(meta_b["models"]) == 1 else model_a)
+        if a not in meta_a["models"] or b not in meta_b["models"]:
+            raise ValueError("Specify both model_a and model_b")
+        return [(a, b)]
+    if len(meta_a["models"]) == 1 and len(meta_b["models"]) == 1:
+        return [(meta_a["models"][0], meta_b["models"][0])]
+    common = [m for m in meta_a["models"] if m in meta_b["models"]]
+    if not common:
+        raise ValueError("The jobs have no model in common; specify model_a and model_b")
+    return [(m, m) for m in common]
+
+
+def _diff(data_a, data_b, model_a, model_b, metrics, confidence: float, samples: int, top: int) -> Dict[str, Any]:
+    meta_a, meta_b = data_a["meta"], data_b["meta"]
+    names = [m for m in _selected(meta_a, metrics) if m in meta_b["metrics"]]
+    rng = np.random.default_rng(0)
+    size = 1 + max(int(data_a["columns"]["row_index"].max(initial=-1)), int(data_b["columns"]["row_index"].max(initial=-1)))
+    pairs = []
+    for a, b in _pairs(meta_a, meta_b, model_a, model_b):
+        present_a, scores_a, latency_a = _dense(data_a, a, size)
+        present_b, scores_b, latency_b = _dense(data_b, b, size)
+        matched = present_a & present_b
+        pair = {
+            "model_a": a,
+            "model_b": b,
+            "rows": int(matched.sum()),
+            "only_a": int((present_a & ~present_b).sum()),
+            "only_b": int((present_b & ~present_a).sum()),
+            # Lower is better here, so the improved/regressed counts would read backwards
+            "latency_ms": {k: v for k, v in _paired(latency_a, latency_b, matched, confidence, samples, rng, 0).items()
+                           if k in ("count", "mean_a", "mean_b", "delta", "ci")},
+            "metrics": {name: _paired(scores_a[name], scores_b[name], matched, confidence, samples, rng, top) for name in names},
+        }
+        pairs.append(pair)
+    return {"metrics": names, "confidence": confidence, "bootstrap_samples": samples, "pairs": pairs}
+
+
+def _paired(a: np.ndarray, b: np.ndarray, matched: np.ndarray, confidence: float, samples: int, rng, top: int) -> Dict[str, Any]:
+    """Mean of b - a over rows both jobs scored, with a paired bootstrap CI and the largest movers."""
+    both = matched & ~np.isnan(a) & ~np.isnan(b)
+    rows = np.flatnonzero(both)
+    delta = b[rows] - a[rows]
+    if rows.size == 0:
+        return {"count": 0, "mean_a": None, "mean_b": None, "delta": None, "ci": None}
+    result = {
+        "count": int(rows.size),
+        "mean_a": float(a[rows].mean()),
+        "mean_b": float(b[rows].mean()),
+        "delta": float(delta.mean()),
+        "ci": bootstrap_mean_ci(delta, confidence, samples, rng),
+        "improved": int((delta > 0).sum()),
+        "regressed": int((delta < 0).sum()),
+        "unchanged": int((delta == 0).sum()),
+    }
+    if top:
+        def movers(signed: np.ndarray) -> List[Dict[str, Any]]:
+            # Partial selection of the k smallest, then a sort of just those
+            k = min(top, signed.size)
+            picks = np.argpartition(signed, k - 1)[:k]
+            picks = picks[np.argsort(signed[picks], kind="stable")]
+            return [
+                {"row_index": int(rows[i]), "a": float(a[rows[i]]), "b": float(b[rows[i]]), "delta": float(delta[i])}
+                for i in picks if delta[i] != 0
+            ]
+        result["top_regressions"] = movers(delta)
+        result["top_improvements"] = movers(-delta)
+    return result
+
+
+result_columns = ResultColumns()
@@ -0,0 +1,258 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple
+from app.models.metrics import metrics
+
+# Upstream calls in flight across all backends: starts at the initial limit and
+# adapts between min and max to the latency the backends are showing
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+SCHEDULER_INITIAL_LIMIT = int(os.getenv("SCHEDULER_INITIAL_LIMIT", "8"))
+SCHEDULER_MIN_LIMIT = int(os.getenv("SCHEDULER_MIN_LIMIT", "2"))
+SCHEDULER_MAX_LIMIT = int(os.getenv("SCHEDULER_MAX_LIMIT", "64"))
+# Slots only interactive requests may take, so a chat never waits behind a full batch
+SCHEDULER_INTERACTIVE_RESERVE = int(os.getenv("SCHEDULER_INTERACTIVE_RESERVE", "2"))
+# Latency may grow this much over its long-run average before the limit shrinks
+SCHEDULER_LATENCY_TOLERANCE = float(os.getenv("SCHEDULER_LATENCY_TOLERANCE", "1.5"))
+
+# Highest first; a class is only served when every class above it has nothing admissible waiting
+PRIORITIES = ("interactive", "ab", "batch")
+
+SHORT_SMOOTHING = 0.2
+LONG_SMOOTHING = 0.01
+LIMIT_SMOOTHING = 0.2
+
+
+class Ticket:
+    __slots__ = ("priority", "user", "tag", "enqueued", "future", "admitted")
+
+    def __init__(self, priority: str, user: str, tag: float, future: Optional[asyncio.Future] = None):
+        self.priority = priority
+        self.user = user
+        self.tag = tag
+        self.enqueued = time.perf_counter()
+        self.future = future
+        self.admitted = False
+
+
+class LatencyTracker:
+    """Recent latency of one kind of sample against its unloaded baseline."""
+
+    def __init__(self):
+        self.short: Optional[float] = None
+        self.long: Optional[float] = None
+
+    def add(self, value: float) -> float:
+        """Record a sample and return long/short, the latency gradient (below 1 means getting slower)."""
+        if self.short is None:
+            self.short = self.long = value
+        else:
+            self.short += (value - self.short) * SHORT_SMOOTHING
+            # The baseline follows improvements quickly but drifts up slowly, so sustained
+            # queueing keeps registering as slow instead of becoming the new normal
+            self.long += (value - self.long) * (SHORT_SMOOTHING if value < self.long else LONG_SMOOTHING)
+        if self.short <= 0:
+            return 1.0
+        return self.long / self.short
+
+
+class UpstreamScheduler:
+    """
+    Admission control in front of the backends. Requests wait in one queue per
+    priority class; inside a class, users share slots by weighted fair queuing
+    (each user's requests are tagged with a virtual finish time, the smallest
+    tag goes next), so one user's thousand-row batch interleaves with another's
+    ten-row one instead of running ahead of it.
+
+    The concurrency limit follows a gradient rule: while latency stays near its
+    baseline the limit grows towards limit + sqrt(limit), and when it climbs
+    (the GPUs are queueing internally) the limit shrinks in proportion.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = SCHEDULER_ENABLED,
+        initial_limit: int = SCHEDULER_INITIAL_LIMIT,
+        min_limit: int = SCHEDULER_MIN_LIMIT,
+        max_limit: int = SCHEDULER_MAX_LIMIT,
+        interactive_reserve: int = SCHEDULER_INTERACTIVE_RESERVE
+    ):
+        self.enabled = enabled
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.interactive_reserve = interactive_reserve
+        self.active = 0
+        self.active_by_priority: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._queues: Dict[str, List[Tuple[float, int, Ticket]]] = {p: [] for p in PRIORITIES}
+        self._waiting: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._virtual_time: Dict[str, float] = {p: 0.0 for p in PRIORITIES}
+        self._user_finish: Dict[str, Dict[str, float]] = {p: {} for p in PRIORITIES}
+        self.weights: Dict[str, float] = {}
+        self._latency: Dict[str, LatencyTracker] = {}
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.limit_changes = 0
+
+    def set_weight(self, user: str, weight: float):
+        """Relative share of a user within each priority class (default 1)."""
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        self.weights[user] = weight
+
+    def _capacity(self, priority: str) -> int:
+        limit = int(self.limit)
+        if priority == "interactive":
+            return limit
+        # Background classes always keep at least one slot so they are never shut out entirely
+        return max(1, limit - self.interactive_reserve)
+
+    def _admissible(self, priority: str) -> bool:
+        return self.active < self._capacity(priority)
+
+    def _higher_waiting(self, priority: str) -> bool:
+        for p in PRIORITIES:
+            if p == priority:
+                return False
+            if self._waiting[p]:
+                return True
+        return False
+
+    def _admit(self, ticket: Ticket):
+        ticket.admitted = True
+        self.active += 1
+        self.active_by_priority[ticket.priority] += 1
+        self.admitted += 1
+        metrics.observe("llm_scheduler_wait_seconds", time.perf_counter() - ticket.enqueued, priority=ticket.priority)
+
+    async def acquire(self, priority: str = "interactive", user: Optional[str] = None) -> Ticket:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}', use one of {', '.join(PRIORITIES)}")
+        user = user or "anonymous"
+        if not self.enabled:
+            ticket = Ticket(priority, user, 0.0)
+            self._admit(ticket)
+            return ticket
+
+        finish = self._user_finish[priority]
+        tag = max(self._virtual_time[priority], finish.get(user, 0.0)) + 1.0 / self.weights.get(user, 1.0)
+        finish[user] = tag
+        if not self._waiting[priority] and not self._higher_waiting(priority) and self._admissible(priority):
+            ticket = Ticket(priority, user, tag)
+            self._virtual_time[priority] = tag
+            self._admit(ticket)
+            return ticket
+
+        ticket = Ticket(priority, user, tag, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queues[priority], (tag, next(self._seq), ticket))
+        self._waiting[priority] += 1
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.admitted:
+                # Granted in the same tick the caller gave up: hand the slot on
+                self.release(ticket)
+            else:
+                # Left in the heap and skipped when it reaches the top; classes below may now go
+                self._waiting[priority] -= 1
+                self._dispatch()
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket, latency: Optional[float] = None, kind: str = "latency"):
+        """Free the ticket's slot; latency (seconds, of the given kind) feeds the adaptive limit."""
+        if not ticket.admitted:
+            return
+        ticket.admitted = False
+        self.active -= 1
+        self.active_by_priority[ticket.priority] -= 1
+        if latency is not None and latency > 0 and self.enabled:
+            self._adapt(latency, kind)
+        self._dispatch()
+
+    def _adapt(self, latency: float, kind: str):
+        tracker = self._latency.setdefault(kind, LatencyTracker())
+        gradient = tracker.add(latency) * SCHEDULER_LATENCY_TOLERANCE
+        gradient = max(0.5, min(1.0, gradient))
+        # A mostly idle scheduler says nothing about whether more concurrency would help
+        if gradient >= 1.0 and self.active + 1 < self.limit / 2:
+            return
+        target = self.limit + math.sqrt(self.limit) if gradient >= 1.0 else self.limit * gradient
+        limit = self.limit * (1 - LIMIT_SMOOTHING) + target * LIMIT_SMOOTHING
+        limit = min(max(limit, self.min_limit), self.max_limit)
+        if int(limit) != int(self.limit):
+            self.limit_changes += 1
+        self.limit = limit
+
+    def _dispatch(self):
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self._admissible(priority):
+                tag, _, ticket = heapq.heappop(queue)
+                if ticket.future.done():
+                    continue
+                self._waiting[priority] -= 1
+                self._virtual_time[priority] = tag
+                self._admit(ticket)
+                ticket.future.set_result(None)
+            self._reset_idle(priority)
+            if self._waiting[priority]:
+                # Lower classes wait until this one drains
+                return
+
+    def _reset_idle(self, priority: str):
+        if not self._waiting[priority]:
+            # Nothing live is queued: drop cancelled tickets and the finish tags of idle users
+            self._queues[priority].clear()
+            self._user_finish[priority].clear()
+
+    def queue_depth(self) -> Dict[str, int]:
+        return dict(self._waiting)
+
+    def status(self) -> Dict[str, Any]:
+        now = time.perf_counter()
+        oldest = {}
+        for priority, queue in self._queues.items():
+            waiting = [t.enqueued for _, _, t in queue if not t.future.done()]
+            oldest[priority] = (now - min(waiting)) * 1000 if waiting else None
+        return {
+            "enabled": self.enabled,
+            "limit": int(self.limit),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "interactive_reserve": self.interactive_reserve,
+            "active": self.active,
+            "active_by_priority": dict(self.active_by_priority),
+            "queued": self.queue_depth(),
+            "oldest_wait_ms": oldest,
+            "latency": {
+                kind: {"short_ms": t.short * 1000, "long_ms": t.long * 1000}
+                for kind, t in self._latency.items() if t.short is not None
+            },
+            "admitted_total": self.admitted,
+            "limit_changes": self.limit_changes,
+            "weights": dict(self.weights),
+        }
+
+    def render_prometheus(self) -> str:
+        lines = [
+            "# HELP llm_scheduler_limit Current adaptive upstream concurrency limit",
+            "# TYPE llm_scheduler_limit gauge",
+            f"llm_scheduler_limit {int(self.limit)}",
+            "# HELP llm_scheduler_active Upstream calls holding a slot, by priority class",
+            "# TYPE llm_scheduler_active gauge",
+        ]
+        lines += [f'llm_scheduler_active{{priority="{p}"}} {n}' for p, n in self.active_by_priority.items()]
+        lines += [
+            "# HELP llm_scheduler_queued Requests waiting for a slot, by priority class",
+            "# TYPE llm_scheduler_queued gauge",
+        ]
+        lines += [f'llm_scheduler_queued{{priority="{p}"}} {n}' for p, n in self._waiting.items()]
+        return "\n".join(lines) + "\n"
+
+
+scheduler = UpstreamScheduler()
+metrics.describe("llm_scheduler_wait_seconds", "histogram", "Time a request waited for an upstream slot, by priority class")
@@ -1,46 +1,268 @@
+import asyncio
 import httpx
+import json
 import os
-from openai import AsyncOpenAI
-from typing import List, Dict, Any, Optional, AsyncGenerator
+import time
+from typing import List, Dict, Any, Optional, AsyncGenerator, Callable, Awaitable
+from app.models.backends import Backend, BackendPool, failover_errors
+from app.models.history import history
+from app.models.metrics import metrics, RATE_BUCKETS
+from app.models.response_cache import ResponseCache, cache_key
+from app.models.scheduler import scheduler, Ticket
+from app.models.single_flight import SingleFlight
+from app.models.sse_stream import SSEParser
 
-# Default to LM Studio local address
+# Default to LM Studio local address (set LM_STUDIO_BASE_URLS for several backends)
 LM_STUDIO_BASE_URL = os.getenv("LM_STUDIO_BASE_URL", "http://127.0.0.1:1234/v1")
+# Model lists younger than this are served from memory; older ones (up to the
+# stale limit) are served immediately while a refresh runs in the background
+LLM_MODELS_TTL = float(os.getenv("LLM_MODELS_TTL", "5"))
+LLM_MODELS_STALE = float(os.getenv("LLM_MODELS_STALE", "60"))
+
+class TrackedStream:
+    """
+    An async iterator over a generator whose cleanup must run even if it is closed
+    before its first item: closing an unstarted generator skips its finally block,
+    so aclose() then runs on_unstarted_close instead.
+    """
+
+    def __init__(self, items: AsyncGenerator, on_unstarted_close: Callable[[], Awaitable[Any]]):
+        self._items = items
+        self._on_unstarted_close = on_unstarted_close
+        self._started = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        self._started = True
+        return await self._items.__anext__()
+
+    async def aclose(self):
+        if not self._started:
+            self._started = True
+            await self._on_unstarted_close()
+        await self._items.aclose()
 
 class LocalLLMService:
     def __init__(self):
-        self.base_url = LM_STUDIO_BASE_URL
-        self.client = AsyncOpenAI(base_url=self.base_url, api_key="lm-studio")
-        self.http_client = httpx.AsyncClient(base_url=self.base_url)
+        self.pool = BackendPool()
+        self.base_url = self.pool.primary.base_url
+        self.cache = ResponseCache()
+        self.flight = SingleFlight()
+        self.scheduler = scheduler
+
+    # Clients of the first backend, for callers that talk to a single server
+    @property
+    def client(self):
+        return self.pool.primary.client
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        return self.pool.primary.http_client
+
+    async def aclose(self):
+        """Close every backend's connection pool (they are reopened on next use)."""
+        await self.pool.aclose()
+
+    async def _refresh_backends(self):
+        """Refresh backend model lists, coalescing callers and honouring the models TTL."""
+        await self.pool.ensure_started()
+        age = time.monotonic() - self.pool.refreshed_at
+        if age < LLM_MODELS_TTL:
+            return
+        if age < LLM_MODELS_STALE:
+            self.flight.start("backends:refresh", self.pool.refresh_all)
+            return
+        await self.flight.do("backends:refresh", self.pool.refresh_all)
 
     async def check_health(self) -> Dict[str, Any]:
         """
-        Quick ping to check if the server is reachable and list models.
-        Equivalent to: curl http://127.0.0.1:1234/v1/models/
+        Quick ping to check if the servers are reachable and list models.
+        Equivalent to: curl http://127.0.0.1:1234/v1/models/ on every backend
         """
-        try:
-            response = await self.http_client.get("/models")
-            response.raise_for_status()
-            data = response.json()
+        await self._refresh_backends()
+        healthy = [b for b in self.pool.backends if b.healthy]
+        if healthy:
             return {
                 "status": "online",
-                "models": data.get("data", []),
-                "message": "LM Studio is reachable"
-            }
-        except Exception as e:
-            print(f"Health check failed: {e}")
-            return {
-                "status": "offline",
-                "models": [],
-                "message": f"Could not connect to LM Studio at {self.base_url}. Error: {str(e)}"
+                "models": self._merge_models(healthy),
+                "backends": self.pool.status(),
+                "message": f"{len(healthy)}/{len(self.pool.backends)} LM Studio backends reachable"
             }
+        errors = "; ".join(f"{b.base_url}: {b.last_error}" for b in self.pool.backends)
+        print(f"Health check failed: {errors}")
+        return {
+            "status": "offline",
+            "models": [],
+            "backends": self.pool.status(),
+            "message": f"Could not connect to LM Studio. Error: {errors}"
+        }
 
     async def list_models(self) -> List[Dict[str, Any]]:
+        await self._refresh_backends()
+        return self._merge_models([b for b in self.pool.backends if b.healthy])
+
+    def _merge_models(self, backends: List[Backend]) -> List[Dict[str, Any]]:
+        models: Dict[str, Dict[str, Any]] = {}
+        for backend in backends:
+            for model in backend.model_data:
+                models.setdefault(model.get("id"), model)
+        return list(models.values())
+
+    async def _upstream(
+        self,
+        model: Optional[str],
+        endpoint: str,
+        call: Callable[[Backend], Awaitable[Any]],
+        stream: bool = False,
+        payload: Optional[Dict[str, Any]] = None,
+        priority: str = "interactive",
+        user: Optional[str] = None,
+        summarize: Optional[Callable[[Any], Any]] = None
+    ) -> Any:
+        """
+        Run call on the least-loaded healthy backend serving model, failing over
+        to the next one if the backend cannot be reached.
+        The call first waits for a scheduler slot of its priority class; streams
+        keep their slot and their backend counted as busy until they are consumed.
+        Timings are recorded per model and endpoint, and the exchange is
+        appended to the request history (the response as summarize returns it,
+        if given).
+        """
+        labels = {"model": model or "", "endpoint": endpoint}
+        entry = {"ts": time.time(), "endpoint": endpoint, "model": model, "stream": stream, "request": payload,
+                 "priority": priority, "user": user}
+        entered = time.perf_counter()
+        await self.pool.ensure_started()
+        ticket = await self.scheduler.acquire(priority, user)
+        tried = set()
+        last_error: Optional[Exception] = None
+        while True:
+            backend = self.pool.pick(model, tried)
+            if backend is None:
+                self.scheduler.release(ticket)
+                error = last_error or RuntimeError(f"No backend available for model {model}")
+                self._finish(entry, labels, "error", entered, error=error)
+                raise error
+            tried.add(backend)
+            backend.outstanding += 1
+            sent = time.perf_counter()
+            metrics.observe("llm_queue_wait_seconds", sent - entered, **labels)
+            entry["backend"] = backend.base_url
+            try:
+                result = await call(backend)
+            except failover_errors() as e:
+                backend.outstanding -= 1
+                backend.mark_failed(e)
+                last_error = e
+                print(f"Backend {backend.base_url} failed, trying next: {e}")
+                continue
+            except BaseException as e:
+                backend.outstanding -= 1
+                self.scheduler.release(ticket)
+                if isinstance(e, Exception):
+                    self._finish(entry, labels, "error", sent, error=e)
+                raise
+            if stream:
+                return TrackedStream(
+                    self._track_stream(backend, result, entry, labels, sent, ticket),
+                    lambda: self._end_stream(backend, result, entry, labels, sent, ticket, "cancelled")
+                )
+            backend.outstanding -= 1
+            tokens = _usage_tokens(result)
+            # Non-streamed calls report time per output token, so long and short answers compare
+            self.scheduler.release(ticket, (time.perf_counter() - sent) / tokens if tokens else None, kind="token")
+            self._finish(entry, labels, "ok", sent, tokens=tokens, output=(summarize or _dump)(result))
+            return result
+
+    def _finish(
+        self,
+        entry: Dict[str, Any],
+        labels: Dict[str, str],
+        status: str,
+        sent: float,
+        tokens: int = 0,
+        first_token: Optional[float] = None,
+        output: Any = None,
+        error: Optional[Exception] = None
+    ):
+        """Record metrics and history for a finished upstream call."""
+        now = time.perf_counter()
+        duration = now - sent
+        metrics.inc("llm_requests_total", status=status, **labels)
+        if status == "ok":
+            metrics.observe("llm_request_duration_seconds", duration, **labels)
+            if tokens:
+                metrics.inc("llm_output_tokens_total", tokens, **labels)
+                elapsed = now - first_token if first_token is not None else duration
+                if elapsed > 0:
+                    metrics.observe("llm_tokens_per_second", tokens / elapsed, buckets=RATE_BUCKETS, **labels)
+        if history.enabled:
+            history.record({
+                **entry,
+                "status": status,
+                "duration_ms": duration * 1000,
+                "ttft_ms": (first_token - sent) * 1000 if first_token is not None else None,
+                "tokens": tokens,
+                "response": output,
+                "error": str(error) if error is not None else None,
+            })
+
+    async def _track_stream(self, backend: Backend, stream: Any, entry: Dict[str, Any], labels: Dict[str, str], sent: float, ticket: Ticket):
+        first_token: Optional[float] = None
+        tokens = 0
+        parts: List[str] = []
+        status = "error"
         try:
-            response = await self.client.models.list()
-            return [model.model_dump() for model in response.data]
-        except Exception as e:
-            print(f"List models failed: {e}")
-            return []
+            async for item in stream:
+                if _is_token(item):
+                    tokens += 1
+                    if history.enabled:
+                        parts.append(_token_text(item))
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                        metrics.observe("llm_time_to_first_token_seconds", first_token - sent, **labels)
+                yield item
+            status = "ok"
+        except (GeneratorExit, asyncio.CancelledError):
+            status = "cancelled"
+            raise
+        finally:
+            await self._end_stream(backend, stream, entry, labels, sent, ticket, status, tokens, first_token, parts)
+
+    async def _end_stream(
+        self,
+        backend: Backend,
+        stream: Any,
+        entry: Dict[str, Any],
+        labels: Dict[str, str],
+        sent: float,
+        ticket: Ticket,
+        status: str,
+        tokens: int = 0,
+        first_token: Optional[float] = None,
+        parts: Optional[List[str]] = None
+    ):
+        """Give back a stream's slot and backend, record it, and close the upstream stream."""
+        # Bookkeeping first: after a client disconnect any await here may be cancelled
+        backend.outstanding -= 1
+        self.scheduler.release(ticket, first_token - sent if first_token is not None else None, kind="ttft")
+        self._finish(entry, labels, status, sent, tokens=tokens, first_token=first_token,
+                     output={"content": "".join(parts or [])})
+        # Closing the upstream stream stops generation when the consumer goes away
+        await close_stream(stream)
+
+    async def _create_chat(self, params: Dict[str, Any], priority: str, user: Optional[str]) -> Any:
+        return await self._upstream(
+            params["model"],
+            "chat.completions",
+            lambda backend: backend.client.chat.completions.create(**params),
+            stream=params.get("stream", False),
+            payload=params,
+            priority=priority,
+            user=user
+        )
 
     async def chat_completion(
         self, 
@@ -48,7 +270,10 @@ class LocalLLMService:
         model: str, 
         temperature: float = 0.7, 
         max_tokens: int = -1,
-        stream: bool = False
+        stream: bool = False,
+        use_cache: Optional[bool] = None,
+        priority: str = "interactive",
+        user: Optional[str] = None
     ) -> Any:
         params = {
             "model": model,
@@ -59,15 +284,86 @@ class LocalLLMService:
         if max_tokens > 0:
             params["max_tokens"] = max_tokens
 
-        return await self.client.chat.completions.create(**params)
+        # Streamed and non-streamed calls share entries; both store the full completion
+        key = cache_key("chat", {k: v for k, v in params.items() if k != "stream"})
+        caching = self.cache.should_cache(use_cache, temperature)
+        if caching:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                from openai.types.chat import ChatCompletion
+                completion = ChatCompletion.model_validate(cached)
+                return self._replay_chat_stream(completion) if stream else completion
+
+        if stream:
+            response = await self._create_chat(params, priority, user)
+            if caching:
+                return TrackedStream(self._record_chat_stream(key, response), lambda: close_stream(response))
+            return response
+
+        async def fetch():
+            response = await self._create_chat(params, priority, user)
+            if caching:
+                await self.cache.set(key, response.model_dump())
+            return response
+
+        # Identical deterministic requests already in flight share one upstream call
+        if temperature == 0:
+            return await self.flight.do(f"chat:{key}", fetch)
+        return await fetch()
+
+    async def _record_chat_stream(self, key: str, stream: Any):
+        parts: List[str] = []
+        last = None
+        finish_reason = None
+        try:
+            async for chunk in stream:
+                last = chunk
+                if chunk.choices:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                yield chunk
+        finally:
+            # A consumer that stops early closes us; pass that on so the upstream call ends now
+            await close_stream(stream)
+        # Only a stream that ran to completion is worth replaying
+        if last is not None:
+            await self.cache.set(key, {
+                "id": last.id,
+                "object": "chat.completion",
+                "created": last.created,
+                "model": last.model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(parts)},
+                    "finish_reason": finish_reason or "stop"
+                }]
+            })
+
+    async def _replay_chat_stream(self, completion: Any):
+        from openai.types.chat import ChatCompletionChunk
+        choice = completion.choices[0]
+        base = {"id": completion.id, "object": "chat.completion.chunk", "created": completion.created, "model": completion.model}
+        yield ChatCompletionChunk.model_validate({
+            **base,
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": choice.message.content or ""}, "finish_reason": None}]
+        })
+        yield ChatCompletionChunk.model_validate({
+            **base,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": choice.finish_reason or "stop"}]
+        })
 
     async def create_response(
         self,
         model: str,
-        input_text: str,
+        input_text: Any,
         previous_response_id: Optional[str] = None,
         reasoning_effort: Optional[str] = None,
-        stream: bool = False
+        stream: bool = False,
+        use_cache: Optional[bool] = None,
+        priority: str = "interactive",
+        user: Optional[str] = None
     ) -> Any:
         payload = {
             "model": model,
@@ -81,24 +377,135 @@ class LocalLLMService:
         if reasoning_effort:
             payload["reasoning"] = {"effort": reasoning_effort}
 
+        # Responses chained to server-side state are never cached
+        key = None
+        if not previous_response_id and self.cache.should_cache(use_cache, None):
+            key = cache_key("responses", payload)
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return self._replay_events(cached) if stream else cached
+
         # Use httpx directly as this is a custom endpoint
         if stream:
-            return self._stream_response(payload)
+            events = await self._upstream(model, "responses", lambda backend: self._open_response_stream(backend, payload), stream=True, payload=payload,
+                                          priority=priority, user=user)
+            return TrackedStream(self._record_events(key, events), lambda: close_stream(events)) if key else events
         else:
-            response = await self.http_client.post("/responses", json=payload)
-            response.raise_for_status()
-            return response.json()
+            data = await self._upstream(model, "responses", lambda backend: self._post_response(backend, payload), payload=payload,
+                                        priority=priority, user=user)
+            if key:
+                await self.cache.set(key, data)
+            return data
+
+    async def _post_response(self, backend: Backend, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = await backend.http_client.post("/responses", json=payload)
+        response.raise_for_status()
+        return response.json()
 
-    async def _stream_response(self, payload: Dict[str, Any]):
-        async with self.http_client.stream("POST", "/responses", json=payload) as response:
+    async def _open_response_stream(self, backend: Backend, payload: Dict[str, Any]):
+        # Send eagerly so connection failures surface here, where they can fail over
+        request = backend.http_client.build_request("POST", "/responses", json=payload)
+        response = await backend.http_client.send(request, stream=True)
+        if response.is_error:
+            await response.aread()
+            await response.aclose()
             response.raise_for_status()
-            async for line in response.aiter_lines():
-                if line.startswith("event:"):
-                    self.current_event = line.replace("event:", "").strip()
-                elif line.startswith("data:"):
-                    data = line.replace("data:", "").strip()
-                    if data and self.current_event:
-                        yield {"event": self.current_event, "data": data}
-                        self.current_event = None
+        return self._stream_response(response)
+
+    async def _record_events(self, key: str, events: AsyncGenerator):
+        recorded = []
+        try:
+            async for event in events:
+                recorded.append(event)
+                yield event
+        finally:
+            await close_stream(events)
+        await self.cache.set(key, recorded)
+
+    async def _replay_events(self, events: List[Dict[str, Any]]):
+        for event in events:
+            yield event
+
+    async def _stream_response(self, response: httpx.Response):
+        # Parser state lives with the stream: concurrent streams share nothing
+        parser = SSEParser()
+        try:
+            async for chunk in response.aiter_bytes():
+                for event in parser.feed(chunk):
+                    yield event
+        finally:
+            # Also runs when the consumer closes us early: closing the response drops the
+            # upstream connection, which is what stops the backend generating
+            await asyncio.shield(response.aclose())
+
+    async def embeddings(
+        self,
+        texts: List[str],
+        model: str,
+        priority: str = "batch",
+        user: Optional[str] = None
+    ) -> List[List[float]]:
+        """One vector per text, in input order, from the backend's /v1/embeddings."""
+        if not texts:
+            return []
+        payload = {"model": model, "input": texts}
+        response = await self._upstream(
+            model,
+            "embeddings",
+            # Plain floats: not every local server implements the base64 encoding
+            lambda backend: backend.client.embeddings.create(model=model, input=texts, encoding_format="float"),
+            payload=payload,
+            priority=priority,
+            user=user,
+            summarize=_embeddings_summary
+        )
+        data = sorted(response.data, key=lambda item: item.index)
+        if len(data) != len(texts):
+            raise RuntimeError(f"Embeddings response has {len(data)} vectors for {len(texts)} inputs")
+        return [item.embedding for item in data]
+
+async def close_stream(stream: Any):
+    """Close an async generator or OpenAI stream, whichever API it has."""
+    close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+    if close is not None:
+        # Shielded: when a client disconnects, cleanup runs in an already-cancelled scope
+        # and an unshielded close would be abandoned at its first await
+        await asyncio.shield(close())
+
+def _usage_tokens(result: Any) -> int:
+    """Output token count reported by a non-streamed chat completion or Responses payload."""
+    usage = result.get("usage") if isinstance(result, dict) else getattr(result, "usage", None)
+    if usage is None:
+        return 0
+    if isinstance(usage, dict):
+        return usage.get("output_tokens") or usage.get("completion_tokens") or 0
+    return getattr(usage, "completion_tokens", 0) or 0
+
+def _is_token(item: Any) -> bool:
+    """Whether a streamed item carries generated text (chat chunk delta or Responses delta event)."""
+    if isinstance(item, dict):
+        return item.get("event", "").endswith(".delta")
+    choices = getattr(item, "choices", None)
+    return bool(choices) and bool(choices[0].delta.content)
+
+def _token_text(item: Any) -> str:
+    if isinstance(item, dict):
+        try:
+            return json.loads(item["data"]).get("delta") or ""
+        except (ValueError, AttributeError):
+            return ""
+    choices = getattr(item, "choices", None)
+    return (choices[0].delta.content or "") if choices else ""
+
+def _dump(result: Any) -> Any:
+    return result.model_dump() if hasattr(result, "model_dump") else result
+
+def _embeddings_summary(result: Any) -> Dict[str, Any]:
+    # The vectors themselves are not worth a place in the history log
+    return {
+        "model": result.model,
+        "embeddings": len(result.data),
+        "dimensions": len(result.data[0].embedding) if result.data else 0,
+    }
 
 service = LocalLLMService()
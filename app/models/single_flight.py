@@ -0,0 +1,36 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller starts the work,
+    later callers await the same task instead of issuing their own upstream request.
+    The key is released as soon as the task finishes, so nothing is cached here.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    def start(self, key: str, fn: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Return the in-flight task for key, starting fn if there is none."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._release(key, t))
+        return task
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        # Shielded so one cancelled caller does not cancel the work for the others
+        return await asyncio.shield(self.start(key, fn))
+
+    def _release(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark the exception retrieved even if every waiter went away
+            task.exception()
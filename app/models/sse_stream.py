@@ -0,0 +1,205 @@
+import asyncio
+import json
+import os
+from typing import List, Dict, Any, Optional, Callable, AsyncIterator
+from fastapi.responses import StreamingResponse
+from sse_starlette.sse import EventSourceResponse
+
+# Deltas arriving within this window after the first pending one go out as a single write
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "15"))
+# ... unless this many bytes are already pending
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "4096"))
+# Items buffered for a slow client before we stop reading from upstream
+SSE_MAX_PENDING = int(os.getenv("SSE_MAX_PENDING", "512"))
+SSE_PING_INTERVAL = float(os.getenv("SSE_PING_INTERVAL", "15"))
+
+SSE_HEADERS = {"Cache-Control": "no-store", "Connection": "keep-alive", "X-Accel-Buffering": "no"}
+PING_FRAME = b": ping\n\n"
+
+
+def encode_event(data: str, event: Optional[str] = None) -> bytes:
+    """One SSE frame; multi-line data becomes one data: field per line."""
+    if "\n" in data:
+        body = "".join(f"data: {line}\n" for line in data.split("\n"))
+    else:
+        body = f"data: {data}\n"
+    if event:
+        return f"event: {event}\n{body}\n".encode("utf-8")
+    return f"{body}\n".encode("utf-8")
+
+
+class SSEParser:
+    """
+    Incremental parser for one upstream event stream. Feed it raw bytes as they
+    arrive; it returns the events completed so far. Multi-line data fields are
+    joined with newlines, comments and unknown fields are skipped, and lines may
+    end in LF, CRLF or CR, even when a chunk boundary splits them.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._event = b""
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[Dict[str, str]]:
+        buffer = self._buffer + chunk
+        if b"\r" in buffer:
+            # A trailing CR may be the first half of a CRLF split across chunks
+            held = buffer[-1:] if buffer.endswith(b"\r") else b""
+            buffer = buffer[:len(buffer) - len(held)].replace(b"\r\n", b"\n").replace(b"\r", b"\n") + held
+        lines = buffer.split(b"\n")
+        self._buffer = lines.pop()
+        events = []
+        for line in lines:
+            if not line:
+                if self._data:
+                    events.append({
+                        "event": self._event.decode("utf-8", "replace") or "message",
+                        "data": b"\n".join(self._data).decode("utf-8", "replace"),
+                    })
+                self._event = b""
+                self._data = []
+                continue
+            field, colon, value = line.partition(b":")
+            if colon and value.startswith(b" "):
+                value = value[1:]
+            if field == b"data":
+                self._data.append(value)
+            elif field == b"event":
+                self._event = value
+        return events
+
+
+def encode_text(pieces: List[str]) -> bytes:
+    """Merge text deltas into a single {"data": ...} frame: one JSON encode per write, not per token."""
+    return b"data: " + json.dumps({"data": "".join(pieces)}).encode("utf-8") + b"\n\n"
+
+
+def encode_events(events: List[dict]) -> bytes:
+    return b"".join(encode_event(e["data"], e.get("event")) for e in events)
+
+
+async def coalesce(
+    source: AsyncIterator[Any],
+    encode: Callable[[List[Any]], bytes],
+    size: Callable[[Any], int] = len,
+    window: float = SSE_COALESCE_MS / 1000,
+    max_bytes: int = SSE_COALESCE_BYTES,
+    max_pending: int = SSE_MAX_PENDING,
+    ping_interval: float = SSE_PING_INTERVAL
+) -> AsyncIterator[bytes]:
+    """
+    Turn a stream of items into pre-encoded SSE writes.
+
+    A reader task drains `source` into a buffer. The first item is written
+    immediately so time-to-first-token is unchanged; after that, items that arrive
+    within `window` of the oldest pending one are encoded and written together,
+    or sooner once `max_bytes` are pending. When a slow client lets `max_pending`
+    items pile up the reader stops pulling from upstream until the buffer drains.
+    Idle streams get a comment frame every `ping_interval` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    pending: List[Any] = []
+    wake = asyncio.Event()
+    drained = asyncio.Event()
+    state = {"bytes": 0, "since": 0.0, "windowing": False, "done": False, "error": None}
+
+    async def read():
+        try:
+            async for item in source:
+                if not pending:
+                    state["since"] = loop.time()
+                pending.append(item)
+                state["bytes"] += size(item)
+                if not state["windowing"] or state["bytes"] >= max_bytes:
+                    wake.set()
+                if len(pending) >= max_pending:
+                    drained.clear()
+                    await drained.wait()
+        except Exception as e:
+            state["error"] = e
+        finally:
+            state["done"] = True
+            wake.set()
+            close = getattr(source, "aclose", None)
+            if close is not None:
+                await close()
+
+    async def sleep_until_woken(delay: float):
+        timer = loop.call_later(delay, wake.set)
+        try:
+            await wake.wait()
+        finally:
+            timer.cancel()
+
+    reader = asyncio.ensure_future(read())
+    first = True
+    try:
+        while True:
+            if not pending and not state["done"]:
+                wake.clear()
+                await sleep_until_woken(ping_interval)
+                if not pending and not state["done"]:
+                    yield PING_FRAME
+                    continue
+
+            if pending and not first and not state["done"] and state["bytes"] < max_bytes:
+                delay = state["since"] + window - loop.time()
+                if delay > 0:
+                    wake.clear()
+                    state["windowing"] = True
+                    try:
+                        await sleep_until_woken(delay)
+                    finally:
+                        state["windowing"] = False
+
+            if pending:
+                batch = pending[:]
+                pending.clear()
+                state["bytes"] = 0
+                drained.set()
+                first = False
+                yield encode(batch)
+
+            if state["done"] and not pending:
+                if state["error"] is not None:
+                    raise state["error"]
+                break
+    finally:
+        reader.cancel()
+        try:
+            # The reader closes the source as it exits. Shielded because a disconnected
+            # client's cancel scope re-cancels whatever we await, and that would abort the
+            # reader's cleanup and leave the upstream stream open
+            await asyncio.shield(reader)
+        except asyncio.CancelledError:
+            pass
+
+
+class ClosesBody:
+    """
+    Closes the body generator as soon as the response ends, however it ends.
+    On a client disconnect the server cancels the send loop, which can leave the
+    generator suspended at a yield until it is garbage collected; closing it here
+    runs its cleanup at once, so the upstream stream is closed and the backend
+    stops generating for a reader that is gone.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            close = getattr(self.body_iterator, "aclose", None)
+            if close is not None:
+                await close()
+
+
+class EventStreamResponse(ClosesBody, StreamingResponse):
+    """Pre-encoded SSE frames (see coalesce)."""
+
+    def __init__(self, content: AsyncIterator[bytes], **kwargs):
+        super().__init__(content, media_type="text/event-stream", headers=SSE_HEADERS, **kwargs)
+
+
+class ClosingEventSourceResponse(ClosesBody, EventSourceResponse):
+    """EventSourceResponse for event dicts, with the same prompt cleanup."""
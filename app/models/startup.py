@@ -0,0 +1,73 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+
+# Import the openai package in a background thread once the worker is ready, so the
+# first model request does not pay for it (it is otherwise loaded on first use)
+STARTUP_PRELOAD = os.getenv("STARTUP_PRELOAD", "1") != "0"
+
+
+def _process_age() -> Optional[float]:
+    """Seconds since this process started, from /proc (None where unavailable)."""
+    try:
+        with open(f"/proc/{os.getpid()}/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - started)
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class StartupProfile:
+    """
+    Wall-clock timing of one worker's start: how long the process ran before the
+    app module was imported (interpreter and server start-up), each named phase
+    (router imports, app setup, lifespan startup) and the moment it became ready.
+    """
+
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.created_at = time.time()
+        self.before_import = _process_age()
+        self.phases: List[Dict[str, Any]] = []
+        self.ready_ms: Optional[float] = None
+        self.preload: Dict[str, Any] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append({
+                "phase": name,
+                "start_ms": (start - self.created) * 1000,
+                "duration_ms": (time.perf_counter() - start) * 1000,
+            })
+
+    def ready(self):
+        self.ready_ms = (time.perf_counter() - self.created) * 1000
+
+    def run_preload(self):
+        """Load what the first request would otherwise wait for; meant to run in a worker thread."""
+        start = time.perf_counter()
+        try:
+            import openai  # noqa: F401
+            self.preload = {"status": "done", "duration_ms": (time.perf_counter() - start) * 1000}
+        except Exception as e:
+            self.preload = {"status": "failed", "error": str(e)}
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "started_at": self.created_at,
+            "before_import_ms": self.before_import * 1000 if self.before_import is not None else None,
+            "ready_ms": self.ready_ms,
+            "phases": self.phases,
+            "preload": self.preload,
+        }
+
+
+startup = StartupProfile()
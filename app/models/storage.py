@@ -0,0 +1,291 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+DB_FILE = os.getenv("LLM_DEV_DB_FILE", os.path.join(DATA_DIR, "store.db"))
+
+
+class Storage:
+    """
+    Embedded SQLite database shared by all stores.
+    Each collection is a table keyed by the item id, so lookups and upserts
+    go through the primary key index instead of rewriting a whole JSON file.
+    """
+
+    def __init__(self, db_file: str = DB_FILE):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._tables: set = set()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS _migrations (name TEXT PRIMARY KEY)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _ensure_table(self, name: str, key: str, legacy_file: Optional[str]):
+        if name in self._tables:
+            return
+        with self._init_lock:
+            if name in self._tables:
+                return
+            conn = self._connect()
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS "{name}" '
+                "(key TEXT PRIMARY KEY, grp TEXT, data TEXT NOT NULL)"
+            )
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}_grp" ON "{name}" (grp)')
+            if legacy_file:
+                self._import_legacy(conn, name, key, legacy_file)
+            self._tables.add(name)
+
+    def _import_legacy(self, conn: sqlite3.Connection, name: str, key: str, legacy_file: str):
+        # One-off import of the JSON array files used before the database existed
+        if conn.execute("SELECT 1 FROM _migrations WHERE name = ?", (name,)).fetchone():
+            return
+        items = []
+        if os.path.exists(legacy_file):
+            try:
+                with open(legacy_file, "r") as f:
+                    items = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Skipping legacy import of {legacy_file}: {e}")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Checked again under the write lock: another worker process may have imported meanwhile
+            if conn.execute("SELECT 1 FROM _migrations WHERE name = ?", (name,)).fetchone():
+                conn.execute("ROLLBACK")
+                return
+            conn.executemany(
+                f'INSERT OR REPLACE INTO "{name}" (key, grp, data) VALUES (?, NULL, ?)',
+                ((str(item[key]), json.dumps(item)) for item in items if key in item)
+            )
+            conn.execute("INSERT INTO _migrations (name) VALUES (?)", (name,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def collection(self, name: str, key: str = "id", legacy_file: Optional[str] = None) -> "Collection":
+        return Collection(self, name, key, legacy_file)
+
+    def _atomic(self, work: Callable[[], Any], collections: "List[Collection]") -> Any:
+        for collection in collections:
+            collection._conn()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    async def atomic(self, work: Callable[[], Any], *collections: "Collection") -> Any:
+        """
+        Run work() in a worker thread inside one write transaction, so what it reads
+        and writes through the collections' _get/_put/_delete primitives is atomic
+        across processes. The collections it uses are created beforehand.
+        """
+        return await asyncio.to_thread(self._atomic, work, list(collections))
+
+
+class Collection:
+    def __init__(self, storage: Storage, name: str, key: str = "id", legacy_file: Optional[str] = None):
+        self.storage = storage
+        self.name = name
+        self.key = key
+        self.legacy_file = legacy_file
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def _write_lock(self) -> asyncio.Lock:
+        # Created on first use so it binds to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _conn(self) -> sqlite3.Connection:
+        self.storage._ensure_table(self.name, self.key, self.legacy_file)
+        return self.storage._connect()
+
+    # Synchronous primitives, run in a worker thread by the async API below
+    def _list(self, group: Optional[str], offset: int, limit: int) -> List[Dict[str, Any]]:
+        sql = f'SELECT data FROM "{self.name}"'
+        params: List[Any] = []
+        if group is not None:
+            sql += " WHERE grp = ?"
+            params.append(group)
+        sql += " ORDER BY rowid LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        return [json.loads(row[0]) for row in self._conn().execute(sql, params)]
+
+    def _page(self, group: str, after: int, limit: int, offset: int) -> List[Tuple[int, Dict[str, Any]]]:
+        # The group index ends in the rowid, so this seeks straight to the cursor instead of
+        # stepping over every earlier row the way OFFSET does
+        rows = self._conn().execute(
+            f'SELECT rowid, data FROM "{self.name}" WHERE grp = ? AND rowid > ? ORDER BY rowid LIMIT ? OFFSET ?',
+            (group, after, limit, offset)
+        )
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def _between(self, low: str, high: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            f'SELECT data FROM "{self.name}" WHERE key >= ? AND key < ? ORDER BY key', (low, high)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            f'SELECT data FROM "{self.name}" WHERE key = ?', (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put(self, items: List[Dict[str, Any]], group: Optional[str]):
+        # No transaction of its own; callers hold one
+        self._conn().executemany(
+            f'INSERT INTO "{self.name}" (key, grp, data) VALUES (?, ?, ?) '
+            "ON CONFLICT(key) DO UPDATE SET grp = excluded.grp, data = excluded.data",
+            ((str(item[self.key]), group, json.dumps(item)) for item in items)
+        )
+
+    def _upsert_many(self, items: List[Dict[str, Any]], group: Optional[str]):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._put(items, group)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _update(
+        self,
+        key: str,
+        change: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]],
+        group: Optional[str]
+    ) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        # BEGIN IMMEDIATE takes the database write lock, so the read and the write are
+        # atomic across processes as well as threads
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(f'SELECT data FROM "{self.name}" WHERE key = ?', (key,)).fetchone()
+            updated = change(json.loads(row[0]) if row else None)
+            if updated is not None:
+                conn.execute(
+                    f'INSERT INTO "{self.name}" (key, grp, data) VALUES (?, ?, ?) '
+                    "ON CONFLICT(key) DO UPDATE SET grp = excluded.grp, data = excluded.data",
+                    (key, group, json.dumps(updated))
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return updated
+
+    def _delete(self, key: str) -> bool:
+        cur = self._conn().execute(f'DELETE FROM "{self.name}" WHERE key = ?', (key,))
+        return cur.rowcount > 0
+
+    def _delete_group(self, group: str) -> int:
+        cur = self._conn().execute(f'DELETE FROM "{self.name}" WHERE grp = ?', (group,))
+        return cur.rowcount
+
+    def _clear(self) -> int:
+        return self._conn().execute(f'DELETE FROM "{self.name}"').rowcount
+
+    def _trim(self, max_items: int) -> int:
+        # Drop the oldest rows (by insertion order) beyond max_items
+        cur = self._conn().execute(
+            f'DELETE FROM "{self.name}" WHERE rowid IN '
+            f'(SELECT rowid FROM "{self.name}" ORDER BY rowid DESC LIMIT -1 OFFSET ?)',
+            (max_items,)
+        )
+        return cur.rowcount
+
+    def _count(self, group: Optional[str]) -> int:
+        if group is None:
+            row = self._conn().execute(f'SELECT COUNT(*) FROM "{self.name}"').fetchone()
+        else:
+            row = self._conn().execute(
+                f'SELECT COUNT(*) FROM "{self.name}" WHERE grp = ?', (group,)
+            ).fetchone()
+        return row[0]
+
+    # Async API
+    async def list(self, group: Optional[str] = None, offset: int = 0, limit: int = -1) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._list, group, offset, limit)
+
+    async def page(self, group: str, after: int = 0, limit: int = 100, offset: int = 0) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Items of a group in insertion order that come after the cursor `after`, each
+        with its own cursor; pass the last one back to read the next page.
+        """
+        return await asyncio.to_thread(self._page, group, after, limit, offset)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get, str(key))
+
+    async def between(self, low: str, high: str) -> List[Dict[str, Any]]:
+        """Items with low <= key < high, in key order (a primary key range scan)."""
+        return await asyncio.to_thread(self._between, low, high)
+
+    async def count(self, group: Optional[str] = None) -> int:
+        return await asyncio.to_thread(self._count, group)
+
+    async def upsert(self, item: Dict[str, Any], group: Optional[str] = None) -> Dict[str, Any]:
+        async with self._write_lock:
+            await asyncio.to_thread(self._upsert_many, [item], group)
+        return item
+
+    async def upsert_many(self, items: List[Dict[str, Any]], group: Optional[str] = None):
+        if not items:
+            return
+        async with self._write_lock:
+            await asyncio.to_thread(self._upsert_many, items, group)
+
+    async def update(
+        self,
+        key: str,
+        change: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]],
+        group: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Atomically replace an item with change(current) (current is None if missing).
+        change returns the new item, or None to leave it as it is; that value is returned.
+        """
+        async with self._write_lock:
+            return await asyncio.to_thread(self._update, str(key), change, group)
+
+    async def delete(self, key: str) -> bool:
+        async with self._write_lock:
+            return await asyncio.to_thread(self._delete, str(key))
+
+    async def delete_group(self, group: str) -> int:
+        async with self._write_lock:
+            return await asyncio.to_thread(self._delete_group, group)
+
+    async def clear(self) -> int:
+        async with self._write_lock:
+            return await asyncio.to_thread(self._clear)
+
+    async def trim(self, max_items: int) -> int:
+        async with self._write_lock:
+            return await asyncio.to_thread(self._trim, max_items)
+
+
+storage = Storage()
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+
+from app.models.service import service, close_stream
+from app.models.template_engine import CompiledTemplate
+
+# Calls in flight for the model being swept; the next model starts once these drain
+SWEEP_MODEL_CONCURRENCY = int(os.getenv("SWEEP_MODEL_CONCURRENCY", "4"))
+# Upper bound on distinct upstream calls in one sweep (after deduplication)
+SWEEP_MAX_REQUESTS = int(os.getenv("SWEEP_MAX_REQUESTS", "2000"))
+
+
+class SweepError(ValueError):
+    pass
+
+
+class Sweep:
+    """
+    A parameter sweep: every combination of model, prompt, dataset row,
+    temperature and max_tokens. Combinations that would send the same request
+    (same model, rendered prompt and sampling settings) share one upstream call.
+
+    Calls are grouped by model and one model's calls finish before the next
+    model's start, so a backend that loads models on demand swaps at most once
+    per model instead of on every other request.
+    """
+
+    def __init__(
+        self,
+        models: List[str],
+        prompts: List[Tuple[str, CompiledTemplate]],
+        temperatures: List[float],
+        max_tokens: List[int],
+        rows: Optional[List[Tuple[Optional[int], Dict[str, Any]]]] = None,
+        values: Optional[Dict[str, Any]] = None,
+        system_prompt: Optional[str] = None,
+        max_requests: int = SWEEP_MAX_REQUESTS
+    ):
+        models = list(dict.fromkeys(models))
+        if not models or not prompts or not temperatures or not max_tokens:
+            raise SweepError("A sweep needs at least one model, prompt, temperature and max_tokens value")
+        rows = rows or [(None, {})]
+        values = values or {}
+        self.models = models
+        self.system_prompt = system_prompt
+        self.cells: List[Dict[str, Any]] = []
+        self.requests: List[Dict[str, Any]] = []
+
+        # Rendered once per prompt and row; the model and sampling axes reuse the text
+        rendered = [
+            (prompt_id, row_index, compiled.render({**values, **row} if values else row))
+            for prompt_id, compiled in prompts
+            for row_index, row in rows
+        ]
+        settings = list(dict.fromkeys((float(t), m if m > 0 else -1) for t in temperatures for m in max_tokens))
+        for model in models:
+            # Keys are per model, so each model's requests stay contiguous
+            by_key: Dict[Tuple[str, float, int], Dict[str, Any]] = {}
+            for prompt_id, row_index, text in rendered:
+                for temperature, limit in settings:
+                    request = by_key.get((text, temperature, limit))
+                    if request is None:
+                        request = {"request": len(self.requests), "model": model, "prompt": text,
+                                   "temperature": temperature, "max_tokens": limit, "cells": []}
+                        by_key[(text, temperature, limit)] = request
+                        self.requests.append(request)
+                    request["cells"].append(len(self.cells))
+                    self.cells.append({
+                        "cell": len(self.cells),
+                        "model": model,
+                        "prompt_id": prompt_id,
+                        "row_index": row_index,
+                        "temperature": temperature,
+                        "max_tokens": limit,
+                        "request": request["request"],
+                    })
+        if len(self.requests) > max_requests:
+            raise SweepError(f"Sweep needs {len(self.requests)} requests, more than the limit of {max_requests}")
+
+    def _messages(self, prompt: str) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": self.system_prompt}] if self.system_prompt else []
+        return messages + [{"role": "user", "content": prompt}]
+
+    async def _call(self, request: Dict[str, Any], user: Optional[str], use_cache: Optional[bool]) -> Dict[str, Any]:
+        result = {k: request[k] for k in ("request", "model", "temperature", "max_tokens", "cells")}
+        start = time.perf_counter()
+        first_token: Optional[float] = None
+        tokens = 0
+        parts: List[str] = []
+        stream = None
+        try:
+            stream = await service.chat_completion(
+                messages=self._messages(request["prompt"]),
+                model=request["model"],
+                temperature=request["temperature"],
+                max_tokens=request["max_tokens"],
+                stream=True,
+                use_cache=use_cache,
+                priority="ab",
+                user=user
+            )
+            async for chunk in stream:
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if not content:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter()
+                tokens += 1
+                parts.append(content)
+            result["status"] = "success"
+        except Exception as e:
+            result.update({"status": "error", "error": str(e)})
+        finally:
+            if stream is not None:
+                await close_stream(stream)
+        end = time.perf_counter()
+        generation = end - first_token if first_token is not None else 0.0
+        result.update({
+            "response": "".join(parts),
+            "ttft_ms": (first_token - start) * 1000 if first_token is not None else None,
+            "latency_ms": (end - start) * 1000,
+            "tokens": tokens,
+            "tokens_per_second": tokens / generation if generation > 0 else None,
+        })
+        return result
+
+    async def run(
+        self,
+        concurrency: int = SWEEP_MODEL_CONCURRENCY,
+        user: Optional[str] = None,
+        use_cache: Optional[bool] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """(event, data) pairs: sweep_started, then model_started / result... / model_completed per model, then done."""
+        started = time.perf_counter()
+        yield "sweep_started", {
+            "models": self.models,
+            "cells": len(self.cells),
+            "requests": len(self.requests),
+            "deduplicated": len(self.cells) - len(self.requests),
+        }
+        per_model = []
+        for model in self.models:
+            requests = [r for r in self.requests if r["model"] == model]
+            model_started = time.perf_counter()
+            yield "model_started", {"model": model, "requests": len(requests)}
+            results = []
+            async for result in self._run_model(requests, max(1, concurrency), user, use_cache):
+                results.append(result)
+                yield "result", result
+            summary = _summarize(model, results, time.perf_counter() - model_started)
+            per_model.append(summary)
+            yield "model_completed", summary
+        yield "done", {
+            "cells": len(self.cells),
+            "requests": len(self.requests),
+            "deduplicated": len(self.cells) - len(self.requests),
+            "errors": sum(m["errors"] for m in per_model),
+            "duration_ms": (time.perf_counter() - started) * 1000,
+            "models": per_model,
+        }
+
+    async def _run_model(self, requests: List[Dict[str, Any]], concurrency: int, user: Optional[str], use_cache: Optional[bool]):
+        pending: asyncio.Queue = asyncio.Queue()
+        for request in requests:
+            pending.put_nowait(request)
+        done: asyncio.Queue = asyncio.Queue()
+
+        async def worker():
+            while not pending.empty():
+                await done.put(await self._call(pending.get_nowait(), user, use_cache))
+
+        tasks = [asyncio.ensure_future(worker()) for _ in range(min(concurrency, len(requests)))]
+        try:
+            for _ in requests:
+                yield await done.get()
+        finally:
+            # Also runs when the client goes away mid-sweep: stop the calls nobody will read
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _summarize(model: str, results: List[Dict[str, Any]], duration: float) -> Dict[str, Any]:
+    ok = [r for r in results if r["status"] == "success"]
+    ttfts = [r["ttft_ms"] for r in ok if r["ttft_ms"] is not None]
+    return {
+        "model": model,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "duration_ms": duration * 1000,
+        "mean_latency_ms": sum(r["latency_ms"] for r in ok) / len(ok) if ok else None,
+        "mean_ttft_ms": sum(ttfts) / len(ttfts) if ttfts else None,
+        "tokens": sum(r["tokens"] for r in ok),
+    }
@@ -0,0 +1,99 @@
+import os
+import re
+from collections import OrderedDict
+from operator import itemgetter
+from typing import List, Dict, Any, Optional, Tuple
+
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "256"))
+
+VARIABLE_PATTERN = re.compile(r"\{\{\s*([A-Za-z_][\w.-]*)\s*\}\}")
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class CompiledTemplate:
+    """
+    A `{{variable}}` template turned into a str.format pattern, so a render is one
+    C-level format call instead of a scan-and-replace per variable.
+    """
+
+    def __init__(self, content: str, defaults: Optional[Dict[str, Any]] = None):
+        self.content = content
+        self.defaults = {k: _text(v) for k, v in (defaults or {}).items()}
+        self.variables: List[str] = []
+        pattern = []
+        position = 0
+        for match in VARIABLE_PATTERN.finditer(content):
+            pattern.append(_escape(content[position:match.start()], position))
+            name = match.group(1)
+            if name not in self.variables:
+                self.variables.append(name)
+            pattern.append("{%d}" % self.variables.index(name))
+            position = match.end()
+        pattern.append(_escape(content[position:], position))
+        self._format = "".join(pattern).format
+        self._getter = itemgetter(*self.variables) if self.variables else None
+
+    def missing(self, available) -> List[str]:
+        """Variables that neither `available` (names or a mapping) nor the defaults provide."""
+        return [v for v in self.variables if v not in available and v not in self.defaults]
+
+    def render(self, values: Dict[str, Any]) -> str:
+        if self._getter is None:
+            return self.content
+        try:
+            found = self._getter(values)
+        except KeyError:
+            return self._format(*(_text(values[v]) if v in values else self.defaults.get(v, "") for v in self.variables))
+        if len(self.variables) == 1:
+            found = (found,)
+        # format() already stringifies numbers and the like; only None needs mapping to ""
+        if None in found:
+            return self._format(*(_text(v) for v in found))
+        return self._format(*found)
+
+
+def _escape(literal: str, position: int) -> str:
+    if "{{" in literal:
+        offset = position + literal.index("{{")
+        raise TemplateError(f"Unclosed or invalid placeholder at character {offset}: {literal[literal.index('{{'):][:40]!r}")
+    return literal.replace("{", "{{").replace("}", "}}")
+
+
+def _text(value: Any) -> str:
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else str(value)
+
+
+def compile_template(template: Dict[str, Any]) -> CompiledTemplate:
+    return CompiledTemplate(template.get("content", "") or "", template.get("defaults"))
+
+
+class TemplateCache:
+    """Compiled templates keyed by (id, version); saving or deleting a template drops its entries."""
+
+    def __init__(self, max_items: int = TEMPLATE_CACHE_SIZE):
+        self.max_items = max_items
+        self._items: "OrderedDict[Tuple[str, int], CompiledTemplate]" = OrderedDict()
+
+    def get(self, template: Dict[str, Any]) -> CompiledTemplate:
+        key = (str(template.get("id")), int(template.get("version", 0)))
+        compiled = self._items.get(key)
+        if compiled is None:
+            compiled = compile_template(template)
+            self._items[key] = compiled
+            if len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        else:
+            self._items.move_to_end(key)
+        return compiled
+
+    def invalidate(self, template_id: str):
+        for key in [k for k in self._items if k[0] == str(template_id)]:
+            del self._items[key]
+
+
+template_cache = TemplateCache()
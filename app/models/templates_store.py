@@ -1,50 +1,39 @@
-import json
 import os
 from typing import List, Dict, Any, Optional
-import aiofiles
 import uuid
+from app.models.storage import storage, DATA_DIR
+from app.models.template_engine import template_cache, compile_template
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+# Pre-database JSON file, imported into the templates collection on first use
 TEMPLATES_FILE = os.path.join(DATA_DIR, "prompt_templates.json")
 
 class TemplatesStore:
     def __init__(self):
-        self._ensure_data_dir()
-
-    def _ensure_data_dir(self):
-        os.makedirs(DATA_DIR, exist_ok=True)
-        if not os.path.exists(TEMPLATES_FILE):
-            with open(TEMPLATES_FILE, 'w') as f:
-                json.dump([], f)
+        self.templates = storage.collection("prompt_templates", legacy_file=TEMPLATES_FILE)
 
     async def list_templates(self) -> List[Dict[str, Any]]:
-        async with aiofiles.open(TEMPLATES_FILE, 'r') as f:
-            return json.loads(await f.read())
+        return await self.templates.list()
+
+    async def get_template(self, template_id: str) -> Optional[Dict[str, Any]]:
+        return await self.templates.get(template_id)
 
     async def save_template(self, template: Dict[str, Any]) -> Dict[str, Any]:
-        items = await self.list_templates()
+        """Compile (raising TemplateError on bad placeholders) and save as the next version."""
+        compiled = compile_template(template)
         if "id" not in template:
             template["id"] = str(uuid.uuid4())
-            
-        idx = next((i for i, x in enumerate(items) if x["id"] == template["id"]), -1)
-        if idx >= 0:
-            items[idx] = template
-        else:
-            items.append(template)
-            
-        async with aiofiles.open(TEMPLATES_FILE, 'w') as f:
-            await f.write(json.dumps(items, indent=2))
-        return template
+        template["variables"] = compiled.variables
+
+        def bump(existing: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            # Read and written in one transaction, so concurrent saves get distinct versions
+            template["version"] = (existing or {}).get("version", 0) + 1
+            return template
+
+        template_cache.invalidate(template["id"])
+        return await self.templates.update(template["id"], bump)
 
     async def delete_template(self, template_id: str) -> bool:
-        items = await self.list_templates()
-        initial_len = len(items)
-        items = [x for x in items if x["id"] != template_id]
-        
-        if len(items) < initial_len:
-            async with aiofiles.open(TEMPLATES_FILE, 'w') as f:
-                await f.write(json.dumps(items, indent=2))
-            return True
-        return False
+        template_cache.invalidate(template_id)
+        return await self.templates.delete(template_id)
 
 templates_store = TemplatesStore()
@@ -0,0 +1,361 @@
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.models.single_flight import SingleFlight
+from app.models.tools_store import tools_store
+
+# Base URL used to resolve tool endpoints given as paths (e.g. /api/tools/calculator)
+TOOL_BASE_URL = os.getenv("TOOL_BASE_URL", "http://127.0.0.1:8000")
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "30"))
+TOOL_RETRIES = int(os.getenv("TOOL_RETRIES", "2"))
+TOOL_MAX_PARALLEL = int(os.getenv("TOOL_MAX_PARALLEL", "8"))
+TOOL_CACHE_ITEMS = int(os.getenv("TOOL_CACHE_ITEMS", "1024"))
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "300"))
+
+Validator = Callable[[Any, str], List[str]]
+
+JSON_TYPES = {
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool) or isinstance(v, float) and v.is_integer(),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "null": lambda v: v is None,
+}
+
+
+class ToolError(Exception):
+    pass
+
+
+def compile_schema(schema: Optional[Dict[str, Any]]) -> Validator:
+    """
+    Compile the JSON Schema subset tools use (type, enum, const, properties, required,
+    additionalProperties, items, numeric/length bounds, pattern) into nested closures,
+    so each call only runs the checks its schema declares. Missing properties with a
+    `default` are filled in. Unknown keywords are ignored.
+    """
+    if not schema:
+        return lambda value, path: []
+    checks: List[Validator] = []
+
+    types = schema.get("type")
+    if types:
+        names = [types] if isinstance(types, str) else list(types)
+        testers = [JSON_TYPES[t] for t in names if t in JSON_TYPES]
+        if testers:
+            checks.append(lambda v, p: [] if any(t(v) for t in testers) else [f"{p or 'arguments'}: expected {' or '.join(names)}"])
+
+    if "enum" in schema:
+        options = schema["enum"]
+        checks.append(lambda v, p: [] if v in options else [f"{p}: must be one of {options}"])
+    if "const" in schema:
+        constant = schema["const"]
+        checks.append(lambda v, p: [] if v == constant else [f"{p}: must equal {constant!r}"])
+
+    for key, test, message in (
+        ("minimum", lambda v, b: v >= b, "must be >= {}"),
+        ("maximum", lambda v, b: v <= b, "must be <= {}"),
+        ("exclusiveMinimum", lambda v, b: v > b, "must be > {}"),
+        ("exclusiveMaximum", lambda v, b: v < b, "must be < {}"),
+    ):
+        if isinstance(schema.get(key), (int, float)):
+            checks.append(_bound(schema[key], test, message, lambda v: JSON_TYPES["number"](v)))
+    for key, test, message, applies in (
+        ("minLength", lambda v, b: len(v) >= b, "must have at least {} characters", JSON_TYPES["string"]),
+        ("maxLength", lambda v, b: len(v) <= b, "must have at most {} characters", JSON_TYPES["string"]),
+        ("minItems", lambda v, b: len(v) >= b, "must have at least {} items", JSON_TYPES["array"]),
+        ("maxItems", lambda v, b: len(v) <= b, "must have at most {} items", JSON_TYPES["array"]),
+    ):
+        if isinstance(schema.get(key), int):
+            checks.append(_bound(schema[key], test, message, applies))
+    if isinstance(schema.get("pattern"), str):
+        regex = re.compile(schema["pattern"])
+        checks.append(lambda v, p: [] if not isinstance(v, str) or regex.search(v) else [f"{p}: does not match {regex.pattern!r}"])
+
+    properties = {name: compile_schema(sub) for name, sub in (schema.get("properties") or {}).items()}
+    defaults = {name: sub["default"] for name, sub in (schema.get("properties") or {}).items() if isinstance(sub, dict) and "default" in sub}
+    required = list(schema.get("required") or [])
+    additional = schema.get("additionalProperties", True)
+    extra = compile_schema(additional) if isinstance(additional, dict) else None
+    if properties or required or additional is not True:
+        def check_object(value: Any, path: str) -> List[str]:
+            if not isinstance(value, dict):
+                return []
+            errors = [f"{path}.{name}: is required" if path else f"{name}: is required"
+                      for name in required if name not in value and name not in defaults]
+            for name, default in defaults.items():
+                value.setdefault(name, default)
+            for name, item in value.items():
+                child = f"{path}.{name}" if path else name
+                if name in properties:
+                    errors += properties[name](item, child)
+                elif additional is False:
+                    errors.append(f"{child}: unexpected property")
+                elif extra is not None:
+                    errors += extra(item, child)
+            return errors
+        checks.append(check_object)
+
+    if isinstance(schema.get("items"), dict):
+        item_check = compile_schema(schema["items"])
+        checks.append(lambda v, p: [e for i, item in enumerate(v) for e in item_check(item, f"{p}[{i}]")] if isinstance(v, list) else [])
+
+    if len(checks) == 1:
+        return checks[0]
+
+    def validate(value: Any, path: str) -> List[str]:
+        errors: List[str] = []
+        for check in checks:
+            errors += check(value, path)
+        return errors
+    return validate
+
+
+def _bound(bound: Any, test: Callable[[Any, Any], bool], message: str, applies: Callable[[Any], bool]) -> Validator:
+    text = message.format(bound)
+    return lambda v, p: [] if not applies(v) or test(v, bound) else [f"{p}: {text}"]
+
+
+def canonical_arguments(arguments: Dict[str, Any]) -> str:
+    return json.dumps(arguments, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class CompiledTool:
+    """A tool definition checked and prepared for calls; an invalid definition raises ToolError."""
+
+    def __init__(self, tool: Dict[str, Any]):
+        self.source = tool
+        try:
+            self.name = tool["name"]
+            self.endpoint = tool.get("endpoint", "")
+            if not isinstance(self.endpoint, str) or not self.endpoint.strip():
+                raise ToolError(f"Tool {self.name!r} has no endpoint")
+            self.method = tool.get("method", "POST").upper()
+            self.validate = compile_schema(tool.get("input_schema"))
+            # Only tools declared idempotent are cached and retried after a request may have reached them
+            self.idempotent = bool(tool.get("idempotent", tool.get("cacheable", False)))
+            self.timeout = float(tool.get("timeout", TOOL_TIMEOUT))
+            self.retries = int(tool.get("retries", TOOL_RETRIES))
+            self.cache_ttl = float(tool.get("cache_ttl", TOOL_CACHE_TTL))
+            url = self.endpoint if urlsplit(self.endpoint).scheme else TOOL_BASE_URL.rstrip("/") + "/" + self.endpoint.lstrip("/")
+        except KeyError as e:
+            raise ToolError(f"Tool definition is missing {e}")
+        except (re.error, AttributeError, TypeError, ValueError) as e:
+            raise ToolError(f"Invalid tool {tool.get('name')!r}: {e}")
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            raise ToolError(f"Tool {self.name!r} endpoint {url!r} is not an http(s) URL")
+        self.origin = f"{parts.scheme}://{parts.netloc}"
+        self.path = url[len(self.origin):] or "/"
+
+
+class ToolRuntime:
+    """
+    Executes model tool calls: arguments are checked against each tool's compiled
+    input_schema, calls in one turn run in parallel, requests reuse one pooled
+    client per endpoint origin, and results of idempotent tools are cached by
+    canonical arguments (identical concurrent calls share one request).
+    """
+
+    def __init__(self, max_parallel: int = TOOL_MAX_PARALLEL, cache_items: int = TOOL_CACHE_ITEMS):
+        self.max_parallel = max_parallel
+        self.cache_items = cache_items
+        self._compiled: Dict[str, CompiledTool] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._limit: Optional[asyncio.Semaphore] = None
+        self.flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def limit(self) -> asyncio.Semaphore:
+        # Created on first use so it binds to the running event loop
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.max_parallel)
+        return self._limit
+
+    async def get_tool(self, name: str) -> CompiledTool:
+        tool = await tools_store.get_tool(name)
+        if tool is None:
+            self.invalidate(name)
+            raise ToolError(f"Unknown tool {name!r}")
+        if tool.get("enabled") is False:
+            raise ToolError(f"Tool {name!r} is disabled")
+        compiled = self._compiled.get(name)
+        # Recompile only when the stored definition changed
+        if compiled is None or compiled.source != tool:
+            compiled = CompiledTool(tool)
+            self._compiled[name] = compiled
+            self._drop_cached(name)
+        return compiled
+
+    async def save_tool(self, tool: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a tool definition after compiling it, so a bad schema or setting is rejected here and not on call."""
+        CompiledTool(tool)
+        self.invalidate(tool["name"])
+        return await tools_store.save_tool(tool)
+
+    def invalidate(self, name: str):
+        self._compiled.pop(name, None)
+        self._drop_cached(name)
+
+    def _drop_cached(self, name: str):
+        for key in [k for k in self._cache if k[0] == name]:
+            del self._cache[key]
+
+    def _client(self, origin: str) -> httpx.AsyncClient:
+        client = self._clients.get(origin)
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=origin,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+                timeout=httpx.Timeout(TOOL_TIMEOUT, connect=5)
+            )
+            self._clients[origin] = client
+        return client
+
+    async def definitions(self, names: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Enabled tools in the OpenAI `tools` request format."""
+        tools = await tools_store.list_tools()
+        return [
+            {"type": "function", "function": {
+                "name": t["name"],
+                "description": t.get("description", ""),
+                "parameters": t.get("input_schema") or {"type": "object", "properties": {}},
+            }}
+            for t in tools if t.get("enabled", True) and (names is None or t["name"] in names)
+        ]
+
+    async def call(self, name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Run one tool call; failures are returned as {"ok": False, "error": ...}, not raised."""
+        start = time.perf_counter()
+        result: Dict[str, Any] = {"name": name, "ok": False, "cached": False}
+        try:
+            tool = await self.get_tool(name)
+            if not isinstance(arguments, dict):
+                raise ToolError("Tool arguments must be a JSON object")
+            errors = tool.validate(arguments, "")
+            if errors:
+                raise ToolError("Invalid arguments: " + "; ".join(errors))
+            if tool.idempotent:
+                key = (name, canonical_arguments(arguments))
+                cached = self._cache_get(key)
+                if cached is not None:
+                    self.hits += 1
+                    result.update(cached, cached=True)
+                else:
+                    self.misses += 1
+                    response = await self.flight.do(f"tool:{key[0]}:{key[1]}", lambda: self._dispatch(tool, arguments))
+                    self._cache_set(key, response, tool.cache_ttl)
+                    result.update(response)
+            else:
+                result.update(await self._dispatch(tool, arguments))
+            result["ok"] = True
+        except ToolError as e:
+            result["error"] = str(e)
+        result["duration_ms"] = (time.perf_counter() - start) * 1000
+        return result
+
+    async def _dispatch(self, tool: CompiledTool, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        client = self._client(tool.origin)
+        attempt = 0
+        while True:
+            try:
+                async with self.limit:
+                    if tool.method == "GET":
+                        response = await client.get(tool.path, params=arguments, timeout=tool.timeout)
+                    else:
+                        response = await client.request(tool.method, tool.path, json=arguments, timeout=tool.timeout)
+                if response.status_code >= 500 or response.status_code == 429:
+                    raise httpx.HTTPStatusError(f"{tool.name} returned {response.status_code}", request=response.request, response=response)
+                if response.status_code >= 400:
+                    raise ToolError(f"{tool.name} returned {response.status_code}: {response.text[:200]}")
+                content = response.text
+                try:
+                    data = response.json()
+                except ValueError:
+                    data = None
+                return {"content": content, "data": data, "status": response.status_code}
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                # A request that may have reached the tool is only repeated for idempotent tools
+                retryable = tool.idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not retryable or attempt >= tool.retries:
+                    raise ToolError(f"{tool.name} failed: {e}")
+                await asyncio.sleep(0.2 * 2 ** attempt)
+                attempt += 1
+            except (httpx.HTTPError, httpx.InvalidURL, httpx.StreamError, TypeError, ValueError) as e:
+                # Bad URLs, unsupported schemes and arguments that cannot be encoded never succeed on a retry
+                raise ToolError(f"{tool.name} failed: {e}")
+
+    def _cache_get(self, key: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return value
+
+    def _cache_set(self, key: Tuple[str, str], value: Dict[str, Any], ttl: float):
+        if ttl <= 0:
+            return
+        self._cache[key] = (time.monotonic() + ttl, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_items:
+            self._cache.popitem(last=False)
+
+    async def execute_tool_calls(self, tool_calls: List[Any]) -> List[Dict[str, Any]]:
+        """
+        Run a model turn's tool_calls (OpenAI objects or dicts) in parallel.
+        Returns one result per call, in order, each with a `message` ready to append
+        to the conversation as the tool's reply.
+        """
+        async def run(call: Any) -> Dict[str, Any]:
+            call = call if isinstance(call, dict) else call.model_dump()
+            function = call.get("function") or {}
+            name = function.get("name", "")
+            raw = function.get("arguments") or "{}"
+            try:
+                arguments = json.loads(raw) if isinstance(raw, str) else raw
+            except ValueError as e:
+                result = {"name": name, "ok": False, "cached": False, "error": f"Arguments are not valid JSON: {e}", "duration_ms": 0.0}
+            else:
+                result = await self.call(name, arguments)
+            result["tool_call_id"] = call.get("id")
+            result["message"] = {
+                "role": "tool",
+                "tool_call_id": call.get("id"),
+                "content": result.get("content", "") if result["ok"] else json.dumps({"error": result["error"]}),
+            }
+            return result
+
+        return list(await asyncio.gather(*(run(c) for c in tool_calls)))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "compiled": len(self._compiled),
+            "clients": sorted(self._clients),
+            "cache_items": len(self._cache),
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+        }
+
+    async def aclose(self):
+        clients, self._clients = list(self._clients.values()), {}
+        await asyncio.gather(*(c.aclose() for c in clients))
+
+
+tool_runtime = ToolRuntime()
@@ -0,0 +1,386 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, AsyncGenerator, Tuple
+
+from app.models.service import service
+from app.models.tool_runtime import tool_runtime
+from app.models.tools_store import tools_store
+
+DEFAULT_AGENT_MODEL = os.getenv("WORKFLOW_DEFAULT_MODEL", "")
+WORKFLOW_CACHE_SIZE = int(os.getenv("WORKFLOW_CACHE_SIZE", "256"))
+
+NODE_TYPES = ("start", "end", "agent", "tool", "condition")
+PLACEHOLDER_PATTERN = re.compile(r"\{\{(input|prev_output)\}\}")
+DEFAULT_PROMPT = "{{prev_output}}"
+DEFAULT_INPUT_TEMPLATE = '{"input": "{{prev_output}}"}'
+
+
+class WorkflowError(Exception):
+    pass
+
+
+class NodeTemplate:
+    """
+    An agent prompt or tool input template with its {{input}} and {{prev_output}}
+    placeholders turned into str.format slots once, at compile time.
+    """
+
+    def __init__(self, content: str):
+        self.content = content
+        pattern = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(content):
+            pattern.append(content[position:match.start()].replace("{", "{{").replace("}", "}}"))
+            pattern.append("{0}" if match.group(1) == "input" else "{1}")
+            position = match.end()
+        pattern.append(content[position:].replace("{", "{{").replace("}", "}}"))
+        self._format = "".join(pattern).format
+
+    def render(self, input_text: str, prev_output: str) -> str:
+        return self._format(input_text, prev_output)
+
+
+def json_escape(value: str) -> str:
+    return json.dumps(value)[1:-1]
+
+
+def parse_condition(expression: str) -> Callable[[str], bool]:
+    """
+    Turn a condition expression into a predicate over the previous output.
+    Supported: contains:x, equals:x, startswith:x, >:n, <:n
+    """
+    op, sep, arg = expression.partition(":")
+    op = op.strip().lower()
+    if not sep:
+        raise WorkflowError(f"Invalid condition expression: {expression!r}")
+    if op == "contains":
+        needle = arg.lower()
+        return lambda value: needle in value.lower()
+    if op == "equals":
+        return lambda value: value.strip() == arg.strip()
+    if op == "startswith":
+        return lambda value: value.strip().lower().startswith(arg.strip().lower())
+    if op in (">", "<"):
+        try:
+            threshold = float(arg)
+        except ValueError:
+            raise WorkflowError(f"Invalid numeric condition: {expression!r}")
+
+        def compare(value: str) -> bool:
+            try:
+                number = float(value.strip())
+            except ValueError:
+                return False
+            return number > threshold if op == ">" else number < threshold
+        return compare
+    raise WorkflowError(f"Unknown condition operator: {op!r}")
+
+
+def node_type(node: Dict[str, Any]) -> str:
+    return str(node.get("type", "")).lower()
+
+
+def node_config(node: Dict[str, Any]) -> Dict[str, Any]:
+    return node.get("data") or node.get("config") or {}
+
+
+def edge_branch(edge: Dict[str, Any]) -> Optional[bool]:
+    """Branch an edge leaving a Condition node belongs to (None for plain edges)."""
+    label = edge.get("branch", edge.get("sourceHandle", edge.get("label")))
+    if label is None:
+        return None
+    label = str(label).lower()
+    if label in ("true", "yes"):
+        return True
+    if label in ("false", "no"):
+        return False
+    return None
+
+
+class CompiledNode:
+    """One node with everything its execution needs resolved up front."""
+
+    def __init__(self, node: Dict[str, Any], tools: Dict[str, str]):
+        self.id = node["id"]
+        self.type = node_type(node)
+        config = node_config(node)
+        if self.type not in NODE_TYPES:
+            raise WorkflowError(f"Unsupported node type {self.type!r} for node {self.id}")
+        if self.type == "agent":
+            self.model = config.get("model") or DEFAULT_AGENT_MODEL
+            if not self.model:
+                raise WorkflowError(f"Agent node {self.id} has no model")
+            self.system_prompt = config.get("system_prompt")
+            self.prompt = NodeTemplate(config.get("prompt", DEFAULT_PROMPT))
+            self.temperature = config.get("temperature", 0.7)
+            self.max_tokens = config.get("max_tokens", -1)
+        elif self.type == "tool":
+            tool_id = config.get("tool_id", config.get("tool"))
+            if not tool_id:
+                raise WorkflowError(f"Tool node {self.id} has no tool_id")
+            if tool_id not in tools:
+                raise WorkflowError(f"Tool node {self.id} uses unknown tool {tool_id!r}")
+            self.tool = tools[tool_id]
+            self.input_template = NodeTemplate(config.get("input_template", DEFAULT_INPUT_TEMPLATE))
+            try:
+                # Placeholders are filled JSON-escaped, so a probe value shows whether every run will parse
+                json.loads(self.input_template.render("0", "0"))
+            except json.JSONDecodeError as e:
+                raise WorkflowError(f"Tool node {self.id} input template is not valid JSON: {e}")
+        elif self.type == "condition":
+            self.expression = config.get("expression", config.get("condition", ""))
+            self.predicate = parse_condition(self.expression)
+
+
+class CompiledWorkflow:
+    """
+    A workflow graph validated and turned into an execution plan: node configs
+    parsed, tool references resolved, edges checked and indexed, and the nodes
+    in topological order. Runs of the same version share one plan.
+    """
+
+    def __init__(self, workflow: Dict[str, Any], tools: Optional[Dict[str, str]] = None):
+        self.workflow = workflow
+        self.nodes: Dict[str, CompiledNode] = {}
+        for node in workflow.get("nodes") or []:
+            if not isinstance(node, dict) or not node.get("id"):
+                raise WorkflowError(f"Node has no id: {node}")
+            if node["id"] in self.nodes:
+                raise WorkflowError(f"Duplicate node id {node['id']!r}")
+            self.nodes[node["id"]] = CompiledNode(node, tools or {})
+        if not self.nodes:
+            raise WorkflowError("Workflow has no nodes")
+
+        # Incoming edges as (source, branch): branch is the Condition outcome the edge needs, or None
+        self.incoming: Dict[str, List[Tuple[str, Optional[bool]]]] = {nid: [] for nid in self.nodes}
+        # One entry per edge, so a node waits for as many settled sources as it has incoming edges
+        self.successors: Dict[str, List[str]] = {nid: [] for nid in self.nodes}
+        for edge in workflow.get("edges") or []:
+            source, target = edge.get("source"), edge.get("target")
+            if source not in self.nodes or target not in self.nodes:
+                raise WorkflowError(f"Edge references unknown node: {edge}")
+            branch = edge_branch(edge) if self.nodes[source].type == "condition" else None
+            self.incoming[target].append((source, branch))
+            self.successors[source].append(target)
+        self.sinks = [nid for nid in self.nodes if not self.successors[nid]]
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        waiting = {nid: len(self.incoming[nid]) for nid in self.nodes}
+        order = [nid for nid, count in waiting.items() if count == 0]
+        for node_id in order:
+            for successor in self.successors[node_id]:
+                waiting[successor] -= 1
+                if waiting[successor] == 0:
+                    order.append(successor)
+        if len(order) < len(self.nodes):
+            cyclic = [nid for nid in self.nodes if waiting[nid] > 0]
+            raise WorkflowError(f"Workflow graph contains a cycle through: {', '.join(cyclic)}")
+        return order
+
+    @property
+    def id(self) -> Optional[str]:
+        return self.workflow.get("id")
+
+    @property
+    def version(self) -> int:
+        return int(self.workflow.get("version", 0))
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "version": self.version,
+            "order": self.order,
+            "sinks": self.sinks,
+            "tools": sorted({n.tool for n in self.nodes.values() if n.type == "tool"}),
+        }
+
+
+async def compile_workflow(workflow: Dict[str, Any]) -> CompiledWorkflow:
+    """Validate a workflow and build its plan; raises WorkflowError describing the first problem found."""
+    tool_ids = {
+        node_config(node).get("tool_id", node_config(node).get("tool"))
+        for node in workflow.get("nodes") or []
+        if isinstance(node, dict) and node_type(node) == "tool"
+    }
+    tools = {}
+    for tool_id in filter(None, tool_ids):
+        tool = await tools_store.get_tool(tool_id)
+        if tool is not None:
+            tools[tool_id] = tool["name"]
+    return CompiledWorkflow(workflow, tools)
+
+
+class WorkflowCache:
+    """Compiled workflows keyed by (id, version); saving or deleting a workflow drops its entries."""
+
+    def __init__(self, max_items: int = WORKFLOW_CACHE_SIZE):
+        self.max_items = max_items
+        self._items: "OrderedDict[Tuple[str, int], CompiledWorkflow]" = OrderedDict()
+
+    def add(self, plan: CompiledWorkflow):
+        self._items[(str(plan.id), plan.version)] = plan
+        self._items.move_to_end((str(plan.id), plan.version))
+        if len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    async def get(self, workflow: Dict[str, Any]) -> CompiledWorkflow:
+        key = (str(workflow.get("id")), int(workflow.get("version", 0)))
+        plan = self._items.get(key)
+        if plan is None:
+            # Saved by another worker, or before workflows were compiled on save
+            plan = await compile_workflow(workflow)
+            self.add(plan)
+        else:
+            self._items.move_to_end(key)
+        return plan
+
+    def invalidate(self, workflow_id: str):
+        for key in [k for k in self._items if k[0] == str(workflow_id)]:
+            del self._items[key]
+
+
+workflow_cache = WorkflowCache()
+
+
+class WorkflowRun:
+    def __init__(self, plan: CompiledWorkflow, input_text: str):
+        self.run_id = str(uuid.uuid4())
+        self.plan = plan
+        self.input_text = input_text
+        self.outputs: Dict[str, str] = {}
+        self.status: Dict[str, str] = {}
+        self.branch_taken: Dict[str, bool] = {}
+        self.events: asyncio.Queue = asyncio.Queue()
+
+    def _emit(self, event: str, **data):
+        self.events.put_nowait({"event": event, "data": {"run_id": self.run_id, **data}})
+
+    def _edge_active(self, source: str, branch: Optional[bool]) -> bool:
+        if self.status.get(source) != "completed":
+            return False
+        return branch is None or branch == self.branch_taken.get(source)
+
+    async def _execute_node(self, node: CompiledNode, prev_output: str) -> str:
+        if node.type == "start":
+            return self.input_text
+        if node.type == "end":
+            return prev_output
+        if node.type == "agent":
+            messages = []
+            if node.system_prompt:
+                messages.append({"role": "system", "content": node.system_prompt})
+            messages.append({"role": "user", "content": node.prompt.render(self.input_text, prev_output)})
+            response = await service.chat_completion(
+                messages=messages,
+                model=node.model,
+                temperature=node.temperature,
+                max_tokens=node.max_tokens
+            )
+            return response.choices[0].message.content or ""
+        if node.type == "tool":
+            return await self._call_tool(node, prev_output)
+        # condition
+        self.branch_taken[node.id] = node.predicate(prev_output)
+        return prev_output
+
+    async def _call_tool(self, node: CompiledNode, prev_output: str) -> str:
+        # Substituted values are JSON-escaped so outputs with quotes keep the template valid
+        rendered = node.input_template.render(json_escape(self.input_text), json_escape(prev_output))
+        try:
+            payload = json.loads(rendered)
+        except json.JSONDecodeError as e:
+            raise WorkflowError(f"Tool node {node.id} input is not valid JSON: {e}")
+        result = await tool_runtime.call(node.tool, payload)
+        if not result["ok"]:
+            raise WorkflowError(f"Tool node {node.id}: {result['error']}")
+        return result["content"]
+
+    async def _run_node(self, node_id: str):
+        node = self.plan.nodes[node_id]
+        incoming = self.plan.incoming[node_id]
+        active = [source for source, branch in incoming if self._edge_active(source, branch)]
+        if incoming and not active:
+            # Every path into this node was pruned by a Condition or a skipped node
+            self.status[node_id] = "skipped"
+            self._emit("node_skipped", node_id=node_id, type=node.type)
+            return
+        prev_output = "\n\n".join(self.outputs[source] for source in active)
+
+        self._emit("node_started", node_id=node_id, type=node.type)
+        start = time.perf_counter()
+        try:
+            output = await self._execute_node(node, prev_output)
+        except Exception as e:
+            self.status[node_id] = "failed"
+            self._emit("node_failed", node_id=node_id, error=str(e),
+                       duration_ms=(time.perf_counter() - start) * 1000)
+            raise
+        self.outputs[node_id] = output
+        self.status[node_id] = "completed"
+        event = {"node_id": node_id, "output": output, "duration_ms": (time.perf_counter() - start) * 1000}
+        if node_id in self.branch_taken:
+            event["branch"] = self.branch_taken[node_id]
+        self._emit("node_completed", **event)
+
+    async def execute(self):
+        """Run the plan, starting every node as soon as all its predecessors have settled."""
+        start = time.perf_counter()
+        self._emit("workflow_started", workflow_id=self.plan.id, version=self.plan.version)
+        waiting = {nid: len(self.plan.incoming[nid]) for nid in self.plan.order}
+        running: Dict[asyncio.Task, str] = {}
+        error: Optional[str] = None
+
+        def launch(node_id: str):
+            running[asyncio.create_task(self._run_node(node_id))] = node_id
+
+        try:
+            for node_id in self.plan.order:
+                if waiting[node_id] == 0:
+                    launch(node_id)
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    node_id = running.pop(task)
+                    if task.exception() is not None:
+                        error = str(task.exception())
+                        continue
+                    for successor in self.plan.successors[node_id]:
+                        waiting[successor] -= 1
+                        if waiting[successor] == 0:
+                            launch(successor)
+                if error:
+                    break
+        finally:
+            for task in running:
+                task.cancel()
+            # Let the cancelled nodes finish unwinding before the workflow reports its result
+            await asyncio.gather(*running, return_exceptions=True)
+
+        sinks = [nid for nid in self.plan.sinks if self.status.get(nid) == "completed"]
+        self._emit(
+            "workflow_completed" if error is None else "workflow_failed",
+            status="completed" if error is None else "failed",
+            error=error,
+            output="\n\n".join(self.outputs[nid] for nid in sinks),
+            outputs=self.outputs,
+            duration_ms=(time.perf_counter() - start) * 1000
+        )
+        self.events.put_nowait(None)
+
+    async def stream(self) -> AsyncGenerator[Dict[str, Any], None]:
+        task = asyncio.create_task(self.execute())
+        try:
+            while True:
+                event = await self.events.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            if not task.done():
+                task.cancel()
@@ -1,58 +1,48 @@
-import json
 import os
 from typing import List, Dict, Any, Optional
-import aiofiles
 import uuid
+from app.models.storage import storage, DATA_DIR
+from app.models.workflow_engine import CompiledWorkflow, workflow_cache, compile_workflow
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+# Pre-database JSON file, imported into the workflows collection on first use
 WORKFLOWS_FILE = os.path.join(DATA_DIR, "workflows.json")
 
 class WorkflowStore:
     def __init__(self):
-        self._ensure_data_dir()
-
-    def _ensure_data_dir(self):
-        os.makedirs(DATA_DIR, exist_ok=True)
-        if not os.path.exists(WORKFLOWS_FILE):
-            with open(WORKFLOWS_FILE, 'w') as f:
-                json.dump([], f)
+        self.workflows = storage.collection("workflows", legacy_file=WORKFLOWS_FILE)
 
     async def list_workflows(self) -> List[Dict[str, Any]]:
-        async with aiofiles.open(WORKFLOWS_FILE, 'r') as f:
-            content = await f.read()
-            return json.loads(content)
+        return await self.workflows.list()
 
     async def save_workflow(self, workflow: Dict[str, Any]) -> Dict[str, Any]:
-        workflows = await self.list_workflows()
-        
+        """Compile (raising WorkflowError on an invalid graph) and save as the next version."""
+        plan = await compile_workflow(workflow)
         if "id" not in workflow:
             workflow["id"] = str(uuid.uuid4())
-            
-        existing_idx = next((i for i, w in enumerate(workflows) if w["id"] == workflow["id"]), -1)
-        
-        if existing_idx >= 0:
-            workflows[existing_idx] = workflow
-        else:
-            workflows.append(workflow)
-            
-        async with aiofiles.open(WORKFLOWS_FILE, 'w') as f:
-            await f.write(json.dumps(workflows, indent=2))
-        
-        return workflow
+
+        def bump(existing: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+            # Read and written in one transaction, so concurrent saves get distinct versions
+            workflow["version"] = (existing or {}).get("version", 0) + 1
+            return workflow
+
+        workflow_cache.invalidate(workflow["id"])
+        saved = await self.workflows.update(workflow["id"], bump)
+        # The plan holds this same dict, so it now carries the id and version it was saved under
+        workflow_cache.add(plan)
+        return saved
 
     async def delete_workflow(self, workflow_id: str) -> bool:
-        workflows = await self.list_workflows()
-        initial_len = len(workflows)
-        workflows = [w for w in workflows if w["id"] != workflow_id]
-        
-        if len(workflows) < initial_len:
-            async with aiofiles.open(WORKFLOWS_FILE, 'w') as f:
-                await f.write(json.dumps(workflows, indent=2))
-            return True
-        return False
+        workflow_cache.invalidate(workflow_id)
+        return await self.workflows.delete(workflow_id)
 
     async def get_workflow(self, workflow_id: str) -> Optional[Dict[str, Any]]:
-        workflows = await self.list_workflows()
-        return next((w for w in workflows if w["id"] == workflow_id), None)
+        return await self.workflows.get(workflow_id)
+
+    async def get_plan(self, workflow_id: str) -> Optional[CompiledWorkflow]:
+        """The workflow's execution plan, compiled once per version."""
+        workflow = await self.workflows.get(workflow_id)
+        if workflow is None:
+            return None
+        return await workflow_cache.get(workflow)
 
 workflow_store = WorkflowStore()
@@ -1,38 +1,219 @@
 from fastapi import APIRouter, HTTPException
-from typing import List, Dict, Any
+from app.models.sse_stream import ClosingEventSourceResponse
+from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
-from app.models.service import service
+from app.models.service import service, close_stream
+from app.models.sweep import Sweep, SweepError, SWEEP_MODEL_CONCURRENCY
+from app.models.template_engine import CompiledTemplate, template_cache, TemplateError
+from app.models.templates_store import templates_store
+from app.models.eval_store import eval_store
 import asyncio
+import json
+import os
+import time
 
 router = APIRouter()
 
+# Streams allowed per model at once across all A/B requests; extra variants wait their turn
+AB_MODEL_CONCURRENCY = int(os.getenv("AB_MODEL_CONCURRENCY", "2"))
+_model_limits: Dict[str, asyncio.Semaphore] = {}
+
+def _limit_for(model: str) -> asyncio.Semaphore:
+    if model not in _model_limits:
+        _model_limits[model] = asyncio.Semaphore(AB_MODEL_CONCURRENCY)
+    return _model_limits[model]
+
 class ABTestRequest(BaseModel):
     prompt: str
     models: List[str]
     temperature: float = 0.7
+    max_tokens: int = -1
+    user: Optional[str] = None
+
+class SweepRequest(BaseModel):
+    models: List[str]
+    # Saved prompt templates and/or inline prompts; both may use {{variables}}
+    template_ids: List[str] = []
+    prompts: List[str] = []
+    temperatures: List[float] = [0.7]
+    max_tokens: List[int] = [-1]
+    # Fill the prompts from these dataset rows (row values win over values)
+    dataset_id: Optional[str] = None
+    row_offset: int = 0
+    row_limit: int = 10
+    values: Dict[str, Any] = {}
+    system_prompt: Optional[str] = None
+    # Reject the sweep if a prompt variable is in neither the dataset columns, values nor defaults
+    strict: bool = True
+    concurrency: int = SWEEP_MODEL_CONCURRENCY
+    use_cache: Optional[bool] = None
+    user: Optional[str] = None
 
 @router.post("/api/ab-test")
 async def run_ab_test(request: ABTestRequest):
     """Run the same prompt against multiple models in parallel"""
     
     async def call_model(model_name):
+        start = time.perf_counter()
         try:
             response = await service.chat_completion(
                 messages=[{"role": "user", "content": request.prompt}],
                 model=model_name,
-                temperature=request.temperature
+                temperature=request.temperature,
+                priority="ab",
+                user=request.user
             )
             return {
                 "model": model_name,
                 "response": response.choices[0].message.content,
+                "latency_ms": (time.perf_counter() - start) * 1000,
                 "status": "success"
             }
         except Exception as e:
             return {
                 "model": model_name,
                 "error": str(e),
+                "latency_ms": (time.perf_counter() - start) * 1000,
                 "status": "error"
             }
 
     results = await asyncio.gather(*(call_model(m) for m in request.models))
     return {"results": results}
+
+@router.post("/api/ab-test/stream")
+async def stream_ab_test(request: ABTestRequest):
+    """
+    Stream every variant's tokens over one SSE connection as they arrive.
+    Events are tagged with the variant index; each variant reports TTFT and tokens/sec when it finishes.
+    """
+    if not request.models:
+        raise HTTPException(status_code=400, detail="At least one model is required")
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run_variant(variant: int, model: str):
+        tag = {"variant": variant, "model": model}
+        queued = time.perf_counter()
+        stream = None
+        try:
+            async with _limit_for(model):
+                start = time.perf_counter()
+                await queue.put(("variant_started", {**tag, "queue_ms": (start - queued) * 1000}))
+                stream = await service.chat_completion(
+                    messages=[{"role": "user", "content": request.prompt}],
+                    model=model,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens,
+                    stream=True,
+                    priority="ab",
+                    user=request.user
+                )
+                first_token: Optional[float] = None
+                tokens = 0
+                async for chunk in stream:
+                    content = chunk.choices[0].delta.content if chunk.choices else None
+                    if not content:
+                        continue
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    tokens += 1
+                    await queue.put(("delta", {**tag, "content": content}))
+            end = time.perf_counter()
+            generation = end - first_token if first_token is not None else 0.0
+            await queue.put(("variant_completed", {
+                **tag,
+                "ttft_ms": (first_token - start) * 1000 if first_token is not None else None,
+                "latency_ms": (end - start) * 1000,
+                "tokens": tokens,
+                "tokens_per_second": tokens / generation if generation > 0 else None,
+            }))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(("variant_error", {**tag, "error": str(e)}))
+        finally:
+            if stream is not None:
+                await close_stream(stream)
+
+    async def event_generator():
+        tasks = [asyncio.create_task(run_variant(i, m)) for i, m in enumerate(request.models)]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                event, data = await queue.get()
+                if event in ("variant_completed", "variant_error"):
+                    remaining -= 1
+                yield {"event": event, "data": json.dumps(data)}
+            yield {"event": "done", "data": json.dumps({"variants": len(tasks)})}
+        finally:
+            # Runs on client disconnect too: stop generating for variants nobody will read
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    return ClosingEventSourceResponse(event_generator())
+
+async def _build_sweep(request: SweepRequest) -> Sweep:
+    prompts = []
+    try:
+        for template_id in request.template_ids:
+            template = await templates_store.get_template(template_id)
+            if template is None:
+                raise HTTPException(status_code=404, detail=f"Template not found: {template_id}")
+            prompts.append((template_id, template_cache.get(template)))
+        prompts += [(f"prompt:{i}", CompiledTemplate(prompt)) for i, prompt in enumerate(request.prompts)]
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    rows = None
+    columns = set()
+    if request.dataset_id:
+        dataset = await eval_store.get_dataset(request.dataset_id)
+        if dataset is None:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        columns = set(dataset.get("columns", []))
+        page = await eval_store.get_dataset_rows(request.dataset_id, request.row_offset, request.row_limit)
+        rows = [(request.row_offset + i, row) for i, row in enumerate(page)]
+    if request.strict:
+        # Checked once per prompt against the dataset's columns, not per row
+        missing = {prompt_id: compiled.missing(columns | set(request.values)) for prompt_id, compiled in prompts}
+        missing = {k: v for k, v in missing.items() if v}
+        if missing:
+            raise HTTPException(status_code=400, detail={"message": "Prompt variables not provided", "missing": missing})
+    try:
+        return Sweep(request.models, prompts, request.temperatures, request.max_tokens,
+                     rows=rows, values=request.values, system_prompt=request.system_prompt)
+    except SweepError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/api/ab-test/sweep")
+async def run_sweep(request: SweepRequest):
+    """
+    Run a model x prompt x row x temperature x max_tokens grid. Identical requests run once;
+    each model's requests run together so the backend is not made to swap models back and forth.
+    """
+    sweep = await _build_sweep(request)
+    results = []
+    summary = {}
+    async for event, data in sweep.run(request.concurrency, request.user, request.use_cache):
+        if event == "result":
+            results.append(data)
+        elif event == "done":
+            summary = data
+    results.sort(key=lambda r: r["request"])
+    return {"summary": summary, "cells": sweep.cells, "results": results}
+
+@router.post("/api/ab-test/sweep/stream")
+async def stream_sweep(request: SweepRequest):
+    """Stream sweep results as each request completes, with per-model timing summaries"""
+    sweep = await _build_sweep(request)
+
+    async def event_generator():
+        events = sweep.run(request.concurrency, request.user, request.use_cache)
+        try:
+            yield {"event": "cells", "data": json.dumps(sweep.cells)}
+            async for event, data in events:
+                yield {"event": event, "data": json.dumps(data)}
+        finally:
+            await close_stream(events)
+
+    return ClosingEventSourceResponse(event_generator())
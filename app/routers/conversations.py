@@ -0,0 +1,36 @@
+from fastapi import APIRouter, HTTPException
+from app.models.conversations import conversation_store
+from typing import List, Dict, Any, Optional
+
+router = APIRouter()
+
+@router.get("/api/conversations")
+async def list_conversations():
+    return await conversation_store.list()
+
+@router.post("/api/conversations")
+async def create_conversation(conversation: Dict[str, Any]):
+    """Start a server-side conversation; pass its id as conversation_id to /api/chat"""
+    try:
+        return await conversation_store.create(conversation)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/api/conversations/{id}")
+async def get_conversation(id: str):
+    conversation = await conversation_store.get(id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+@router.get("/api/conversations/{id}/messages")
+async def list_messages(id: str, offset: int = 0, limit: int = 100):
+    if await conversation_store.get(id) is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return await conversation_store.list_messages(id, offset=offset, limit=limit)
+
+@router.delete("/api/conversations/{id}")
+async def delete_conversation(id: str):
+    if not await conversation_store.delete(id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"success": True}
@@ -1,30 +1,199 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sse_starlette.sse import EventSourceResponse
 from app.models.eval_store import eval_store
-from app.models.evaluators import BUILTIN_EVALUATORS
-from typing import List, Dict, Any
+from app.models.dataset_io import DatasetFormatError, detect_format, parse_rows, encode_jsonl, encode_csv
+from app.models.eval_runner import eval_runner
+from app.models.embeddings import similarity_scorer, SEMANTIC_SIMILARITY, EMBEDDING_DEFAULT_MODEL
+from app.models.evaluators import BUILTIN_EVALUATORS, evaluate_batch
+from app.models.result_columns import EVAL_BOOTSTRAP_SAMPLES
+from app.models.judge import judge_runner, JudgeDefinition, JudgeError, is_judge
+from typing import List, Dict, Any, Optional
+from pydantic import BaseModel
+import asyncio
+import json
 
 router = APIRouter()
 
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
 # Datasets
 @router.get("/api/datasets")
 async def list_datasets():
+    """Dataset summaries (row counts and columns, no rows)"""
     return await eval_store.list_datasets()
 
 @router.post("/api/datasets")
 async def create_dataset(dataset: Dict[str, Any]):
     return await eval_store.save_dataset(dataset)
 
+@router.post("/api/datasets/upload")
+async def upload_dataset(request: Request, name: Optional[str] = None, format: Optional[str] = None):
+    """
+    Stream a JSONL or CSV file into a new dataset, either as the raw request body
+    or as the 'file' field of a multipart form. Rows are parsed and stored in
+    segments as they arrive, so memory use does not grow with the file.
+    """
+    content_type = request.headers.get("content-type", "")
+    form = None
+    if content_type.startswith("multipart/form-data"):
+        # Starlette spools file parts to disk past 1MB, so this does not buffer the file in memory
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Multipart upload needs a 'file' field")
+        filename = upload.filename or ""
+        file_type = upload.content_type or ""
+        name = name or form.get("name")
+
+        async def chunks():
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    return
+                yield chunk
+    else:
+        filename = request.headers.get("x-filename", "")
+        file_type = content_type
+        chunks = request.stream
+
+    fmt = (format or detect_format(filename, file_type)).lower()
+    dataset = {"name": name or filename or "Uploaded dataset", "format": fmt, "source": filename}
+    try:
+        return await eval_store.ingest_dataset(dataset, parse_rows(chunks(), fmt))
+    except DatasetFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        if form is not None:
+            await form.close()
+
+@router.get("/api/datasets/{id}")
+async def get_dataset(id: str):
+    dataset = await eval_store.get_dataset(id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return dataset
+
+@router.delete("/api/datasets/{id}")
+async def delete_dataset(id: str):
+    if not await eval_store.delete_dataset(id):
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return {"success": True}
+
+@router.get("/api/datasets/{id}/rows")
+async def get_dataset_rows(id: str, offset: int = 0, limit: int = 100):
+    """A page of rows; offset/limit select any range without loading the rest"""
+    dataset = await eval_store.get_dataset(id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    if offset < 0 or limit < 1 or limit > 10000:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit between 1 and 10000")
+    rows = await eval_store.get_dataset_rows(id, offset=offset, limit=limit)
+    return {"total": dataset.get("row_count", 0), "offset": offset, "limit": limit, "rows": rows}
+
+@router.get("/api/datasets/{id}/export")
+async def export_dataset(id: str, format: str = "jsonl"):
+    """Stream the dataset back out as JSONL or CSV, one segment at a time"""
+    dataset = await eval_store.get_dataset(id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    if format not in ("jsonl", "csv"):
+        raise HTTPException(status_code=400, detail="format must be jsonl or csv")
+    columns = dataset.get("columns", [])
+
+    async def export_generator():
+        first = True
+        async for _, rows in eval_store.iter_dataset_segments(id):
+            yield encode_csv(rows, columns, header=first) if format == "csv" else encode_jsonl(rows)
+            first = False
+
+    media_type = "text/csv" if format == "csv" else "application/jsonl"
+    filename = f"{dataset.get('name') or id}.{format}".replace('"', "").encode("ascii", "ignore").decode()
+    return StreamingResponse(
+        export_generator(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 # Evaluators
 @router.get("/api/evaluators")
 async def list_evaluators():
     custom = await eval_store.list_evaluators()
     builtin = [{"name": name, "type": "builtin"} for name in BUILTIN_EVALUATORS.keys()]
+    builtin.append({"name": SEMANTIC_SIMILARITY, "type": "embedding", "default_model": EMBEDDING_DEFAULT_MODEL or None})
     return {"builtin": builtin, "custom": custom}
 
+class ScoreRequest(BaseModel):
+    predictions: List[str]
+    references: List[str]
+    metrics: Optional[List[str]] = None
+
+@router.post("/api/evaluators/score")
+async def score_batch(request: ScoreRequest):
+    """Score columns of predictions against references with the batch engine"""
+    try:
+        result = await asyncio.to_thread(evaluate_batch, request.predictions, request.references, request.metrics)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "scores": {metric: values.tolist() for metric, values in result["scores"].items()},
+        "corpus": result["corpus"]
+    }
+
+class SimilarityRequest(BaseModel):
+    predictions: List[str]
+    references: List[str]
+    model: Optional[str] = None
+
+@router.post("/api/evaluators/semantic-similarity")
+async def score_similarity(request: SimilarityRequest):
+    """Cosine similarity of prediction and reference embeddings (cached like in jobs)"""
+    model = request.model or EMBEDDING_DEFAULT_MODEL
+    if not model:
+        raise HTTPException(status_code=400, detail="model is required (or set EMBEDDING_DEFAULT_MODEL)")
+    try:
+        scores = await similarity_scorer.score_many(model, request.predictions, request.references)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"model": model, "scores": scores}
+
+@router.get("/api/evaluators/embeddings/stats")
+async def embedding_stats():
+    """Embedding requests, texts embedded and vector cache hits"""
+    return similarity_scorer.get_stats()
+
+class JudgeRequest(BaseModel):
+    # Each item: prediction, reference and optionally input (plus any columns the prompt uses)
+    items: List[Dict[str, Any]]
+
 @router.post("/api/evaluators/custom")
 async def create_custom_evaluator(evaluator: Dict[str, Any]):
+    """Save a custom evaluator; type "llm_judge" definitions are validated first"""
+    if is_judge(evaluator):
+        try:
+            JudgeDefinition(evaluator)
+        except JudgeError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     return await eval_store.save_evaluator(evaluator)
 
+@router.post("/api/evaluators/custom/{id}/judge")
+async def run_judge(id: str, request: JudgeRequest):
+    """Score items with an LLM-as-judge evaluator (batched and cached like in jobs)"""
+    evaluator = next((e for e in await eval_store.list_evaluators() if id in (e.get("id"), e.get("name"))), None)
+    if evaluator is None or not is_judge(evaluator):
+        raise HTTPException(status_code=404, detail="Judge evaluator not found")
+    try:
+        definition = JudgeDefinition(evaluator)
+    except JudgeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    verdicts = await judge_runner.judge_many(definition, request.items)
+    return {"verdicts": verdicts, "batched": definition.batchable}
+
+@router.get("/api/evaluators/judge/stats")
+async def judge_stats():
+    """Judge requests, batched items, parse failures and verdict cache hit rate"""
+    return await judge_runner.get_stats()
+
 # Jobs
 @router.get("/api/eval-jobs")
 async def list_jobs():
@@ -35,6 +204,108 @@ async def create_job(job: Dict[str, Any]):
     return await eval_store.save_job(job)
 
 @router.post("/api/eval-jobs/{id}/run")
-async def run_job(id: str):
-    # Placeholder for job execution logic
-    return {"status": "started", "message": "Evaluation job execution not yet implemented"}
+async def run_job(id: str, restart: bool = False):
+    """Queue a job (or its resumption) for the next free worker; pass restart=true to discard saved rows"""
+    try:
+        progress = await eval_runner.start(id, restart=restart)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job not found")
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "started", "job_id": id, "progress": progress}
+
+@router.post("/api/eval-jobs/{id}/cancel")
+async def cancel_job(id: str):
+    if not await eval_runner.cancel(id):
+        raise HTTPException(status_code=404, detail="Job is not running")
+    return {"success": True}
+
+async def _job_progress(id: str) -> Dict[str, Any]:
+    progress = await eval_runner.get_progress(id)
+    if progress is not None:
+        return {"job_id": id, **progress}
+    job = await eval_store.get_job(id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": id, "status": job.get("status", "pending"), **job.get("progress", {})}
+
+@router.get("/api/eval-jobs/{id}/progress")
+async def get_job_progress(id: str):
+    return await _job_progress(id)
+
+@router.get("/api/eval-jobs/{id}/events")
+async def stream_job_progress(id: str, request: Request):
+    """Server-sent progress snapshots until the job stops running"""
+    await _job_progress(id)
+
+    async def progress_generator():
+        last = None
+        while not await request.is_disconnected():
+            snapshot = await _job_progress(id)
+            if snapshot != last:
+                last = dict(snapshot)
+                yield {"event": "progress", "data": json.dumps(snapshot)}
+            if not await eval_runner.is_active(id):
+                break
+            await asyncio.sleep(0.5)
+        yield {"event": "done", "data": json.dumps(last)}
+
+    return EventSourceResponse(progress_generator())
+
+@router.get("/api/eval-jobs/{id}/results")
+async def get_job_results(id: str):
+    return await eval_store.list_job_results(id)
+
+def _csv_list(value: Optional[str]) -> Optional[List[str]]:
+    return [v.strip() for v in value.split(",") if v.strip()] if value else None
+
+async def _job_columns(id: str):
+    if await eval_store.get_job(id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {id} not found")
+    await eval_store.ensure_result_columns(id)
+
+@router.get("/api/eval-jobs/{id}/aggregate")
+async def aggregate_job(
+    id: str,
+    metrics: Optional[str] = None,
+    percentiles: str = "5,25,50,75,95",
+    confidence: float = 0.95,
+    bootstrap: int = EVAL_BOOTSTRAP_SAMPLES
+):
+    """Per-model, per-metric mean/std/percentiles with bootstrap confidence intervals"""
+    if not 0 < confidence < 1 or not 0 <= bootstrap <= 10000:
+        raise HTTPException(status_code=400, detail="confidence must be in (0, 1) and bootstrap in [0, 10000]")
+    try:
+        points = [float(p) for p in _csv_list(percentiles) or []]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="percentiles must be comma-separated numbers")
+    if any(not 0 <= p <= 100 for p in points):
+        raise HTTPException(status_code=400, detail="percentiles must be between 0 and 100")
+    await _job_columns(id)
+    try:
+        return await eval_store.columns.aggregate(id, _csv_list(metrics), points, confidence, bootstrap)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/api/eval-jobs/{id}/diff/{other_id}")
+async def diff_jobs(
+    id: str,
+    other_id: str,
+    model_a: Optional[str] = None,
+    model_b: Optional[str] = None,
+    metrics: Optional[str] = None,
+    confidence: float = 0.95,
+    bootstrap: int = EVAL_BOOTSTRAP_SAMPLES,
+    top: int = 10
+):
+    """Paired per-row comparison of two jobs (other minus this), with CIs and the rows that moved most"""
+    if not 0 < confidence < 1 or not 0 <= bootstrap <= 10000 or not 0 <= top <= 1000:
+        raise HTTPException(status_code=400, detail="confidence must be in (0, 1), bootstrap in [0, 10000], top in [0, 1000]")
+    await _job_columns(id)
+    await _job_columns(other_id)
+    try:
+        return await eval_store.columns.diff(id, other_id, model_a, model_b, _csv_list(metrics), confidence, bootstrap, top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
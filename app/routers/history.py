@@ -0,0 +1,78 @@
+from fastapi import APIRouter, HTTPException
+from app.models.sse_stream import ClosingEventSourceResponse
+from pydantic import BaseModel
+from typing import List, Dict, Any, Optional, Union
+from app.models.history import history
+from app.models.replay import Replayer
+import asyncio
+import json
+import time
+
+router = APIRouter()
+
+class ReplayRequest(BaseModel):
+    start: float = 0.0
+    end: Optional[float] = None
+    # Target backend, e.g. http://127.0.0.1:1234/v1 (defaults to the first configured backend)
+    base_url: Optional[str] = None
+    # "1x", "10x", 2.5 or "max"
+    speed: Union[str, float] = "1x"
+    concurrency: Optional[int] = None
+    # Send every request to this model instead of the recorded one
+    model: Optional[str] = None
+
+def _summary(record: Dict[str, Any]) -> Dict[str, Any]:
+    keys = ("id", "ts", "endpoint", "model", "backend", "stream", "status", "duration_ms", "ttft_ms", "tokens", "error")
+    return {k: record.get(k) for k in keys}
+
+@router.get("/api/history")
+async def list_history(start: float = 0.0, end: Optional[float] = None, limit: int = 100, newest: bool = True):
+    """Recorded upstream calls in a time range (epoch seconds), without payloads; most recent first unless newest=false"""
+    records = await history.query(start, end if end is not None else time.time(), limit, newest=newest)
+    return [_summary(r) for r in records]
+
+@router.get("/api/history/stats")
+async def history_stats():
+    return await history.stats()
+
+@router.get("/api/history/{id}")
+async def get_history_record(id: str):
+    record = await history.get(id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    return record
+
+@router.post("/api/history/replay")
+async def replay_history(request: ReplayRequest):
+    """Replay a recorded window against a backend, streaming progress and a final summary"""
+    records = await history.query(request.start, request.end if request.end is not None else time.time())
+    try:
+        replayer = Replayer(records, request.base_url, request.speed, request.concurrency, request.model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not replayer.records:
+        raise HTTPException(status_code=404, detail="No replayable records in that window")
+
+    async def event_generator():
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def on_progress(snapshot: Dict[str, Any]):
+            await queue.put(("progress", snapshot))
+
+        async def run():
+            try:
+                await queue.put(("summary", await replayer.run(on_progress)))
+            except Exception as e:
+                await queue.put(("error", {"error": str(e)}))
+
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event, data = await queue.get()
+                yield {"event": event, "data": json.dumps(data)}
+                if event != "progress":
+                    break
+        finally:
+            task.cancel()
+
+    return ClosingEventSourceResponse(event_generator())
@@ -0,0 +1,42 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from app.models.metrics import metrics
+from app.models.service import service
+from app.models.startup import startup
+
+router = APIRouter()
+
+class WeightRequest(BaseModel):
+    user: str
+    weight: float
+
+@router.get("/api/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Upstream latency/throughput metrics in Prometheus text format"""
+    text = metrics.render_prometheus() + service.scheduler.render_prometheus()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@router.get("/api/metrics/json")
+async def json_metrics():
+    """Same metrics summarized (count, mean, p50/p90/p99) for the UI"""
+    return {**metrics.snapshot(), "backends": service.pool.status(), "scheduler": service.scheduler.status()}
+
+@router.get("/api/startup")
+async def startup_profile():
+    """This worker's start-up timing: time before the app import, import and setup phases, time to ready"""
+    return startup.report()
+
+@router.get("/api/scheduler")
+async def scheduler_status():
+    """Concurrency limit, slots in use and queue depth per priority class"""
+    return service.scheduler.status()
+
+@router.post("/api/scheduler/weights")
+async def set_weight(request: WeightRequest):
+    """Give a user a larger (or smaller) share of upstream capacity"""
+    try:
+        service.scheduler.set_weight(request.user, request.weight)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "weights": service.scheduler.weights}
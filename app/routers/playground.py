@@ -1,8 +1,11 @@
 from fastapi import APIRouter, HTTPException, Request
-from sse_starlette.sse import EventSourceResponse
-from app.models.service import service
-from typing import List, Dict, Any, Optional
+from app.models.service import service, close_stream
+from app.models.sse_stream import coalesce, encode_text, encode_events, encode_event, EventStreamResponse
+from app.models.conversations import conversation_store, ContextBudgetError, response_text
+from typing import List, Dict, Any, Optional, Callable, Awaitable
 from pydantic import BaseModel
+import httpx
+import json
 
 router = APIRouter()
 
@@ -16,6 +19,12 @@ class ChatRequest(BaseModel):
     input: Optional[str] = None
     previous_response_id: Optional[str] = None
     reasoning_effort: Optional[str] = None
+    # None follows the server default (cache temperature-0 requests when enabled)
+    use_cache: Optional[bool] = None
+    # Server-side conversation: messages/input then carry only the new turn
+    conversation_id: Optional[str] = None
+    # Who is asking; upstream capacity is shared fairly between users
+    user: Optional[str] = None
 
 @router.get("/api/models")
 async def list_models():
@@ -28,60 +37,176 @@ async def check_health():
     """Quick ping to check server status"""
     return await service.check_health()
 
+@router.get("/api/cache")
+async def cache_stats():
+    """Response cache hit/miss counters and sizes"""
+    return await service.cache.get_stats()
+
+@router.delete("/api/cache")
+async def clear_cache():
+    await service.cache.clear()
+    return {"success": True}
+
+class Turn:
+    """What to send upstream for one request, after applying its conversation (if any)."""
+
+    def __init__(self, request: ChatRequest):
+        self.request = request
+        self.conversation: Optional[Dict[str, Any]] = None
+        self.messages: List[Dict[str, str]] = request.messages
+        self.input: Any = request.input
+        self.previous_response_id = request.previous_response_id
+        self.context: Optional[Dict[str, Any]] = None
+
+    async def prepare(self):
+        request = self.request
+        if not request.conversation_id:
+            return
+        self.conversation = await conversation_store.get(request.conversation_id)
+        if self.conversation is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        try:
+            if request.input:
+                input_value, previous, self.context = await conversation_store.prepare_response(
+                    self.conversation, request.input, request.model, request.max_tokens
+                )
+                self.input = input_value
+                # An explicit previous_response_id from the client still wins
+                self.previous_response_id = request.previous_response_id or previous
+            else:
+                self.messages, self.context = await conversation_store.prepare_chat(
+                    self.conversation, request.messages, request.model, request.max_tokens
+                )
+        except ContextBudgetError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+    async def create_response(self, stream: bool):
+        request = self.request
+        call = lambda: service.create_response(
+            model=request.model,
+            input_text=self.input,
+            previous_response_id=self.previous_response_id,
+            reasoning_effort=request.reasoning_effort,
+            stream=stream,
+            use_cache=request.use_cache,
+            user=request.user
+        )
+        chained = self.conversation is not None and self.context.get("chained") and not request.previous_response_id
+        try:
+            return await call()
+        except httpx.HTTPStatusError as e:
+            # The backend lost (or never had) the chained response: resend the budgeted history instead
+            if not chained or e.response.status_code >= 500:
+                raise
+            self.input, self.context = await conversation_store.restart_chain(self.conversation, request.model, request.max_tokens)
+            self.previous_response_id = None
+            return await call()
+
+    async def record(self, content: str, tokens: int = 0, response_id: Optional[str] = None):
+        if self.conversation is not None:
+            await conversation_store.record_reply(self.conversation, content, tokens=tokens, response_id=response_id)
+
 @router.post("/api/chat")
 async def chat_completion(request: ChatRequest):
     """Multi-turn chat with optional streaming"""
+    turn = Turn(request)
+    await turn.prepare()
     if request.stream:
-        return EventSourceResponse(
-            chat_generator(request),
-            media_type="text/event-stream"
-        )
+        return EventStreamResponse(await chat_generator(turn))
     else:
         # Use new API if input is provided
         if request.input:
-            return await service.create_response(
-                model=request.model,
-                input_text=request.input,
-                previous_response_id=request.previous_response_id,
-                reasoning_effort=request.reasoning_effort,
-                stream=False
-            )
+            data = await turn.create_response(stream=False)
+            if turn.conversation is not None:
+                usage = data.get("usage") or {}
+                await turn.record(response_text(data), tokens=usage.get("output_tokens", 0), response_id=data.get("id"))
+                data = {**data, "conversation_id": request.conversation_id, "context": turn.context}
+            return data
         
         # Fallback to standard chat completion
         response = await service.chat_completion(
-            messages=request.messages,
+            messages=turn.messages,
             model=request.model,
             temperature=request.temperature,
             max_tokens=request.max_tokens,
-            stream=False
+            stream=False,
+            use_cache=request.use_cache,
+            user=request.user
         )
-        return response.model_dump()
+        result = response.model_dump()
+        if turn.conversation is not None:
+            usage = response.usage
+            await turn.record(response.choices[0].message.content or "", tokens=usage.completion_tokens if usage else 0)
+            result.update({"conversation_id": request.conversation_id, "context": turn.context})
+        return result
 
-async def chat_generator(request: ChatRequest):
+async def chat_generator(turn: Turn):
+    """Pre-encoded, coalesced SSE frames for a streaming chat request"""
+    request = turn.request
     if request.input:
-        # New API Streaming
-        stream = service.create_response(
-            model=request.model,
-            input_text=request.input,
-            previous_response_id=request.previous_response_id,
-            reasoning_effort=request.reasoning_effort,
-            stream=True
-        )
-        async for event in await stream:
-            # Forward the event and data
-            # event['data'] is a JSON string from the upstream service
-            yield {"event": event["event"], "data": event["data"]}
+        # New API Streaming: upstream event data is already JSON, forward it as-is
+        stream = await turn.create_response(stream=True)
+        if turn.conversation is not None:
+            stream = response_events(stream, turn.record)
+        frames = coalesce(stream, encode_events, size=lambda event: len(event["data"]))
     else:
-        # Standard API Streaming
+        # Standard API Streaming: deltas are merged into {"data": "..."} frames
         stream = await service.chat_completion(
-            messages=request.messages,
+            messages=turn.messages,
             model=request.model,
             temperature=request.temperature,
             max_tokens=request.max_tokens,
-            stream=True
+            stream=True,
+            use_cache=request.use_cache,
+            user=request.user
         )
+        frames = coalesce(text_deltas(stream, turn.record if turn.conversation is not None else None), encode_text)
+    if turn.context is None:
+        return frames
+    return with_context(frames, turn.context)
+
+async def with_context(frames, context: Dict[str, Any]):
+    # Sent first so clients can show how much of the conversation went upstream
+    yield encode_event(json.dumps({"context": context}), event="context")
+    try:
+        async for frame in frames:
+            yield frame
+    finally:
+        await close_stream(frames)
+
+async def text_deltas(stream, on_complete: Optional[Callable[[str], Awaitable[None]]] = None):
+    parts: List[str] = []
+    try:
         async for chunk in stream:
-            content = chunk.choices[0].delta.content
+            content = chunk.choices[0].delta.content if chunk.choices else None
             if content:
-                # Format as SSE data - wrap in dict so sse-starlette serializes it to JSON
-                yield {"data": {"data": content}}
+                if on_complete is not None:
+                    parts.append(content)
+                yield content
+    finally:
+        await close_stream(stream)
+    if on_complete is not None:
+        await on_complete("".join(parts))
+
+async def response_events(events, on_complete: Callable[..., Awaitable[None]]):
+    """Pass Responses API events through, then report the reply text and response id."""
+    parts: List[str] = []
+    response_id = None
+    tokens = 0
+    try:
+        async for event in events:
+            name = event.get("event", "")
+            if name.endswith(".delta") or name in ("response.created", "response.completed"):
+                try:
+                    data = json.loads(event["data"])
+                except ValueError:
+                    data = {}
+                if name.endswith(".delta") and name.startswith("response.output_text"):
+                    parts.append(data.get("delta") or "")
+                elif isinstance(data.get("response"), dict):
+                    response_id = data["response"].get("id") or response_id
+                    tokens = (data["response"].get("usage") or {}).get("output_tokens", tokens)
+            yield event
+    finally:
+        await close_stream(events)
+    await on_complete("".join(parts), tokens=tokens, response_id=response_id)
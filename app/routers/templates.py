@@ -1,16 +1,46 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from app.models.templates_store import templates_store
-from typing import List, Dict, Any
+from app.models.template_engine import template_cache, TemplateError
+from app.models.eval_store import eval_store
+from app.models.eval_runner import row_reference
+from typing import List, Dict, Any, Optional
+from pydantic import BaseModel
+import json
 
 router = APIRouter()
 
+class RenderRequest(BaseModel):
+    values: Dict[str, Any] = {}
+
+class DatasetRenderRequest(BaseModel):
+    dataset_id: str
+    # Constants merged into every row (row values win)
+    values: Dict[str, Any] = {}
+    # Reject the request if a variable is in neither the dataset columns, values nor defaults
+    strict: bool = True
+    # Save the rendered prompts as a new dataset (input/expected rows) instead of streaming them
+    save_as: Optional[str] = None
+
+async def _compiled(id: str):
+    template = await templates_store.get_template(id)
+    if template is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    try:
+        return template, template_cache.get(template)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.get("/api/prompt-templates")
 async def list_templates():
     return await templates_store.list_templates()
 
 @router.post("/api/prompt-templates")
 async def create_template(template: Dict[str, Any]):
-    return await templates_store.save_template(template)
+    try:
+        return await templates_store.save_template(template)
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.delete("/api/prompt-templates/{id}")
 async def delete_template(id: str):
@@ -18,3 +48,50 @@ async def delete_template(id: str):
     if not success:
         raise HTTPException(status_code=404, detail="Template not found")
     return {"success": True}
+
+@router.post("/api/prompt-templates/{id}/render")
+async def render_template(id: str, request: RenderRequest):
+    """Render one prompt server-side, listing variables that had no value"""
+    template, compiled = await _compiled(id)
+    return {"prompt": compiled.render(request.values), "missing": compiled.missing(request.values), "version": template.get("version", 0)}
+
+@router.post("/api/prompt-templates/{id}/render-dataset")
+async def render_dataset(id: str, request: DatasetRenderRequest):
+    """
+    Render the template for every row of a dataset. Streams JSONL lines of
+    {"row_index", "input", "expected"}, or saves them as a new dataset with save_as.
+    """
+    template, compiled = await _compiled(id)
+    dataset = await eval_store.get_dataset(request.dataset_id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    # Checked once against the dataset's columns, not per row
+    missing = compiled.missing(set(dataset.get("columns", [])) | set(request.values))
+    if missing and request.strict:
+        raise HTTPException(status_code=400, detail={"message": "Template variables not provided by the dataset", "missing": missing})
+
+    async def rendered_segments():
+        async for start, rows in eval_store.iter_dataset_segments(request.dataset_id):
+            values = request.values
+            yield [
+                {"row_index": start + i, "input": compiled.render({**values, **row} if values else row), "expected": row_reference(row)}
+                for i, row in enumerate(rows)
+            ]
+
+    if request.save_as:
+        async def rendered_rows():
+            async for segment in rendered_segments():
+                for row in segment:
+                    yield row
+        summary = {"name": request.save_as, "source": f"template:{id}@{template.get('version', 0)}", "source_dataset": request.dataset_id}
+        return await eval_store.ingest_dataset(summary, rendered_rows())
+
+    async def jsonl_generator():
+        async for segment in rendered_segments():
+            yield "".join(json.dumps(row) + "\n" for row in segment).encode("utf-8")
+
+    return StreamingResponse(
+        jsonl_generator(),
+        media_type="application/jsonl",
+        headers={"X-Template-Version": str(template.get("version", 0)), "X-Missing-Variables": ",".join(missing)}
+    )
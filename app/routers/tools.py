@@ -1,26 +1,59 @@
 from fastapi import APIRouter, HTTPException
 from app.models.tools_store import tools_store
-from typing import List, Dict, Any
+from app.models.tool_runtime import tool_runtime, ToolError
+from typing import List, Dict, Any, Optional
+from pydantic import BaseModel
 
 router = APIRouter()
 
+class ToolCallsRequest(BaseModel):
+    # OpenAI-style tool_calls: [{"id", "type": "function", "function": {"name", "arguments"}}]
+    tool_calls: List[Dict[str, Any]]
+
 @router.get("/api/tools")
 async def list_tools():
     return await tools_store.list_tools()
 
 @router.post("/api/tools")
 async def create_tool(tool: Dict[str, Any]):
-    return await tools_store.save_tool(tool)
+    """Save a tool; its definition is compiled first and rejected if it is invalid"""
+    try:
+        return await tool_runtime.save_tool(tool)
+    except ToolError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.put("/api/tools/{name}")
 async def update_tool(name: str, tool: Dict[str, Any]):
-    if tool["name"] != name:
+    if tool.get("name") != name:
         raise HTTPException(status_code=400, detail="Tool name mismatch")
-    return await tools_store.save_tool(tool)
+    try:
+        return await tool_runtime.save_tool(tool)
+    except ToolError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.delete("/api/tools/{name}")
 async def delete_tool(name: str):
+    tool_runtime.invalidate(name)
     success = await tools_store.delete_tool(name)
     if not success:
         raise HTTPException(status_code=404, detail="Tool not found")
     return {"success": True}
+
+@router.get("/api/tool-definitions")
+async def tool_definitions():
+    """Enabled tools in the OpenAI `tools` request format"""
+    return await tool_runtime.definitions()
+
+@router.post("/api/tools/{name}/invoke")
+async def invoke_tool(name: str, arguments: Dict[str, Any]):
+    """Call one tool with validated arguments"""
+    return await tool_runtime.call(name, arguments)
+
+@router.post("/api/tool-calls")
+async def execute_tool_calls(request: ToolCallsRequest):
+    """Run a model turn's tool_calls in parallel; each result carries the tool message to send back"""
+    return {"results": await tool_runtime.execute_tool_calls(request.tool_calls)}
+
+@router.get("/api/tool-calls/stats")
+async def tool_stats():
+    return tool_runtime.get_stats()
@@ -1,6 +1,10 @@
 from fastapi import APIRouter, HTTPException
+from app.models.sse_stream import ClosingEventSourceResponse
 from app.models.workflow_store import workflow_store
+from app.models.workflow_engine import WorkflowRun, WorkflowError
+from app.models.service import close_stream
 from typing import List, Dict, Any
+import json
 
 router = APIRouter()
 
@@ -10,7 +14,11 @@ async def list_workflows():
 
 @router.post("/api/workflows")
 async def create_workflow(workflow: Dict[str, Any]):
-    return await workflow_store.save_workflow(workflow)
+    """Save a workflow; the graph is compiled first and rejected if it is invalid"""
+    try:
+        return await workflow_store.save_workflow(workflow)
+    except WorkflowError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/api/workflows/{id}")
 async def get_workflow(id: str):
@@ -23,7 +31,21 @@ async def get_workflow(id: str):
 async def update_workflow(id: str, workflow: Dict[str, Any]):
     if workflow.get("id") != id:
         raise HTTPException(status_code=400, detail="ID mismatch")
-    return await workflow_store.save_workflow(workflow)
+    try:
+        return await workflow_store.save_workflow(workflow)
+    except WorkflowError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/api/workflows/{id}/plan")
+async def get_workflow_plan(id: str):
+    """Execution order, sinks and resolved tools of the workflow's compiled plan"""
+    try:
+        plan = await workflow_store.get_plan(id)
+    except WorkflowError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    return plan.describe()
 
 @router.delete("/api/workflows/{id}")
 async def delete_workflow(id: str):
@@ -34,6 +56,26 @@ async def delete_workflow(id: str):
 
 @router.post("/api/workflows/{id}/run")
 async def run_workflow(id: str, input_data: Dict[str, Any]):
-    # Placeholder for workflow execution logic
-    # In a real implementation, this would invoke the orchestrator
-    return {"status": "started", "job_id": "mock-job-id", "message": "Workflow execution not yet implemented"}
+    """Execute the workflow graph; streams node events unless stream is false"""
+    try:
+        plan = await workflow_store.get_plan(id)
+    except WorkflowError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    run = WorkflowRun(plan, str(input_data.get("input", "")))
+
+    if input_data.get("stream", True):
+        async def event_generator():
+            events = run.stream()
+            try:
+                async for event in events:
+                    yield {"event": event["event"], "data": json.dumps(event["data"])}
+            finally:
+                # Stops the node that is running when the client goes away
+                await close_stream(events)
+        return ClosingEventSourceResponse(event_generator())
+
+    events = [event async for event in run.stream()]
+    final = events[-1]["data"]
+    return {**final, "events": events[:-1]}
@@ -137,14 +137,17 @@ function setupChat() {
             const reader = res.body.getReader();
             const decoder = new TextDecoder();
             let fullText = '';
+            let buffer = '';
             assistantMsgDiv.innerHTML = ''; // Clear loading dots
 
             while (true) {
                 const {done, value} = await reader.read();
                 if (done) break;
                 
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
+                // Frames are coalesced server-side, so a read may end mid-line; keep the tail for the next read
+                buffer += decoder.decode(value, {stream: true});
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
                 
                 for (const line of lines) {
                     if (line.startsWith('event: ')) {
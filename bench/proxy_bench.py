@@ -0,0 +1,328 @@
+"""
+Measures the latency and CPU the FastAPI layer adds on top of the upstream server.
+
+Starts the stub server and the app as subprocesses (app data goes to a temp dir),
+then drives each scenario at rising concurrency. Proxied scenarios are paired with
+a direct call to the stub so the report shows what the app adds, not what the
+stub spends generating.
+
+    python -m bench.proxy_bench                                # run and print
+    python -m bench.proxy_bench --save-baseline                # record bench/baseline.json
+    python -m bench.proxy_bench --compare --threshold 0.15     # exit 1 on regressions
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+import httpx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+MODELS = ["stub-small", "stub-large"]
+MESSAGES = [{"role": "user", "content": "Say something short."}]
+
+# Proxied scenario -> the direct stub scenario it is compared against
+PAIRS = {
+    "chat": "direct_chat",
+    "chat_stream": "direct_chat_stream",
+    "responses_stream": "direct_responses_stream",
+    "ab_test": "direct_chat",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time of a process, from /proc (None where unavailable)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def start_server(args: List[str], port: int, env: Dict[str, str]) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", *args, "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{args[0]} exited: {process.stderr.read().decode(errors='replace')}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{args[0]} did not start on port {port}")
+
+
+async def timed_stream(client: httpx.AsyncClient, url: str, body: Dict[str, Any]) -> Dict[str, float]:
+    start = time.perf_counter()
+    ttft = None
+    async with client.stream("POST", url, json=body) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            # The Responses API opens with a response.created event before any token
+            if ttft is None and line.startswith("data:") and "response.created" not in line:
+                ttft = time.perf_counter() - start
+    return {"latency": time.perf_counter() - start, "ttft": ttft}
+
+
+async def timed_post(client: httpx.AsyncClient, url: str, body: Dict[str, Any]) -> Dict[str, float]:
+    start = time.perf_counter()
+    response = await client.post(url, json=body)
+    response.raise_for_status()
+    return {"latency": time.perf_counter() - start}
+
+
+def build_scenarios(app_url: str, stub_url: str, max_tokens: int) -> Dict[str, Callable[..., Awaitable[Dict[str, float]]]]:
+    chat_body = {"model": MODELS[0], "messages": MESSAGES, "temperature": 0.7, "max_tokens": max_tokens}
+
+    async def store(client: httpx.AsyncClient, i: int) -> Dict[str, float]:
+        # Upserts over a fixed id range so the listing stays the same size throughout
+        start = time.perf_counter()
+        template = {"id": f"bench-{i % 50}", "name": f"Bench {i % 50}", "content": "Hello {{input}}"}
+        (await client.post(f"{app_url}/api/prompt-templates", json=template)).raise_for_status()
+        (await client.get(f"{app_url}/api/prompt-templates")).raise_for_status()
+        return {"latency": time.perf_counter() - start}
+
+    return {
+        "direct_chat": lambda c, i: timed_post(c, f"{stub_url}/chat/completions", chat_body),
+        "direct_chat_stream": lambda c, i: timed_stream(c, f"{stub_url}/chat/completions", {**chat_body, "stream": True}),
+        "direct_responses_stream": lambda c, i: timed_stream(
+            c, f"{stub_url}/responses", {"model": MODELS[0], "input": "Say something short.", "stream": True}),
+        "chat": lambda c, i: timed_post(c, f"{app_url}/api/chat", chat_body),
+        "chat_stream": lambda c, i: timed_stream(c, f"{app_url}/api/chat", {**chat_body, "stream": True}),
+        "responses_stream": lambda c, i: timed_stream(
+            c, f"{app_url}/api/chat", {"model": MODELS[0], "messages": [], "input": "Say something short.", "stream": True}),
+        "ab_test": lambda c, i: timed_post(
+            c, f"{app_url}/api/ab-test", {"prompt": "Say something short.", "models": MODELS, "max_tokens": max_tokens}),
+        "store": store,
+    }
+
+
+async def run_level(
+    fn: Callable[..., Awaitable[Dict[str, float]]],
+    concurrency: int,
+    requests: int,
+    app_pid: Optional[int]
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(120, connect=5)) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                try:
+                    sample = await fn(client, i)
+                    latencies.append(sample["latency"])
+                    if sample.get("ttft") is not None:
+                        ttfts.append(sample["ttft"])
+                except Exception:
+                    errors += 1
+
+        cpu_before = cpu_seconds(app_pid) if app_pid else None
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        cpu_after = cpu_seconds(app_pid) if app_pid else None
+
+    completed = len(latencies)
+    result = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "requests_per_second": completed / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": percentiles(np.asarray(latencies) * 1000),
+        "ttft_ms": percentiles(np.asarray(ttfts) * 1000),
+        "cpu_ms_per_request": None,
+    }
+    if cpu_before is not None and cpu_after is not None and completed:
+        result["cpu_ms_per_request"] = (cpu_after - cpu_before) * 1000 / completed
+    return result
+
+
+def percentiles(values: np.ndarray) -> Dict[str, Optional[float]]:
+    if not len(values):
+        return {"p50": None, "p99": None}
+    p50, p99 = np.percentile(values, [50, 99])
+    return {"p50": float(p50), "p99": float(p99)}
+
+
+def _delta(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return a - b if a is not None and b is not None else None
+
+
+def add_overhead(results: Dict[str, Dict[str, Any]]):
+    """Annotate proxied scenarios with the latency and TTFT they add over their direct pair."""
+    for scenario, direct in PAIRS.items():
+        for level, result in results.get(scenario, {}).items():
+            base = results.get(direct, {}).get(level)
+            if base is None:
+                continue
+            result["added_ms"] = {
+                "p50": _delta(result["latency_ms"]["p50"], base["latency_ms"]["p50"]),
+                "p99": _delta(result["latency_ms"]["p99"], base["latency_ms"]["p99"]),
+                "ttft_p50": _delta(result["ttft_ms"]["p50"], base["ttft_ms"]["p50"]),
+            }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """Regressions beyond threshold (a fraction) in p50/p99 latency or requests/sec."""
+    regressions = []
+    for scenario, levels in results.items():
+        for level, result in levels.items():
+            base = baseline.get(scenario, {}).get(level)
+            if base is None:
+                continue
+            for stat in ("p50", "p99"):
+                now, before = result["latency_ms"][stat], base["latency_ms"][stat]
+                if now is not None and before and now > before * (1 + threshold):
+                    regressions.append(f"{scenario} c={level}: latency {stat} {before:.1f} -> {now:.1f} ms")
+            now, before = result["requests_per_second"], base["requests_per_second"]
+            if before and now < before * (1 - threshold):
+                regressions.append(f"{scenario} c={level}: {before:.1f} -> {now:.1f} req/s")
+    return regressions
+
+
+def _fmt(value: Optional[float], width: int = 8) -> str:
+    return f"{value:{width}.1f}" if value is not None else f"{'-':>{width}}"
+
+
+def print_report(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Dict[str, Any]]] = None):
+    print(f"{'scenario':<24}{'conc':>5}{'p50 ms':>9}{'p99 ms':>9}{'ttft':>9}{'+p50':>9}{'+ttft':>9}{'req/s':>9}{'cpu ms':>9}{'err':>5}{'vs base':>9}")
+    for scenario, levels in results.items():
+        for level, r in levels.items():
+            added = r.get("added_ms", {})
+            change = None
+            base = (baseline or {}).get(scenario, {}).get(level)
+            if base and base["requests_per_second"]:
+                change = (r["requests_per_second"] / base["requests_per_second"] - 1) * 100
+            print(
+                f"{scenario:<24}{level:>5}{_fmt(r['latency_ms']['p50'], 9)}{_fmt(r['latency_ms']['p99'], 9)}"
+                f"{_fmt(r['ttft_ms']['p50'], 9)}{_fmt(added.get('p50'), 9)}{_fmt(added.get('ttft_p50'), 9)}"
+                f"{r['requests_per_second']:9.1f}{_fmt(r['cpu_ms_per_request'], 9)}{r['errors']:>5}"
+                f"{(f'{change:+8.1f}%' if change is not None else '-'):>9}"
+            )
+
+
+async def run_suite(args, app_url: str, stub_url: str, app_pid: int) -> Dict[str, Dict[str, Any]]:
+    scenarios = build_scenarios(app_url, stub_url, args.max_tokens)
+    selected = args.scenarios.split(",") if args.scenarios else list(scenarios)
+    # Direct pairs are needed for the overhead columns even when not asked for explicitly
+    for name in list(selected):
+        if name in PAIRS and PAIRS[name] not in selected:
+            selected.insert(0, PAIRS[name])
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in selected:
+        if name not in scenarios:
+            raise SystemExit(f"Unknown scenario '{name}', choose from: {', '.join(scenarios)}")
+        pid = None if name.startswith("direct_") else app_pid
+        # Warm up connections and lazy initialisation before measuring
+        await run_level(scenarios[name], 2, 4, None)
+        for level in levels:
+            results.setdefault(name, {})[str(level)] = await run_level(scenarios[name], level, max(args.requests, level), pid)
+    add_overhead(results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32,64", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario and level")
+    parser.add_argument("--scenarios", default="", help="Comma-separated subset of scenarios")
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--tokens-per-second", type=float, default=500.0)
+    parser.add_argument("--first-token-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write results to --baseline")
+    parser.add_argument("--compare", action="store_true", help="Compare with --baseline and exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative regression")
+    parser.add_argument("--output", help="Also write the full results as JSON here")
+    args = parser.parse_args()
+
+    stub_port, app_port = free_port(), free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}/v1"
+    app_url = f"http://127.0.0.1:{app_port}"
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = {
+            **os.environ,
+            "LM_STUDIO_BASE_URL": stub_url,
+            "LLM_DEV_DB_FILE": os.path.join(data_dir, "store.db"),
+            "HISTORY_DIR": os.path.join(data_dir, "history"),
+            "PYTHONPATH": ROOT,
+        }
+        env.pop("LM_STUDIO_BASE_URLS", None)
+        stub = start_server([
+            "bench.stub_server",
+            "--tokens-per-second", str(args.tokens_per_second),
+            "--first-token-ms", str(args.first_token_ms),
+            "--jitter-ms", str(args.jitter_ms),
+            "--output-tokens", str(args.max_tokens),
+        ], stub_port, env)
+        try:
+            app = start_server(["uvicorn", "app.main:app", "--log-level", "warning"], app_port, env)
+            try:
+                results = asyncio.run(run_suite(args, app_url, stub_url, app.pid))
+            finally:
+                app.terminate()
+                app.wait(timeout=10)
+        finally:
+            stub.terminate()
+            stub.wait(timeout=10)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results")
+    print_report(results, baseline)
+
+    report = {
+        "created": time.time(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare", "output", "baseline")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif args.compare:
+        if baseline is None:
+            raise SystemExit(f"No baseline at {args.baseline}; run with --save-baseline first")
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions beyond threshold")
+
+
+if __name__ == "__main__":
+    main()
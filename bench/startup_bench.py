@@ -0,0 +1,152 @@
+"""
+Measures how fast a worker starts and how cleanly it stops.
+
+Each run starts the app with uvicorn (app data in a temp dir, the stub server as
+its backend) and records the time until it answers /api/startup, the phases it
+reports, how long the first chat request takes, and how long SIGTERM takes to
+shut it down. Shutdown stderr is checked for leaked clients and pending tasks.
+
+    python -m bench.startup_bench                       # 10 runs, print
+    python -m bench.startup_bench --max-ready-ms 1000   # exit 1 if the median is slower
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict, Any
+
+import httpx
+import numpy as np
+
+from bench.proxy_bench import ROOT, MESSAGES, MODELS, free_port, start_server
+
+# uvicorn re-raises the SIGTERM it handled once shutdown is complete
+CLEAN_EXIT_CODES = (0, -signal.SIGTERM)
+# Signs in a worker's stderr that something was not closed on shutdown
+LEAK_MARKERS = ("Unclosed", "ResourceWarning", "Task was destroyed but it is pending", "Traceback")
+
+
+def run_once(env: Dict[str, str], stub_url: str, timeout: float) -> Dict[str, Any]:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        report = None
+        with httpx.Client(timeout=5) as client:
+            while time.perf_counter() - started < timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"app exited: {process.stderr.read().decode(errors='replace')}")
+                try:
+                    response = client.get(f"{url}/api/startup")
+                    # A revision without /api/startup still counts as ready once it answers
+                    if response.status_code in (200, 404):
+                        report = response.json() if response.status_code == 200 else {}
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.005)
+            if report is None:
+                raise RuntimeError(f"app did not answer within {timeout}s")
+            ready = time.perf_counter() - started
+
+            request_start = time.perf_counter()
+            response = client.post(f"{url}/api/chat", json={"model": MODELS[0], "messages": MESSAGES, "max_tokens": 8})
+            response.raise_for_status()
+            first_request = time.perf_counter() - request_start
+    finally:
+        stop_start = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        try:
+            _, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            _, stderr = process.communicate()
+        stopped = time.perf_counter() - stop_start
+
+    text = stderr.decode(errors="replace")
+    return {
+        "ready_ms": ready * 1000,
+        "first_request_ms": first_request * 1000,
+        "shutdown_ms": stopped * 1000,
+        "exit_code": process.returncode,
+        "leaks": [line for line in text.splitlines() if any(m in line for m in LEAK_MARKERS)],
+        "report": report,
+    }
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    array = np.array(values)
+    return {"min": float(array.min()), "p50": float(np.percentile(array, 50)), "max": float(array.max())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for start-up or shutdown")
+    parser.add_argument("--max-ready-ms", type=float, help="Exit 1 if the median time to ready is above this")
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}/v1"
+    runs = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = {
+            **os.environ,
+            "LM_STUDIO_BASE_URL": stub_url,
+            "LLM_DEV_DB_FILE": os.path.join(data_dir, "store.db"),
+            "HISTORY_DIR": os.path.join(data_dir, "history"),
+            "EVAL_RESULTS_DIR": os.path.join(data_dir, "results"),
+            "PYTHONPATH": ROOT,
+            # Surfaces unclosed sockets and clients in stderr
+            "PYTHONWARNINGS": "always::ResourceWarning",
+        }
+        env.pop("LM_STUDIO_BASE_URLS", None)
+        stub = start_server(["bench.stub_server"], stub_port, env)
+        try:
+            for _ in range(args.runs):
+                runs.append(run_once(env, stub_url, args.timeout))
+        finally:
+            stub.terminate()
+            stub.wait(timeout=10)
+
+    print(f"{'metric':<24}{'min':>9}{'p50':>9}{'max':>9}")
+    for metric in ("ready_ms", "first_request_ms", "shutdown_ms"):
+        s = summarize([r[metric] for r in runs])
+        print(f"{metric:<24}{s['min']:9.1f}{s['p50']:9.1f}{s['max']:9.1f}")
+    # Phases as the worker measured them, median over runs
+    phases: Dict[str, List[float]] = {}
+    for r in runs:
+        if not r["report"]:
+            continue
+        before = r["report"].get("before_import_ms")
+        if before is not None:
+            phases.setdefault("before_import", []).append(before)
+        for phase in r["report"]["phases"]:
+            phases.setdefault(phase["phase"], []).append(phase["duration_ms"])
+        phases.setdefault("in_process_ready", []).append(r["report"]["ready_ms"])
+    print()
+    print(f"{'phase (p50 ms)':<40}{'':>9}")
+    for name, values in phases.items():
+        print(f"{name:<40}{float(np.percentile(values, 50)):9.1f}")
+
+    failures = [f"run {i}: exit code {r['exit_code']}" for i, r in enumerate(runs) if r["exit_code"] not in CLEAN_EXIT_CODES]
+    failures += [f"run {i}: {line}" for i, r in enumerate(runs) for line in r["leaks"]]
+    for line in failures:
+        print(f"SHUTDOWN {line}")
+    ready_p50 = summarize([r["ready_ms"] for r in runs])["p50"]
+    if args.max_ready_ms is not None and ready_p50 > args.max_ready_ms:
+        print(f"SLOW median time to ready {ready_p50:.1f} ms > {args.max_ready_ms:.1f} ms")
+        sys.exit(1)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
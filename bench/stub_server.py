@@ -0,0 +1,122 @@
+"""
+Stub OpenAI-compatible server for benchmarks: no GPU, no network.
+Implements /v1/models, /v1/chat/completions (streaming and not) and /v1/responses (SSE and not),
+generating tokens at a configurable rate with optional jitter.
+
+    python -m bench.stub_server --port 1234 --tokens-per-second 200 --jitter-ms 2
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+def create_app(
+    tokens_per_second: float = 500.0,
+    output_tokens: int = 32,
+    first_token_ms: float = 20.0,
+    jitter_ms: float = 0.0,
+    models: List[str] = None
+) -> FastAPI:
+    app = FastAPI(title="LLM stub server")
+    model_ids = models or ["stub-small", "stub-large"]
+    token_delay = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+
+    async def pause(base: float):
+        delay = base + (random.uniform(-jitter_ms, jitter_ms) / 1000 if jitter_ms else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def tokens_for(body: Dict[str, Any]) -> List[str]:
+        count = int(body.get("max_tokens") or body.get("max_output_tokens") or output_tokens)
+        # -1 means "no limit" to LM Studio
+        count = output_tokens if count <= 0 else min(count, output_tokens)
+        return [f"tok{i} " for i in range(count)]
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": m, "object": "model", "created": 0, "owned_by": "stub"} for m in model_ids]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        tokens = tokens_for(body)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        base = {"id": completion_id, "created": created, "model": body.get("model", model_ids[0])}
+
+        if not body.get("stream"):
+            await pause(first_token_ms / 1000 + token_delay * len(tokens))
+            return {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 8, "completion_tokens": len(tokens), "total_tokens": 8 + len(tokens)},
+            }
+
+        async def stream():
+            await pause(first_token_ms / 1000)
+            for token in tokens:
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await pause(token_delay)
+            chunk = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/v1/responses")
+    async def responses(request: Request):
+        body = await request.json()
+        tokens = tokens_for(body)
+        response_id = f"resp_{uuid.uuid4().hex[:12]}"
+        final = {
+            "id": response_id,
+            "object": "response",
+            "model": body.get("model", model_ids[0]),
+            "status": "completed",
+            "output_text": "".join(tokens),
+            "usage": {"input_tokens": 8, "output_tokens": len(tokens)},
+        }
+        if not body.get("stream"):
+            await pause(first_token_ms / 1000 + token_delay * len(tokens))
+            return final
+
+        async def stream():
+            yield f"event: response.created\ndata: {json.dumps({'type': 'response.created', 'response': {'id': response_id}})}\n\n"
+            await pause(first_token_ms / 1000)
+            for token in tokens:
+                yield f"event: response.output_text.delta\ndata: {json.dumps({'type': 'response.output_text.delta', 'delta': token})}\n\n"
+                await pause(token_delay)
+            yield f"event: response.completed\ndata: {json.dumps({'type': 'response.completed', 'response': final})}\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--tokens-per-second", type=float, default=500.0)
+    parser.add_argument("--output-tokens", type=int, default=32)
+    parser.add_argument("--first-token-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    app = create_app(args.tokens_per_second, args.output_tokens, args.first_token_ms, args.jitter_ms)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
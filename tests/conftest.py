@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Stores read their paths at import time, so point them at a scratch dir before any app module loads
+_DATA_DIR = tempfile.mkdtemp(prefix="llm-dev-tests-")
+os.environ.setdefault("LLM_DEV_DB_FILE", os.path.join(_DATA_DIR, "store.db"))
+os.environ.setdefault("HISTORY_DIR", os.path.join(_DATA_DIR, "history"))
+os.environ.setdefault("EVAL_RESULTS_DIR", os.path.join(_DATA_DIR, "results"))
+os.environ.setdefault("EMBEDDINGS_DIR", os.path.join(_DATA_DIR, "embeddings"))
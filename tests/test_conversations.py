@@ -0,0 +1,57 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+from app.models.conversations import conversation_store, ContextBudgetError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REPLIES = 40
+WORKERS = 4
+
+
+def test_workers_appending_to_one_conversation_get_distinct_seqs():
+    conversation = asyncio.run(conversation_store.create({"name": "shared"}))
+    script = (
+        "import asyncio, sys\n"
+        "from app.models.conversations import conversation_store\n"
+        "async def main():\n"
+        "    conversation = await conversation_store.get(sys.argv[1])\n"
+        f"    for i in range({REPLIES}):\n"
+        "        await conversation_store.record_reply(conversation, f'{sys.argv[2]}-{i}')\n"
+        "asyncio.run(main())\n"
+    )
+    # Each process stands in for one uvicorn worker; they share the database file
+    workers = [subprocess.Popen([sys.executable, "-c", script, conversation["id"], str(w)], cwd=ROOT) for w in range(WORKERS)]
+    assert all(worker.wait(timeout=120) == 0 for worker in workers)
+
+    async def stored():
+        return await conversation_store.get(conversation["id"]), await conversation_store.list_messages(conversation["id"])
+
+    record, messages = asyncio.run(stored())
+    assert len(messages) == REPLIES * WORKERS
+    assert sorted(m["seq"] for m in messages) == list(range(REPLIES * WORKERS))
+    assert record["message_count"] == REPLIES * WORKERS
+    assert record["token_total"] == sum(m["tokens"] for m in messages)
+    assert {m["content"] for m in messages} == {f"{w}-{i}" for w in range(WORKERS) for i in range(REPLIES)}
+
+
+def test_rejected_turn_is_rolled_back():
+    async def scenario():
+        conversation = await conversation_store.create({"name": "small", "context_tokens": 64, "policy": "error"})
+        await conversation_store.record_reply(conversation, "ok")
+        try:
+            await conversation_store.prepare_chat(conversation, [{"role": "user", "content": "x" * 1000}], "m1")
+        except ContextBudgetError:
+            pass
+        else:
+            raise AssertionError("oversized turn was accepted")
+        await conversation_store.record_reply(conversation, "again")
+        return await conversation_store.get(conversation["id"]), await conversation_store.list_messages(conversation["id"])
+
+    record, messages = asyncio.run(scenario())
+    assert [m["seq"] for m in messages] == [0, 1]
+    assert [m["content"] for m in messages] == ["ok", "again"]
+    assert record["message_count"] == 2
+    assert record["token_total"] == sum(m["tokens"] for m in messages)
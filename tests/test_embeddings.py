@@ -0,0 +1,22 @@
+import asyncio
+
+from app.models.embeddings import SimilarityScorer
+
+
+def test_idle_batchers_are_released_after_their_flush():
+    scorer = SimilarityScorer()
+
+    async def score_batch(model, batch, user):
+        for prediction, reference, future in batch:
+            future.set_result(1.0 if prediction == reference else 0.0)
+
+    scorer._score_batch = score_batch
+
+    async def scenario():
+        # One batcher per (model, user); a long-lived scorer sees many users
+        scores = await asyncio.gather(*(scorer.score("m1", "a", "a" if i % 2 else "b", user=f"u{i}") for i in range(20)))
+        return scores, dict(scorer._batchers)
+
+    scores, batchers = asyncio.run(scenario())
+    assert scores == [0.0, 1.0] * 10
+    assert batchers == {}
@@ -0,0 +1,118 @@
+import asyncio
+
+from app.models.eval_runner import EvalRunner
+from app.models.eval_store import eval_store
+from app.models.job_queue import job_queue
+
+
+async def _queued_job() -> str:
+    dataset = await eval_store.save_dataset({"name": "d", "rows": [{"input": "q", "expected": "a"}]})
+    job = await eval_store.save_job({"dataset_id": dataset["id"], "model": "m1", "evaluators": ["exact_match"]})
+    await job_queue.enqueue(job["id"])
+    return job["id"]
+
+
+def _runner(release: asyncio.Event) -> EvalRunner:
+    runner = EvalRunner()
+
+    async def run(job, dataset, judges):
+        await release.wait()
+
+    runner._run = run
+    return runner
+
+
+def test_heartbeat_is_held_and_stops_with_the_job():
+    async def scenario():
+        release = asyncio.Event()
+        runner = _runner(release)
+        job_id = await _queued_job()
+        assert await runner._claim(job_id)
+        held = [t for t in runner._helpers if not t.done()]
+        release.set()
+        await runner._tasks[job_id]
+        await asyncio.sleep(0)
+        return len(held), len(runner._helpers)
+
+    held, after = asyncio.run(scenario())
+    assert held == 1
+    assert after == 0
+
+
+def test_shutdown_waits_for_heartbeats():
+    async def scenario():
+        runner = _runner(asyncio.Event())
+        job_id = await _queued_job()
+        assert await runner._claim(job_id)
+        await runner.shutdown()
+        return runner._tasks[job_id].done(), len(runner._helpers)
+
+    done, helpers = asyncio.run(scenario())
+    assert done
+    assert helpers == 0
+
+
+def _evaluating(runner: EvalRunner, marker: str, evaluated: list, block_from: int = None):
+    async def evaluate_row(job, row, row_index, model, evaluator_names, judges=None, embedding_model=None):
+        if block_from is not None and row_index >= block_from:
+            await asyncio.Event().wait()
+        evaluated.append(row_index)
+        return {"row_index": row_index, "model": model, "reference": "a", "prediction": marker,
+                "latency_ms": 1.0, "scores": {"exact_match": 1.0}}
+
+    runner._evaluate_row = evaluate_row
+
+
+def test_takeover_after_crash_mid_restart_resumes_saved_rows(monkeypatch):
+    async def scenario():
+        dataset = await eval_store.save_dataset({"name": "d", "rows": [{"input": str(i), "expected": "a"} for i in range(10)]})
+        job = await eval_store.save_job({"dataset_id": dataset["id"], "model": "m1", "evaluators": ["exact_match"]})
+        job_id = job["id"]
+
+        # A finished earlier run, now restarted
+        first = EvalRunner()
+        _evaluating(first, "old", [])
+        await job_queue.enqueue(job_id)
+        assert await first._claim(job_id)
+        await first._tasks[job_id]
+
+        monkeypatch.setattr(job_queue, "worker_id", "worker-a")
+        crashing = EvalRunner()
+        _evaluating(crashing, "a", [], block_from=5)
+        await job_queue.enqueue(job_id, restart=True)
+        assert await crashing._claim(job_id)
+        while len(await eval_store.list_job_results(job_id)) < 5 or (await eval_store.list_job_results(job_id))[0]["prediction"] == "old":
+            await asyncio.sleep(0.01)
+        # The worker dies: its lease is left running until it expires
+        crashing._lost.add(job_id)
+        crashing._tasks[job_id].cancel()
+        await asyncio.gather(crashing._tasks[job_id], return_exceptions=True)
+        await job_queue.leases.update(job_id, lambda lease: {**lease, "expires_at": 0})
+
+        monkeypatch.setattr(job_queue, "worker_id", "worker-b")
+        takeover = EvalRunner()
+        evaluated = []
+        _evaluating(takeover, "b", evaluated)
+        assert await takeover._claim(job_id)
+        await takeover._tasks[job_id]
+        return evaluated, await eval_store.list_job_results(job_id)
+
+    evaluated, results = asyncio.run(scenario())
+    by_row = {r["row_index"]: r["prediction"] for r in results}
+    assert sorted(evaluated) == [5, 6, 7, 8, 9]
+    assert by_row == {**{i: "a" for i in range(5)}, **{i: "b" for i in range(5, 10)}}
+
+
+def test_job_that_cannot_start_is_marked_failed():
+    async def scenario():
+        job_id = await _queued_job()
+        job = await eval_store.get_job(job_id)
+        # The dataset went away while the job waited in the queue
+        await eval_store.delete_dataset(job["dataset_id"])
+        claimed = await EvalRunner()._claim(job_id)
+        return claimed, await eval_store.get_job(job_id)
+
+    claimed, job = asyncio.run(scenario())
+    assert not claimed
+    assert job["status"] == "failed"
+    assert job["error"]
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.models import eval_store as eval_store_module
+from app.models.eval_store import eval_store
+from app.routers import evaluation
+
+
+def test_segments_are_read_in_order_with_keyset_paging(monkeypatch):
+    monkeypatch.setattr(eval_store_module, "DATASET_CHUNK_ROWS", 7)
+
+    async def scenario():
+        # Another dataset's segments interleave with this one's in the table
+        dataset, _ = await asyncio.gather(
+            eval_store.save_dataset({"name": "d", "rows": [{"input": str(i)} for i in range(100)]}),
+            eval_store.save_dataset({"name": "other", "rows": [{"input": "x"}] * 30}),
+        )
+        segments = [(start, rows) async for start, rows in eval_store.iter_dataset_segments(dataset["id"])]
+        tail = [start async for start, _ in eval_store.iter_dataset_segments(dataset["id"], start_segment=13)]
+        return segments, tail
+
+    segments, tail = asyncio.run(scenario())
+    assert [start for start, _ in segments] == list(range(0, 100, 7))
+    assert [row["input"] for _, rows in segments for row in rows] == [str(i) for i in range(100)]
+    assert tail == [91, 98]
+
+
+def test_failed_reupload_keeps_previous_rows(monkeypatch):
+    monkeypatch.setattr(eval_store_module, "DATASET_CHUNK_ROWS", 4)
+
+    async def broken_rows():
+        for i in range(10):
+            yield {"input": f"new {i}"}
+        raise ValueError("bad row")
+
+    async def scenario():
+        dataset = await eval_store.save_dataset({"name": "d", "rows": [{"input": str(i)} for i in range(6)]})
+        try:
+            await eval_store.ingest_dataset({"id": dataset["id"], "name": "d"}, broken_rows())
+        except ValueError:
+            pass
+        stored = await eval_store.get_dataset(dataset["id"])
+        rows = await eval_store.get_dataset_rows(dataset["id"], 0, 100)
+        # A successful re-upload replaces the rows and frees the old segments
+        await eval_store.save_dataset({"id": dataset["id"], "name": "d", "rows": [{"input": "z"}]})
+        old_segments = await eval_store.dataset_rows.list(group=stored["rows_group"])
+        return stored, rows, await eval_store.get_dataset_rows(dataset["id"], 0, 100), old_segments
+
+    stored, rows, replaced, old_segments = asyncio.run(scenario())
+    assert stored["row_count"] == 6
+    assert [row["input"] for row in rows] == [str(i) for i in range(6)]
+    assert [row["input"] for row in replaced] == ["z"]
+    assert old_segments == []
+
+
+@pytest.mark.parametrize("fmt", ["jsonl", "csv"])
+def test_upload_that_is_not_utf8_is_a_bad_request(fmt):
+    app = FastAPI()
+    app.include_router(evaluation.router)
+    body = b'{"input": "ok"}\n{"input": "\xff\xfe"}\n' if fmt == "jsonl" else b"input\nok\n\xff\xfe\n"
+    with TestClient(app) as client:
+        response = client.post(f"/api/datasets/upload?format={fmt}&name=latin1", content=body)
+        assert response.status_code == 400
+        assert "UTF-8" in response.json()["detail"]
+        assert "latin1" not in [d["name"] for d in client.get("/api/datasets").json()]
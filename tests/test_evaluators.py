@@ -0,0 +1,24 @@
+from app.models import evaluators
+from app.models.evaluators import BUILTIN_EVALUATORS, evaluate_row
+
+PREDICTION = "The cat sat on the mat, quietly."
+REFERENCE = "A cat sat quietly on the mat."
+
+
+def test_row_scores_match_the_single_metric_functions():
+    scores = evaluate_row(PREDICTION, REFERENCE, list(BUILTIN_EVALUATORS))
+    for name, metric in BUILTIN_EVALUATORS.items():
+        assert scores[name] == metric(PREDICTION, REFERENCE)
+
+
+def test_row_is_tokenized_once_for_all_metrics(monkeypatch):
+    calls = []
+    tokenize = evaluators.tokenize
+
+    def counting(text):
+        calls.append(text)
+        return tokenize(text)
+
+    monkeypatch.setattr(evaluators, "tokenize", counting)
+    evaluate_row(PREDICTION, REFERENCE, ["bleu", "rouge_l", "token_f1"])
+    assert sorted(calls) == sorted([PREDICTION, REFERENCE])
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import uuid
+
+from app.models.history import HistoryLog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _records(timestamps):
+    return [{"id": uuid.uuid4().hex, "ts": float(ts), "endpoint": "chat.completions"} for ts in timestamps]
+
+
+def _write_from_other_process(directory: str, timestamps):
+    script = (
+        "import json, sys\n"
+        "from app.models.history import HistoryLog\n"
+        "log = HistoryLog(sys.argv[1])\n"
+        "log._load()\n"
+        "log._append_batch(json.loads(sys.argv[2]))\n"
+    )
+    subprocess.run([sys.executable, "-c", script, directory, json.dumps(_records(timestamps))], cwd=ROOT, check=True)
+
+
+def test_limit_applies_across_overlapping_segments(tmp_path):
+    directory = str(tmp_path)
+    log = HistoryLog(directory)
+    log._load()
+    # This process's segment spans the other's, so its later records sort after the other's
+    log._append_batch(_records(range(1, 11)) + _records(range(100, 111)))
+    _write_from_other_process(directory, range(11, 21))
+
+    oldest = asyncio.run(log.query(0, 1000, limit=15))
+    newest = asyncio.run(log.query(0, 1000, limit=5, newest=True))
+    everything = asyncio.run(log.query(0, 1000))
+
+    assert [r["ts"] for r in oldest] == list(range(1, 16))
+    assert [r["ts"] for r in newest] == [110, 109, 108, 107, 106]
+    assert [r["ts"] for r in everything] == list(range(1, 21)) + list(range(100, 111))
+
+
+def test_range_skips_a_segment_removed_after_the_snapshot(tmp_path):
+    directory = str(tmp_path)
+    log = HistoryLog(directory)
+    log._load()
+    log._append_batch(_records(range(1, 6)))
+    _write_from_other_process(directory, range(6, 11))
+    asyncio.run(log.query(0, 1000))
+
+    # Another process's retention removes its segment while this one still indexes it
+    removed = next(s.path for s in log._segments if any(ts >= 6 for ts, *_ in s.entries))
+    os.remove(removed)
+
+    assert [r["ts"] for r in log._range(0, 1000, -1, False)] == [1, 2, 3, 4, 5]
@@ -0,0 +1,66 @@
+import asyncio
+import json
+import uuid
+
+from app.models.judge import JudgeRunner, JudgeDefinition
+
+
+def _definition() -> JudgeDefinition:
+    return JudgeDefinition({
+        "id": f"judge-{uuid.uuid4().hex[:8]}",
+        "model": "judge-model",
+        "prompt": "Is {{prediction}} a good answer to {{reference}}?",
+        "batch_size": 4,
+    })
+
+
+def _runner(replies) -> JudgeRunner:
+    runner = JudgeRunner()
+
+    async def complete(definition, messages, user):
+        return replies(messages[-1]["content"])
+
+    runner._complete = complete
+    return runner
+
+
+def test_failed_fallback_only_fails_its_own_item():
+    tag = uuid.uuid4().hex
+
+    def replies(content):
+        if "### Item" in content:
+            # The batched reply answers a and b and leaves out the other two
+            scores = {f"a-{tag}": 1, f"b-{tag}": 0}
+            return json.dumps([
+                {"id": number, "score": scores[item.split("\n")[2]]}
+                for number, item in enumerate(content.split("### Item ")[1:], start=1)
+                if item.split("\n")[2] in scores
+            ])
+        if f"broken-{tag}" in content:
+            raise RuntimeError("judge backend failed")
+        return '{"score": 1, "reason": "fine"}'
+
+    runner = _runner(replies)
+    definition = _definition()
+    items = [{"prediction": f"{name}-{tag}", "reference": "r"} for name in ("a", "b", "broken", "d")]
+    verdicts = asyncio.run(runner.judge_many(definition, items))
+
+    assert verdicts[0]["score"] == 1.0
+    assert verdicts[1]["score"] == 0.0
+    assert "judge backend failed" in verdicts[2]["error"]
+    assert verdicts[3]["score"] == 1.0
+    assert runner.stats["fallbacks"] == 2
+
+
+def test_batchers_are_dropped_once_flushed():
+    runner = _runner(lambda content: json.dumps([{"id": i, "score": 1} for i in range(1, 5)]))
+
+    async def scenario():
+        for _ in range(3):
+            # A different definition (and user) every time, as with many short-lived jobs
+            definition = _definition()
+            await runner.judge_many(definition, [{"prediction": uuid.uuid4().hex, "reference": "r"} for _ in range(3)],
+                                    user=uuid.uuid4().hex)
+        return len(runner._batchers)
+
+    assert asyncio.run(scenario()) == 0
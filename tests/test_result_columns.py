@@ -0,0 +1,100 @@
+import asyncio
+import uuid
+
+import numpy as np
+
+from app.models import result_columns
+from app.models.result_columns import ResultColumns, bootstrap_mean_ci
+
+
+def _rows(scores):
+    return [{"row_index": i, "model": "m1", "latency_ms": 10.0, "scores": {"exact_match": s}} for i, s in enumerate(scores)]
+
+
+def test_restart_with_same_row_count_recomputes_aggregate():
+    async def scenario():
+        columns = ResultColumns(flush_rows=1000)
+        job_id = f"job-{uuid.uuid4().hex}"
+        for row in _rows([1.0, 1.0, 1.0, 1.0]):
+            await columns.append(job_id, row)
+        first = await columns.aggregate(job_id, samples=50)
+
+        # What run?restart=true does before the rows are scored again
+        await columns.delete(job_id)
+        for row in _rows([0.0, 0.0, 0.0, 0.0]):
+            await columns.append(job_id, row)
+        second = await columns.aggregate(job_id, samples=50)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first["rows"] == second["rows"] == 4
+    assert first["models"]["m1"]["metrics"]["exact_match"]["mean"] == 1.0
+    assert second["models"]["m1"]["metrics"]["exact_match"]["mean"] == 0.0
+
+
+def test_rebuild_invalidates_aggregate_and_diff():
+    async def scenario():
+        columns = ResultColumns(flush_rows=1000)
+        job_a, job_b = f"job-{uuid.uuid4().hex}", f"job-{uuid.uuid4().hex}"
+        await columns.rebuild(job_a, _rows([0.0, 0.0, 1.0]))
+        await columns.rebuild(job_b, _rows([1.0, 1.0, 1.0]))
+        before = await columns.diff(job_a, job_b, samples=50)
+        await columns.rebuild(job_b, _rows([0.0, 0.0, 1.0]))
+        after = await columns.diff(job_a, job_b, samples=50)
+        aggregate = await columns.aggregate(job_b, samples=50)
+        return before, after, aggregate
+
+    before, after, aggregate = asyncio.run(scenario())
+    assert before["pairs"][0]["metrics"]["exact_match"]["delta"] > 0
+    assert after["pairs"][0]["metrics"]["exact_match"]["delta"] == 0
+    assert aggregate["models"]["m1"]["metrics"]["exact_match"]["mean"] == 1 / 3
+
+
+def test_restart_seen_by_another_process_changes_cache_key():
+    async def scenario():
+        job_id = f"job-{uuid.uuid4().hex}"
+        reader, writer = ResultColumns(flush_rows=1000), ResultColumns(flush_rows=1000)
+        await writer.rebuild(job_id, _rows([1.0, 1.0]))
+        first = await reader.aggregate(job_id, samples=50)
+        # Another worker restarts the job; this instance's cache is never told
+        await writer.rebuild(job_id, _rows([0.0, 0.0]))
+        second = await reader.aggregate(job_id, samples=50)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first["models"]["m1"]["metrics"]["exact_match"]["mean"] == 1.0
+    assert second["models"]["m1"]["metrics"]["exact_match"]["mean"] == 0.0
+
+
+def test_bootstrap_resamples_rows_of_continuous_scores(monkeypatch):
+    # Small blocks, so the resamples are drawn over several blocks
+    monkeypatch.setattr(result_columns, "BOOTSTRAP_BLOCK_VALUES", 3000)
+    values = np.random.default_rng(0).lognormal(sigma=2.0, size=1000)
+    ci = bootstrap_mean_ci(values, 0.9, 500, np.random.default_rng(7))
+
+    # Same draws as a plain row bootstrap with the same seed
+    direct = values[np.random.default_rng(7).integers(0, values.size, size=(500, values.size))].mean(axis=1)
+    assert ci == [float(v) for v in np.quantile(direct, [0.05, 0.95])]
+
+
+def test_bootstrap_of_few_valued_scores_stays_within_their_range():
+    values = np.array([0.0] * 30 + [1.0] * 70)
+    low, high = bootstrap_mean_ci(values, 0.95, 2000, np.random.default_rng(0))
+    assert 0.0 < low < 0.7 < high < 1.0
+    assert bootstrap_mean_ci(np.full(10, 0.5), 0.95, 100, np.random.default_rng(0)) == [0.5, 0.5]
+
+
+def test_repeated_rows_without_errors_count_once():
+    async def scenario():
+        columns = ResultColumns(flush_rows=1000)
+        job_id = f"job-{uuid.uuid4().hex}"
+        # A stale worker finishing row 1 after another worker already scored it
+        for row in _rows([1.0, 1.0, 1.0, 1.0]) + _rows([1.0, 0.0])[1:]:
+            await columns.append(job_id, row)
+        return await columns.load(job_id), await columns.aggregate(job_id, samples=50)
+
+    data, aggregate = asyncio.run(scenario())
+    assert data["columns"]["row_index"].tolist() == [0, 2, 3, 1]
+    assert data["scores"]["exact_match"].tolist() == [1.0, 1.0, 1.0, 0.0]
+    assert aggregate["models"]["m1"]["metrics"]["exact_match"]["count"] == 4
+    assert aggregate["models"]["m1"]["metrics"]["exact_match"]["mean"] == 0.75
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import uuid
+
+import httpx
+
+from app.models.scheduler import scheduler
+from app.models.service import LocalLLMService
+
+
+class UpstreamStream(httpx.AsyncByteStream):
+    """An SSE chat stream that keeps generating until it is closed."""
+
+    def __init__(self):
+        self.closed = False
+
+    async def __aiter__(self):
+        for i in range(1000):
+            chunk = {"id": "c1", "object": "chat.completion.chunk", "created": 0, "model": "m1",
+                     "choices": [{"index": 0, "delta": {"content": f"t{i} "}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+            await asyncio.sleep(0.001)
+        yield b"data: [DONE]\n\n"
+
+    async def aclose(self):
+        self.closed = True
+
+
+def _service(upstream: UpstreamStream) -> LocalLLMService:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/models"):
+            return httpx.Response(200, json={"data": [{"id": "m1"}]})
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=upstream)
+
+    service = LocalLLMService()
+    backend = service.pool.primary
+    backend._http_client = httpx.AsyncClient(base_url=backend.base_url, transport=httpx.MockTransport(handler))
+    return service
+
+
+def _consume_then_disconnect(use_cache: bool, reads: int = 3):
+    upstream = UpstreamStream()
+
+    async def scenario():
+        service = _service(upstream)
+        active = scheduler.active
+        messages = [{"role": "user", "content": uuid.uuid4().hex}]
+        stream = await service.chat_completion(messages, "m1", temperature=0, stream=True, use_cache=use_cache)
+        received = 0
+        while received < reads:
+            await stream.__anext__()
+            received += 1
+        # What the SSE response does when the client goes away
+        await stream.aclose()
+        state = (upstream.closed, service.pool.primary.outstanding, scheduler.active - active)
+        await service.aclose()
+        return state
+
+    return asyncio.run(scenario())
+
+
+def test_cached_stream_closes_upstream_on_disconnect():
+    closed, outstanding, held = _consume_then_disconnect(use_cache=True)
+    assert closed
+    assert outstanding == 0
+    assert held == 0
+
+
+def test_plain_stream_closes_upstream_on_disconnect():
+    closed, outstanding, held = _consume_then_disconnect(use_cache=False)
+    assert closed
+    assert outstanding == 0
+    assert held == 0
+
+
+def test_stream_closed_before_first_read_releases_its_slot():
+    for use_cache in (True, False):
+        closed, outstanding, held = _consume_then_disconnect(use_cache, reads=0)
+        assert closed
+        assert outstanding == 0
+        assert held == 0
@@ -0,0 +1,20 @@
+import asyncio
+import uuid
+
+from app.models.templates_store import templates_store
+
+
+def test_concurrent_saves_get_distinct_versions():
+    template_id = f"tpl-{uuid.uuid4().hex[:8]}"
+
+    async def scenario():
+        saved = await asyncio.gather(*[
+            templates_store.save_template({"id": template_id, "name": f"v{i}", "content": "Hi {{name}}"})
+            for i in range(5)
+        ])
+        return saved, await templates_store.get_template(template_id)
+
+    saved, stored = asyncio.run(scenario())
+    assert sorted(t["version"] for t in saved) == [1, 2, 3, 4, 5]
+    assert stored["version"] == 5
+    assert stored["variables"] == ["name"]
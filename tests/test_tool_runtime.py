@@ -0,0 +1,104 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.models.tool_runtime import ToolRuntime, ToolError, CompiledTool
+from app.models.tools_store import tools_store
+from app.routers import tools
+
+
+def _client() -> TestClient:
+    app = FastAPI()
+    app.include_router(tools.router)
+    return TestClient(app)
+
+
+def _tool(**overrides):
+    tool = {
+        "name": f"tool-{uuid.uuid4().hex[:8]}",
+        "endpoint": "http://127.0.0.1:9/echo",
+        "input_schema": {"type": "object", "properties": {"q": {"type": "string"}}},
+    }
+    tool.update(overrides)
+    return tool
+
+
+@pytest.mark.parametrize("overrides", [
+    {"input_schema": {"type": "object", "properties": {"q": {"type": "string", "pattern": "("}}}},
+    {"timeout": "soon"},
+    {"cache_ttl": "forever"},
+    {"retries": "many"},
+])
+def test_invalid_tool_is_rejected_on_save(overrides):
+    tool = _tool(**overrides)
+    with _client() as client:
+        assert client.post("/api/tools", json=tool).status_code == 400
+        assert client.put(f"/api/tools/{tool['name']}", json=tool).status_code == 400
+        assert tool["name"] not in [t["name"] for t in client.get("/api/tools").json()]
+
+
+def test_valid_tool_is_saved():
+    tool = _tool(timeout=5)
+    with _client() as client:
+        response = client.post("/api/tools", json=tool)
+        assert response.status_code == 200
+        assert tool["name"] in [t["name"] for t in client.get("/api/tools").json()]
+
+
+def test_compile_errors_are_tool_errors():
+    with pytest.raises(ToolError):
+        CompiledTool({"endpoint": "/x"})
+    with pytest.raises(ToolError):
+        CompiledTool(_tool(input_schema={"properties": {"q": {"pattern": "[a-"}}}))
+    for endpoint in ("", "   ", None, "ftp://files.test/x", "http://"):
+        with pytest.raises(ToolError):
+            CompiledTool(_tool(endpoint=endpoint))
+
+
+def test_empty_endpoint_is_rejected_on_save():
+    tool = _tool(endpoint="")
+    with _client() as client:
+        assert client.post("/api/tools", json=tool).status_code == 400
+
+
+def test_undecodable_response_is_a_failed_call():
+    tool = _tool(endpoint="http://tools.test/echo")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers={"content-encoding": "gzip"}, content=b"not gzip")
+
+    async def scenario():
+        await tools_store.save_tool(tool)
+        runtime = ToolRuntime()
+        runtime._clients["http://tools.test"] = httpx.AsyncClient(base_url="http://tools.test", transport=httpx.MockTransport(handler))
+        return await runtime.call(tool["name"], {"q": "x"})
+
+    result = asyncio.run(scenario())
+    assert result["ok"] is False and "failed" in result["error"]
+
+
+def test_call_returns_failure_for_stored_invalid_tool():
+    # Saved before definitions were checked (or written to the store directly)
+    tool = _tool(input_schema={"type": "object", "properties": {"q": {"type": "string", "pattern": "("}}})
+
+    async def scenario():
+        await tools_store.save_tool(tool)
+        runtime = ToolRuntime()
+        single = await runtime.call(tool["name"], {"q": "x"})
+        batch = await runtime.execute_tool_calls([
+            {"id": "call-1", "type": "function", "function": {"name": tool["name"], "arguments": '{"q": "x"}'}}
+        ])
+        return single, batch
+
+    single, batch = asyncio.run(scenario())
+    assert single["ok"] is False and "Invalid tool" in single["error"]
+    assert batch[0]["ok"] is False and batch[0]["message"]["role"] == "tool"
+
+    with _client() as client:
+        response = client.post(f"/api/tools/{tool['name']}/invoke", json={"q": "x"})
+        assert response.status_code == 200
+        assert response.json()["ok"] is False
@@ -0,0 +1,31 @@
+import asyncio
+
+from app.models.workflow_engine import CompiledWorkflow, WorkflowRun
+
+
+def _agent(node_id: str):
+    return {"id": node_id, "type": "agent", "data": {"model": "m", "prompt": "{{input}}"}}
+
+
+def test_failed_node_waits_for_cancelled_siblings():
+    plan = CompiledWorkflow({"id": "wf", "nodes": [_agent("fails"), _agent("slow")], "edges": []})
+    run = WorkflowRun(plan, "hi")
+    unwound = []
+
+    async def run_node(node_id):
+        if node_id == "fails":
+            raise RuntimeError("upstream down")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            # Cleanup that itself awaits, like closing a stream
+            await asyncio.sleep(0)
+            unwound.append(node_id)
+
+    run._run_node = run_node
+
+    async def scenario():
+        await run.execute()
+        return list(unwound)
+
+    assert asyncio.run(scenario()) == ["slow"]
@@ -0,0 +1,21 @@
+import asyncio
+import uuid
+
+from app.models.workflow_store import workflow_store
+
+_AGENT = {"id": "a", "type": "agent", "data": {"model": "m", "prompt": "{{input}}"}}
+
+
+def test_concurrent_saves_get_distinct_versions():
+    workflow_id = f"wf-{uuid.uuid4().hex[:8]}"
+
+    async def scenario():
+        saved = await asyncio.gather(*[
+            workflow_store.save_workflow({"id": workflow_id, "name": f"v{i}", "nodes": [_AGENT], "edges": []})
+            for i in range(5)
+        ])
+        return saved, await workflow_store.get_workflow(workflow_id)
+
+    saved, stored = asyncio.run(scenario())
+    assert sorted(w["version"] for w in saved) == [1, 2, 3, 4, 5]
+    assert stored["version"] == 5